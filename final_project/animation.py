@@ -0,0 +1,247 @@
+from bakery import assert_equal
+from PIL import Image as PIL_Image
+from PIL import ImageSequence
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import io
+from decoder import carrier_channels, get_color_values_range, read_binary_message, values_to_bytes
+from encoder import encode_message, pixels_needed
+from header import ALPHA, FIXED_HEADER_BYTES, FRAME_LAYOUT_VERSION, INTERLEAVED, decode_varint, encode_varint, is_binary_header
+from upload import carrier_image
+
+def split_payload(message:bytes, frame_count:int) -> list[bytes]:
+    '''
+    Splits a message into equal parts, one per frame, so every frame holds about the
+    same amount and takes about the same time to encode. A message shorter than the
+    number of frames uses fewer frames
+
+    Args:
+        message (bytes): the message to hide
+        frame_count (int): how many frames the animation has
+
+    Returns:
+        list[bytes]: the parts in frame order, at least one (which is empty for an empty message)
+    '''
+    part_size = max(1, -(-len(message) // frame_count))
+    return [message[start:start + part_size] for start in range(0, len(message), part_size)] or [b'']
+
+assert_equal([part.decode() for part in split_payload(b"abcdefg", 3)], ["abc", "def", "g"])
+assert_equal([part.decode() for part in split_payload(b"ab", 5)], ["a", "b"])
+assert_equal(split_payload(b"", 4) == [b''], True)
+
+def frame_payload(index:int, frame_count:int, part:bytes) -> bytes:
+    '''
+    Puts a frame's index and the number of frames the message takes in front of its part,
+    so the decoder knows from the first frame how many frames to read and can check
+    every frame it reads is the one it expects
+
+    Args:
+        index (int): the frame the part goes in, from 0
+        frame_count (int): how many frames the message takes
+        part (bytes): the frame's part of the message
+
+    Returns:
+        bytes: the bytes hidden in the frame, behind a FRAME_LAYOUT_VERSION header
+    '''
+    return encode_varint(index) + encode_varint(frame_count) + part
+
+def parse_frame_payload(payload:bytes) -> tuple:
+    '''
+    Undoes frame_payload
+
+    Args:
+        payload (bytes): the bytes read from a frame
+
+    Returns:
+        tuple: (index, frame count, part), or None if the varints are cut off
+    '''
+    index, index_bytes = decode_varint(payload)
+    if not index_bytes:
+        return None
+    frame_count, count_bytes = decode_varint(payload[index_bytes:])
+    if not count_bytes:
+        return None
+    return (index, frame_count, payload[index_bytes + count_bytes:])
+
+assert_equal(parse_frame_payload(frame_payload(2, 300, b"part")) == (2, 300, b"part"), True)
+assert_equal(parse_frame_payload(frame_payload(0, 1, b"")) == (0, 1, b""), True)
+assert_equal(parse_frame_payload(b"\x80"), None)
+
+def read_frames(png_file) -> tuple:
+    '''
+    Reads every frame of an animated PNG, composited the way it is shown
+
+    Args:
+        png_file: the open animated PNG file (a still PNG is read as one frame)
+
+    Returns:
+        tuple: (the frames as RGB or RGBA images, the duration of each frame in ms,
+            how many times the animation loops)
+
+    Raises:
+        ValueError: upload.PALETTE_ERROR for palette frames, which includes every GIF
+    '''
+    with PIL_Image.open(png_file) as animation:
+        loop = animation.info.get("loop", 0)
+        frames = []
+        durations = []
+        for frame in ImageSequence.Iterator(animation):
+            frames.append(carrier_image(frame.copy()))
+            durations.append(frame.info.get("duration", 0))
+    return (frames, durations, loop)
+
+def encode_frame(task:tuple) -> PIL_Image:
+    '''
+    Hides one frame's part of a message with encoder.encode_message. Runs in a worker process
+
+    Args:
+        task (tuple): the (frame, bytes from frame_payload, color channel, bit depth)
+
+    Returns:
+        PIL_Image: the frame with its part hidden in it
+    '''
+    frame, payload, color, depth = task
+    return encode_message(frame, payload, color, depth, FRAME_LAYOUT_VERSION)
+
+def encode_animation(png_file, output_file, message:bytes, color:int, depth:int=1, workers:int=None) -> int:
+    '''
+    Splits a message across the frames of an animated PNG with split_payload and hides every
+    part in its frame on a pool of worker processes, so the animation holds about as many
+    times more than a still image as it has frames, and the encoding time goes down with the
+    number of cores. Frames the message doesn't reach are saved unchanged
+
+    Args:
+        png_file: the open animated PNG file
+        output_file: the path or open file to save the encoded animated PNG to
+        message (bytes): the message to hide
+        color (int): the color channel (0=>red, 1=>green, 2=>blue, 3=>interleaved, 4=>alpha)
+        depth (int): how many of the lowest bits of each value hold the message (1 to 4)
+        workers (int): how many worker processes to use, one per CPU if None,
+                    or 1 to encode every frame in this process
+
+    Returns:
+        int: how many frames the message was split across
+
+    Raises:
+        ValueError: if a frame is too small for its part, the frames are palette images,
+            or the alpha channel is asked for and the frames have none
+    '''
+    frames, durations, loop = read_frames(png_file)
+    parts = split_payload(message, len(frames))
+    tasks = [(frames[index], frame_payload(index, len(parts), part), color, depth) for index, part in enumerate(parts)]
+    for frame, payload, color, depth in tasks:
+        if color not in carrier_channels(frame):
+            raise ValueError("This animation has no alpha channel.")
+        width, length = frame.size
+        if pixels_needed(len(payload), color, depth) > width*length:
+            raise ValueError("That message is too long for this animation.")
+    if workers == 1:
+        encoded = list(map(encode_frame, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            encoded = list(executor.map(encode_frame, tasks))
+    frames[:len(encoded)] = encoded
+    frames[0].save(output_file, format="PNG", save_all=True, append_images=frames[1:], duration=durations, loop=loop)
+    return len(parts)
+
+def read_frame_payload(frame:PIL_Image, channel_index:int) -> bytes:
+    '''
+    Reads the bytes hidden in one frame behind a FRAME_LAYOUT_VERSION header
+
+    Args:
+        frame (PIL_Image): an RGB or RGBA frame
+        channel_index (int): the color channel to read (0=>red, 1=>green, 2=>blue, 3=>interleaved, 4=>alpha)
+
+    Returns:
+        bytes: the frame_payload bytes, b'' if the frame has no frame header or no such
+            channel (alpha in an RGB frame), or None if the header claims more bytes than the frame holds
+    '''
+    if channel_index not in carrier_channels(frame):
+        return b''
+    read_values = lambda start, count: get_color_values_range(frame, channel_index, start, count)
+    fixed_header = values_to_bytes(read_values(0, FIXED_HEADER_BYTES*8))
+    if not is_binary_header(fixed_header, FRAME_LAYOUT_VERSION):
+        return b''
+    return read_binary_message(read_values, fixed_header, channel_index)
+
+def decode_animation(png_file, channel_index:int) -> bytes:
+    '''
+    Finds a message split across the frames of an animated PNG by encode_animation. The
+    first frame's header says how many frames the message takes, so only those frames are
+    decoded; the rest of the animation is never read
+
+    Args:
+        png_file: the open animated PNG file
+        channel_index (int): the color channel to read (0=>red, 1=>green, 2=>blue, 3=>interleaved, 4=>alpha)
+
+    Returns:
+        bytes: the hidden message, b'' if the first frame has none, or None if a frame is
+            missing, out of order or claims more bytes than it holds
+    '''
+    with PIL_Image.open(png_file) as animation:
+        parts = []
+        frame_count = 1
+        while len(parts) < frame_count:
+            try:
+                animation.seek(len(parts))
+            except EOFError:
+                return None
+            payload = read_frame_payload(carrier_image(animation), channel_index)
+            if not payload:
+                return payload if parts == [] else None
+            parsed = parse_frame_payload(payload)
+            if parsed is None or parsed[0] != len(parts) or (parts and parsed[1] != frame_count):
+                return None
+            index, frame_count, part = parsed
+            parts.append(part)
+    return b"".join(parts)
+
+def animation_bytes(frames:list, **options) -> bytes:
+    '''
+    Test helper. Saves frames as an animated PNG and returns the file bytes
+    '''
+    image_data = io.BytesIO()
+    frames[0].save(image_data, format="PNG", save_all=True, append_images=frames[1:], **options)
+    return image_data.getvalue()
+
+animation_test_frames = [PIL_Image.fromarray(np.random.default_rng(frame).integers(0, 256, (30, 40, 3), dtype=np.uint8), "RGB")
+                         for frame in range(5)]
+animation_test_file = io.BytesIO(animation_bytes(animation_test_frames, duration=[40, 50, 60, 70, 80], loop=3))
+animation_test_message = "split across frames ✓ ".encode("utf-8")*20
+animation_test_output = io.BytesIO()
+assert_equal(encode_animation(animation_test_file, animation_test_output, animation_test_message, 1, 2, workers=1), 5)
+animation_test_output.seek(0)
+assert_equal(decode_animation(animation_test_output, 1) == animation_test_message, True)
+animation_test_output.seek(0)
+assert_equal(decode_animation(animation_test_output, 0) == b'', True)
+animation_test_output.seek(0)
+assert_equal(decode_animation(animation_test_output, ALPHA) == b'', True)
+animation_test_output.seek(0)
+assert_equal([int(frame.info["duration"]) for frame in ImageSequence.Iterator(PIL_Image.open(animation_test_output))], [40, 50, 60, 70, 80])
+assert_equal(PIL_Image.open(animation_test_output).info["loop"], 3)
+animation_test_file.seek(0)
+animation_test_output = io.BytesIO()
+assert_equal(encode_animation(animation_test_file, animation_test_output, b"Hi", INTERLEAVED, workers=1), 2)
+animation_test_output.seek(0)
+assert_equal(decode_animation(animation_test_output, INTERLEAVED) == b"Hi", True)
+animation_test_output.seek(0)
+assert_equal(read_frames(animation_test_output)[0][4].tobytes() == animation_test_frames[4].tobytes(), True)
+animation_test_file.seek(0)
+try:
+    encode_animation(animation_test_file, io.BytesIO(), bytes(5*200), 0, workers=1)
+    animation_test_error = ''
+except ValueError as error:
+    animation_test_error = str(error)
+assert_equal(animation_test_error, "That message is too long for this animation.")
+animation_test_output = io.BytesIO(animation_bytes(animation_test_frames[:1] + [encode_frame((animation_test_frames[1], frame_payload(1, 3, b"x"), 0, 1))]))
+assert_equal(decode_animation(animation_test_output, 0) == b'', True)
+animation_test_output = io.BytesIO(animation_bytes([encode_frame((animation_test_frames[0], frame_payload(0, 3, b"x"), 0, 1)),
+                                                    encode_frame((animation_test_frames[1], frame_payload(1, 3, b"y"), 0, 1))]))
+assert_equal(decode_animation(animation_test_output, 0), None)
+animation_test_file.seek(0)
+try:
+    encode_animation(animation_test_file, io.BytesIO(), b"Hi", ALPHA, workers=1)
+    animation_test_error = ''
+except ValueError as error:
+    animation_test_error = str(error)
+assert_equal(animation_test_error, "This animation has no alpha channel.")
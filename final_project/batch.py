@@ -0,0 +1,238 @@
+from bakery import assert_equal
+from PIL import Image as PIL_Image
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+from encoder import compress_message, encode_message, pixels_needed
+from header import ALPHA, CODEC_NONE, HEADER_VERSION, INTERLEAVED, MAX_DEPTH, ROW_LAYOUT_VERSION
+from png_stream import decode_png_stream
+from upload import PALETTE_ERROR, carrier_image
+
+# Command line names for the color channels
+CHANNELS = {"red": 0, "green": 1, "blue": 2, "interleaved": INTERLEAVED, "alpha": ALPHA}
+# Command line names for the layout versions; rows can be decoded from the first scanlines alone
+LAYOUTS = {"columns": HEADER_VERSION, "rows": ROW_LAYOUT_VERSION}
+
+def find_images(folder:str) -> list[str]:
+    '''
+    Walks a folder and all of its subfolders and returns the path of every PNG file in it
+
+    Args:
+        folder (str): the folder to search
+
+    Returns:
+        list[str]: the PNG paths, sorted so every run lists them in the same order
+    '''
+    paths = []
+    for root, folders, files in os.walk(folder):
+        for file_name in files:
+            if file_name.lower().endswith(".png"):
+                paths.append(os.path.join(root, file_name))
+    return sorted(paths)
+
+def read_manifest(manifest_path:str, channel:str, depth:int, layout:str, compress:str, output_folder:str) -> list[dict]:
+    '''
+    Reads an encoding manifest. Every line is a JSON object with the "image" to encode and
+    the "message" to hide in it, and may also give its own "channel", "depth", "layout",
+    "compress" and "output" path. Relative image paths are read from the manifest's folder
+
+    Args:
+        manifest_path (str): the JSON lines manifest
+        channel (str): the channel name to use when a line doesn't give one
+        depth (int): the bit depth to use when a line doesn't give one
+        layout (str): the layout name to use when a line doesn't give one
+        compress (str): "auto" or "off", to use when a line doesn't give one
+        output_folder (str): where encoded images go when a line doesn't give an output path
+
+    Returns:
+        list[dict]: one encoding task per line, with every key filled in
+    '''
+    tasks = []
+    manifest_folder = os.path.dirname(manifest_path)
+    with open(manifest_path, encoding="utf-8") as manifest:
+        for line in manifest:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            image_path = os.path.join(manifest_folder, entry["image"])
+            tasks.append({"image": image_path,
+                          "message": entry["message"],
+                          "channel": entry.get("channel", channel),
+                          "depth": entry.get("depth", depth),
+                          "layout": entry.get("layout", layout),
+                          "compress": entry.get("compress", compress),
+                          "output": entry.get("output", os.path.join(output_folder, os.path.basename(image_path)))})
+    return tasks
+
+def decode_file(task:tuple) -> dict:
+    '''
+    Decodes the message hidden in one image file with png_stream.decode_png_stream, which
+    only reads the first scanlines of a row layout image. Runs in a worker process, so any
+    error is returned in the result instead of stopping the whole batch
+
+    Args:
+        task (tuple): the (image path, channel name) to decode
+
+    Returns:
+        dict: the image path, channel and message, or an error if the image couldn't be decoded
+    '''
+    image_path, channel = task
+    result = {"image": image_path, "channel": channel}
+    try:
+        with open(image_path, "rb") as png_file:
+            message = decode_png_stream(png_file, CHANNELS[channel])
+    except Exception as error:
+        result["error"] = str(error)
+        return result
+    if message is None:
+        result["error"] = "The header claims more bytes than the image holds."
+    else:
+        result["message"] = message.decode("utf-8", errors="replace")
+    return result
+
+def encode_file(task:dict) -> dict:
+    '''
+    Hides a message in one image file and saves the result as a PNG, compressing the
+    message first when compress is "auto" and that makes it smaller. Runs in a worker
+    process, so any error is returned in the result instead of stopping the whole batch
+
+    Args:
+        task (dict): an encoding task from read_manifest
+
+    Returns:
+        dict: the image path, output path, channel, depth and layout, or an error if the image couldn't be encoded
+    '''
+    result = {"image": task["image"], "output": task["output"], "channel": task["channel"], "depth": task["depth"],
+              "layout": task["layout"]}
+    message = task["message"].encode("utf-8")
+    codec = CODEC_NONE
+    if task["compress"] == "auto":
+        message, codec = compress_message(message)
+    result["codec"] = codec
+    try:
+        with PIL_Image.open(task["image"]) as image:
+            image = carrier_image(image)
+        width, length = image.size
+        if pixels_needed(len(message), CHANNELS[task["channel"]], task["depth"]) > width*length:
+            result["error"] = "That message is too long for this image."
+            return result
+        encoded = encode_message(image, message, CHANNELS[task["channel"]], task["depth"], LAYOUTS[task["layout"]],
+                                 codec=codec)
+        os.makedirs(os.path.dirname(task["output"]) or ".", exist_ok=True)
+        encoded.save(task["output"], "PNG")
+    except Exception as error:
+        result["error"] = str(error)
+    return result
+
+def run_tasks(function, tasks:list, output_file, workers:int, chunksize:int=0) -> int:
+    '''
+    Runs a function over every task on a pool of worker processes and writes each result
+    to the output file as a line of JSON, in the same order as the tasks. The tasks are
+    handed to the workers in chunks so tens of thousands of small images don't each pay
+    for a round trip to a worker
+
+    Args:
+        function: decode_file or encode_file
+        tasks (list): the tasks to run
+        output_file: the open text file to write the JSON lines to
+        workers (int): how many worker processes to use
+        chunksize (int): how many tasks to hand a worker at once, or 0 to pick one that
+                    gives every worker about four chunks
+
+    Returns:
+        int: how many tasks ended in an error
+    '''
+    if not chunksize:
+        chunksize = max(1, len(tasks) // (workers*4))
+    errors = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(function, tasks, chunksize=chunksize):
+            if "error" in result:
+                errors += 1
+            output_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+    return errors
+
+def main(arguments:list[str]) -> int:
+    '''
+    The command line entry point.
+        python batch.py --output results.jsonl decode FOLDER [--channel green]
+        python batch.py --output results.jsonl encode MANIFEST --output-folder FOLDER [--channel green] [--depth 1] [--layout columns] [--compress auto]
+
+    Args:
+        arguments (list[str]): the command line arguments, without the program name
+
+    Returns:
+        int: the exit status, 1 if any image failed
+    '''
+    parser = argparse.ArgumentParser(description="Hide or find messages in many PNG images at once.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes (default: one per CPU)")
+    parser.add_argument("--chunksize", type=int, default=0, help="images handed to a worker at once (default: automatic)")
+    # A file rather than standard output, since the inline tests print as each module is imported
+    parser.add_argument("--output", required=True, help="JSON lines results file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    decode_parser = commands.add_parser("decode", help="decode every PNG in a folder and its subfolders")
+    decode_parser.add_argument("folder")
+    decode_parser.add_argument("--channel", choices=CHANNELS, default="green")
+    encode_parser = commands.add_parser("encode", help="encode the images and messages listed in a JSON lines manifest")
+    encode_parser.add_argument("manifest")
+    encode_parser.add_argument("--output-folder", required=True)
+    encode_parser.add_argument("--channel", choices=CHANNELS, default="green")
+    encode_parser.add_argument("--depth", type=int, choices=range(1, MAX_DEPTH + 1), default=1)
+    encode_parser.add_argument("--layout", choices=LAYOUTS, default="columns")
+    encode_parser.add_argument("--compress", choices=["auto", "off"], default="auto")
+    options = parser.parse_args(arguments)
+    if options.command == "decode":
+        function = decode_file
+        tasks = [(image_path, options.channel) for image_path in find_images(options.folder)]
+    else:
+        function = encode_file
+        tasks = read_manifest(options.manifest, options.channel, options.depth, options.layout, options.compress,
+                              options.output_folder)
+    with open(options.output, "w", encoding="utf-8") as output_file:
+        errors = run_tasks(function, tasks, output_file, options.workers, options.chunksize)
+    return 1 if errors else 0
+
+batch_test_folder = tempfile.mkdtemp()
+os.makedirs(os.path.join(batch_test_folder, "inner"))
+PIL_Image.new("RGB", (20, 20), (10, 20, 30)).save(os.path.join(batch_test_folder, "inner", "plain.png"))
+with open(os.path.join(batch_test_folder, "notes.txt"), "w") as notes:
+    notes.write("not an image")
+with open(os.path.join(batch_test_folder, "broken.PNG"), "w") as broken:
+    broken.write("not an image either")
+with open(os.path.join(batch_test_folder, "manifest.jsonl"), "w", encoding="utf-8") as manifest:
+    manifest.write(json.dumps({"image": "inner/plain.png", "message": "Hi ✓"}) + "\n\n")
+    manifest.write(json.dumps({"image": "inner/plain.png", "message": "x"*100, "compress": "off", "output": os.path.join(batch_test_folder, "long.png")}) + "\n")
+    manifest.write(json.dumps({"image": "inner/plain.png", "message": "Hi", "channel": "interleaved", "depth": 2, "layout": "rows",
+                               "output": os.path.join(batch_test_folder, "out", "rgb.png")}) + "\n")
+batch_test_tasks = read_manifest(os.path.join(batch_test_folder, "manifest.jsonl"), "red", 1, "columns", "auto",
+                                 os.path.join(batch_test_folder, "out"))
+assert_equal([(task["channel"], task["depth"], task["layout"]) for task in batch_test_tasks],
+             [("red", 1, "columns"), ("red", 1, "columns"), ("interleaved", 2, "rows")])
+assert_equal(batch_test_tasks[0]["output"], os.path.join(batch_test_folder, "out", "plain.png"))
+assert_equal(encode_file(batch_test_tasks[0]).get("error"), None)
+assert_equal(encode_file(batch_test_tasks[1])["error"], "That message is too long for this image.")
+assert_equal(encode_file(batch_test_tasks[2]).get("error"), None)
+assert_equal(find_images(batch_test_folder), [os.path.join(batch_test_folder, "broken.PNG"),
+                                              os.path.join(batch_test_folder, "inner", "plain.png"),
+                                              os.path.join(batch_test_folder, "out", "plain.png"),
+                                              os.path.join(batch_test_folder, "out", "rgb.png")])
+assert_equal(decode_file((os.path.join(batch_test_folder, "out", "plain.png"), "red"))["message"], "Hi ✓")
+assert_equal(decode_file((os.path.join(batch_test_folder, "out", "rgb.png"), "interleaved"))["message"], "Hi")
+assert_equal(decode_file((os.path.join(batch_test_folder, "inner", "plain.png"), "red"))["message"], "")
+assert_equal("error" in decode_file((os.path.join(batch_test_folder, "broken.PNG"), "red")), True)
+PIL_Image.new("RGBA", (20, 20), (10, 20, 30, 255)).save(os.path.join(batch_test_folder, "clear.png"))
+PIL_Image.new("P", (20, 20)).save(os.path.join(batch_test_folder, "palette.png"))
+batch_test_task = dict(batch_test_tasks[0], image=os.path.join(batch_test_folder, "clear.png"), channel="alpha",
+                       output=os.path.join(batch_test_folder, "out", "clear.png"))
+assert_equal(encode_file(batch_test_task).get("error"), None)
+assert_equal(PIL_Image.open(batch_test_task["output"]).mode, "RGBA")
+assert_equal(decode_file((batch_test_task["output"], "alpha"))["message"], "Hi ✓")
+assert_equal(encode_file(dict(batch_test_task, image=os.path.join(batch_test_folder, "palette.png")))["error"], PALETTE_ERROR)
+shutil.rmtree(batch_test_folder)
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
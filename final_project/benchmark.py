@@ -0,0 +1,250 @@
+from PIL import Image as PIL_Image
+import numpy as np
+import io
+import os
+import time
+from animation import animation_bytes, encode_animation
+from decoder import decode_image_bytes
+from encoder import compress_message, encode_message, encode_message_tiled, hide_bits, hide_bytes, message_to_binary
+from header import ROW_LAYOUT_VERSION
+from keyed_order import keyed_positions
+from png_stream import decode_png_stream
+from steganalysis import analyze_image
+from upload import carrier_image
+
+def time_call(function, *args, repeat:int=3) -> float:
+    '''
+    Calls a function with the given arguments a few times and returns the
+    fastest run, so one slow run (garbage collection, other programs) doesn't
+    skew the result
+
+    Args:
+        function: the function to time
+        args: the arguments to call it with
+        repeat (int): how many times to call it
+
+    Returns:
+        float: the fastest run in seconds
+    '''
+    best = None
+    for run in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def random_image(width:int, length:int) -> PIL_Image:
+    '''
+    Builds an RGB image filled with random color values
+
+    Args:
+        width (int): the width of the image
+        length (int): the height of the image
+
+    Returns:
+        PIL_Image: the random image
+    '''
+    generator = np.random.default_rng(106)
+    return PIL_Image.fromarray(generator.integers(0, 256, (length, width, 3), dtype=np.uint8), "RGB")
+
+def benchmark_lookup_tables(message_bytes:int):
+    '''
+    Compares the per pixel hide_bits reference against the lookup table engine
+    in hide_bytes for a message of the given size and prints both timings.
+    hide_bits only walks the first column, so the image is one message tall
+
+    Args:
+        message_bytes (int): the size of the message to hide
+    '''
+    image = random_image(64, message_bytes*8)
+    message = bytes(np.random.default_rng(7).integers(32, 127, message_bytes, dtype=np.uint8))
+    bits = message_to_binary(message.decode("ascii"))
+    per_pixel = time_call(hide_bits, image, bits, 1)
+    lookup = time_call(hide_bytes, image, message, 1)
+    print(f"{message_bytes:>8} bytes  per pixel {per_pixel*1000:9.1f} ms  lookup table {lookup*1000:7.1f} ms  "
+          f"{per_pixel/lookup:6.1f}x")
+
+def benchmark_tile_scaling(megapixels:int, max_workers:int):
+    """
+    Times encode_message_tiled on a square random image of about the given size,
+    with a message that fills most of the green channel, for every thread count
+    from 1 to max_workers, and prints each against the single threaded encode_message
+
+    Args:
+        megapixels (int): the size of the image in millions of pixels
+        max_workers (int): the most threads to try
+    """
+    side = int((megapixels*1000*1000) ** 0.5)
+    image = random_image(side, side)
+    message = bytes(np.random.default_rng(7).integers(0, 256, side*side // 8 - 8, dtype=np.uint8))
+    single = time_call(encode_message, image, message, 1, repeat=1)
+    print(f"{megapixels} MP, {len(message)/(1024*1024):.1f} MB message  encode_message {single:6.2f} s")
+    for workers in range(1, max_workers + 1):
+        tiled = time_call(encode_message_tiled, image, message, 1, 1, workers, repeat=1)
+        print(f"  {workers:>3} threads  {tiled:6.2f} s  {single/tiled:5.2f}x")
+
+def decode_png_file(png_data:bytes) -> bytes:
+    """
+    Decodes the green channel message from PNG file bytes by opening the whole image
+
+    Args:
+        png_data (bytes): the PNG file
+
+    Returns:
+        bytes: the hidden message
+    """
+    with PIL_Image.open(io.BytesIO(png_data)) as image:
+        return decode_image_bytes(carrier_image(image), 1)
+
+def benchmark_stream_decode(megapixels:int):
+    """
+    Hides a short message in the row layout in a square random image of about the
+    given size and prints how long it takes to decode from the PNG file with the
+    whole image opened against png_stream reading only the first scanlines
+
+    Args:
+        megapixels (int): the size of the image in millions of pixels
+    """
+    side = int((megapixels*1000*1000) ** 0.5)
+    image_data = io.BytesIO()
+    encode_message(random_image(side, side), b"a short message", 1, 1, ROW_LAYOUT_VERSION).save(image_data, format="PNG")
+    png_data = image_data.getvalue()
+    whole = time_call(decode_png_file, png_data)
+    stream = time_call(lambda: decode_png_stream(io.BytesIO(png_data), 1))
+    print(f"{megapixels:>4} MP  whole image {whole*1000:8.1f} ms  first scanlines {stream*1000:6.1f} ms")
+
+def benchmark_keyed_positions(message_bytes:int, megapixels:int):
+    """
+    Times working out the keyed positions of a message's bits lazily with keyed_positions
+    against shuffling every position of the image with a seeded generator and keeping
+    the first ones, and prints both
+
+    Args:
+        message_bytes (int): the size of the message
+        megapixels (int): the size of the image in millions of pixels
+    """
+    total = megapixels*1000*1000
+    count = message_bytes*8
+    lazy = time_call(keyed_positions, 0, count, total, "benchmark key")
+    full = time_call(lambda: np.random.default_rng(106).permutation(total)[:count])
+    print(f"{message_bytes:>8} bytes {megapixels:>4} MP  lazy {lazy*1000:8.2f} ms  full permutation {full*1000:8.1f} ms")
+
+def log_payload(lines:int) -> bytes:
+    """
+    Builds a log-like message: timestamped lines that repeat with small changes
+
+    Args:
+        lines (int): how many log lines to write
+
+    Returns:
+        bytes: the log as UTF-8
+    """
+    levels = ["INFO", "INFO", "INFO", "WARN", "DEBUG"]
+    return "".join(f"2026-10-18 12:{line // 60 % 60:02d}:{line % 60:02d} {levels[line % 5]} worker-{line % 8} "
+                   f"handled request {line} in {line * 7 % 90} ms\n" for line in range(lines)).encode("utf-8")
+
+def benchmark_compression(lines:int):
+    """
+    Hides a log-like message raw and compressed with compress_message in an image just
+    big enough for the raw message, and prints the values each one changes and how long
+    each encode takes (compression included)
+
+    Args:
+        lines (int): how many log lines the message has
+    """
+    message = log_payload(lines)
+    side = int((len(message)*8 + 64) ** 0.5) + 1
+    image = random_image(side, side)
+
+    def compress_and_encode():
+        payload, codec = compress_message(message)
+        return encode_message(image, payload, 1, codec=codec)
+
+    payload, codec = compress_message(message)
+    raw = time_call(encode_message, image, message, 1)
+    compressed = time_call(compress_and_encode)
+    print(f"{len(message):>8} bytes  raw {len(message)*8:>8} values {raw*1000:7.1f} ms  "
+          f"compressed (codec {codec}) {len(payload)*8:>7} values {compressed*1000:7.1f} ms")
+
+def benchmark_native_load(megapixels:int):
+    """
+    Times loading an RGBA PNG and reading its green channel message the old way, converted
+    to an RGB copy, against carrier_image using it in its own mode, and prints both along
+    with the pixel bytes each keeps (the loaded image plus any converted copy)
+
+    Args:
+        megapixels (int): the size of the image in millions of pixels
+    """
+    side = int((megapixels*1000*1000) ** 0.5)
+    image_data = io.BytesIO()
+    encode_message(random_image(side, side).convert("RGBA"), b"a short message", 1).save(image_data, format="PNG",
+                                                                                         compress_level=1)
+    png_data = image_data.getvalue()
+
+    def load(convert:bool) -> bytes:
+        with PIL_Image.open(io.BytesIO(png_data)) as image:
+            return decode_image_bytes(image.convert('RGB') if convert else carrier_image(image), 1)
+
+    converted = time_call(load, True)
+    native = time_call(load, False)
+    print(f"{megapixels:>4} MP  converted {converted*1000:8.1f} ms ({side*side*7 // 2**20} MB)  "
+          f"native {native*1000:8.1f} ms ({side*side*4 // 2**20} MB)")
+
+def benchmark_frame_scaling(frames:int, megapixels:int, workers:int):
+    """
+    Splits a message that fills about an eighth of every frame across a random animated PNG
+    and prints how long encode_animation takes with one worker against the given number
+
+    Args:
+        frames (int): how many frames the animation has
+        megapixels (int): the size of each frame in millions of pixels
+        workers (int): how many worker processes to compare against one
+    """
+    side = int((megapixels*1000*1000) ** 0.5)
+    # every frame different, since identical frames are merged when an animated PNG is saved
+    png_data = animation_bytes([PIL_Image.fromarray(np.random.default_rng(frame).integers(0, 256, (side, side, 3), dtype=np.uint8), "RGB")
+                                for frame in range(frames)], duration=50, compress_level=1)
+    message = np.random.default_rng(106).integers(0, 256, frames*side*side // 64, dtype=np.uint8).tobytes()
+    single = time_call(lambda: encode_animation(io.BytesIO(png_data), io.BytesIO(), message, 1, workers=1), repeat=1)
+    parallel = time_call(lambda: encode_animation(io.BytesIO(png_data), io.BytesIO(), message, 1, workers=workers), repeat=1)
+    print(f"{frames:>3} frames {megapixels:>3} MP  1 worker {single:6.2f} s  {workers} workers {parallel:6.2f} s")
+
+def benchmark_steganalysis(megapixels:int):
+    """
+    Prints how long analyze_image takes on a random RGB image, and how many megapixels a second that is
+
+    Args:
+        megapixels (int): the image size in millions of pixels
+    """
+    side = int((megapixels*1000*1000) ** 0.5)
+    image = random_image(side, side)
+    seconds = time_call(analyze_image, image)
+    print(f"{megapixels:>4} MP  {seconds:6.3f} s  {megapixels/seconds:7.1f} MP/s")
+
+if __name__ == "__main__":
+    print("hide_bits (per pixel) vs hide_bytes (lookup tables)")
+    for size in [100, 1000, 10000]:
+        benchmark_lookup_tables(size)
+    print("encode_message vs encode_message_tiled")
+    for megapixels in [50, 100]:
+        benchmark_tile_scaling(megapixels, os.cpu_count())
+    print("decoding a short row layout message: whole image vs first scanlines")
+    for megapixels in [1, 10, 50]:
+        benchmark_stream_decode(megapixels)
+    print("keyed positions: only the bits used vs a permutation of the whole image")
+    for megapixels in [1, 100]:
+        for size in [100, 10000, 100000]:
+            benchmark_keyed_positions(size, megapixels)
+    print("loading an RGBA upload: converted to RGB vs its own mode")
+    for megapixels in [10, 40]:
+        benchmark_native_load(megapixels)
+    print("animated PNG frames: one worker vs one per CPU")
+    benchmark_frame_scaling(16, 2, os.cpu_count())
+    print("steganalysis statistics for every band of an image")
+    for megapixels in [1, 10, 40]:
+        benchmark_steganalysis(megapixels)
+    print("raw vs compressed log-like messages")
+    for lines in [10, 1000, 20000]:
+        benchmark_compression(lines)
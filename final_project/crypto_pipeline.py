@@ -0,0 +1,102 @@
+from bakery import assert_equal
+
+# The same hash settings the Crypto Corgi site uses. Its crypto_tools isn't imported; the expected
+# values in the tests below are the outputs of its encrypt_text and hash_text
+HASH_BASE = 31
+HASH_SIZE = 10**9
+# The hash is stored after the encrypted message as a big endian number this many bytes long
+HASH_BYTES = 4
+# encrypt_text marks every encrypted character below this code by putting a '~' after it
+MARKED_BELOW = 48
+MARKER = ord("~")
+
+def rotate_char_code(char_code: int, rotation: int) -> int:
+    '''
+    Takes in a printable ASCII character's code and Caesar cipher shifts it by a given rotation.
+    Copied from the Crypto Corgi project's crypto_tools, which isn't a package final_project can import
+
+    Args:
+        char_code (int): the code of a printable ASCII character
+        rotation (int): how many characters to spin around the cipher
+    Returns:
+        int: the shifted character code
+    '''
+    return (char_code + rotation - 32) % 94 + 32
+
+assert_equal(rotate_char_code(34,5),39)
+assert_equal(rotate_char_code(125,5),36)
+assert_equal(rotate_char_code(100,5),105)
+
+def encrypt_and_hash(message:str, rotation:int) -> bytes:
+    '''
+    Encrypts a message the way Crypto Corgi's crypto_tools.encrypt_text does and hashes it
+    the way its crypto_tools.hash_text does, in a single pass over its characters, writing the
+    encrypted bytes straight into one buffer instead of building lists and strings.
+    hash_text raises (index + base) to the power of every character code before taking
+    the remainder; the same sum is kept here with pow(..., HASH_SIZE) so it never grows
+
+    Args:
+        message (str): the message to hide, printable ASCII (space to '}') only
+        rotation (int): the Caesar cipher rotation
+
+    Returns:
+        bytes: the encrypted message followed by the HASH_BYTES hash of the original message
+
+    Raises:
+        ValueError: if the message has a character the cipher can't round trip
+    '''
+    payload = bytearray()
+    hash_sum = 0
+    for index, character in enumerate(message):
+        char_code = ord(character)
+        if not 32 <= char_code < MARKER:
+            raise ValueError(f"{character!r} can't be encrypted; only printable ASCII from ' ' to '}}' can")
+        encrypted_code = rotate_char_code(char_code, rotation)
+        payload.append(encrypted_code)
+        if encrypted_code < MARKED_BELOW:
+            payload.append(MARKER)
+        hash_sum += pow(index + HASH_BASE, char_code, HASH_SIZE)
+    payload += (hash_sum % HASH_SIZE).to_bytes(HASH_BYTES, "big")
+    return bytes(payload)
+
+assert_equal(encrypt_and_hash("Hello", 29)[:-HASH_BYTES].decode("ascii"), "e$~+~+~.~")
+assert_equal(encrypt_and_hash("Dragons!", 10)[:-HASH_BYTES].decode("ascii"), "N|kqyx}+~")
+assert_equal(int.from_bytes(encrypt_and_hash("western", 4)[-HASH_BYTES:], "big"), 829038716)
+assert_equal(int.from_bytes(encrypt_and_hash("Meet at the old oak, 9pm.", 4)[-HASH_BYTES:], "big"), 768942275)
+assert_equal(encrypt_and_hash("", 4) == bytes(HASH_BYTES), True)
+
+def decrypt_and_verify(payload:bytes, rotation:int) -> str:
+    '''
+    Undoes encrypt_and_hash in a single pass: decrypts the message the way
+    Crypto Corgi's crypto_tools.decrypt_text does while hashing the decrypted characters, then checks
+    the hash against the one stored after the message
+
+    Args:
+        payload (bytes): the bytes decoded out of the image
+        rotation (int): the Caesar cipher rotation the message was encrypted with
+
+    Returns:
+        str: the decrypted message, or None if it is too short to hold a hash or its hash
+            doesn't match (the message was changed, or the rotation is wrong)
+    '''
+    if len(payload) < HASH_BYTES:
+        return None
+    decrypted = bytearray()
+    hash_sum = 0
+    for encrypted_code in payload[:-HASH_BYTES]:
+        if encrypted_code == MARKER:
+            continue
+        char_code = rotate_char_code(encrypted_code, -rotation)
+        hash_sum += pow(len(decrypted) + HASH_BASE, char_code, HASH_SIZE)
+        decrypted.append(char_code)
+    if hash_sum % HASH_SIZE != int.from_bytes(payload[-HASH_BYTES:], "big"):
+        return None
+    return decrypted.decode("ascii")
+
+assert_equal(decrypt_and_verify(encrypt_and_hash("Hello", 29), 29), "Hello")
+assert_equal(decrypt_and_verify(encrypt_and_hash("Meet at the old oak, 9pm.", 4), 4), "Meet at the old oak, 9pm.")
+assert_equal(decrypt_and_verify(encrypt_and_hash("", 4), 4), "")
+assert_equal(decrypt_and_verify(encrypt_and_hash("Hello", 29), 28), None)
+assert_equal(decrypt_and_verify(b"Hallo" + encrypt_and_hash("Hello", 0)[-HASH_BYTES:], 0), None)
+assert_equal(decrypt_and_verify(b"Hi", 4), None)
+assert_equal(decrypt_and_verify(b"N|kqyx}+~" + encrypt_and_hash("Dragons!", 10)[-HASH_BYTES:], 10), "Dragons!")
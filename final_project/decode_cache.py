@@ -0,0 +1,103 @@
+from bakery import assert_equal
+from collections import OrderedDict
+import hashlib
+import time
+from header import HEADER_VERSION, KEYED_LAYOUT_VERSION
+
+def decode_key(handle:str, channel_index:int, key:str=None) -> tuple:
+    '''
+    Builds the DecodeCache key for decoding an image. A message written in order can be in any
+    of the unkeyed layouts, which the decoder tells apart by their headers, so they share
+    HEADER_VERSION; a keyed message is only found with its key, so a hash of the key is added
+
+    Args:
+        handle (str): the image store handle, the sha256 of the uploaded file
+        channel_index (int): the color channel (0=>red, 1=>green, 2=>blue, 3=>interleaved, 4=>alpha)
+        key (str): the key the message was written with, or None for a message written in order
+
+    Returns:
+        tuple: (handle, channel, layout version, key hash)
+    '''
+    if key is None:
+        return (handle, channel_index, HEADER_VERSION, '')
+    return (handle, channel_index, KEYED_LAYOUT_VERSION, hashlib.sha256(key.encode("utf-8")).hexdigest())
+
+assert_equal(decode_key("abc", 1), ("abc", 1, HEADER_VERSION, ''))
+assert_equal(decode_key("abc", 1, "key") == decode_key("abc", 1, "key"), True)
+assert_equal(decode_key("abc", 1, "key") == decode_key("abc", 1, "kez"), False)
+assert_equal(decode_key("abc", 1, "key")[2], KEYED_LAYOUT_VERSION)
+
+class DecodeCache():
+    '''
+    Keeps the result of decoding each image, so decoding the same upload again (a repeat click
+    of Decode, or the same file uploaded twice, which gets the same handle) is a dictionary
+    lookup instead of another read of the image. "No message" results (b'') and headers that
+    claim too many bytes (None) are cached too. Entries are dropped least recently used first
+    once there are more than max_entries, and are treated as missing once they are older than max_age.
+
+    Args:
+        max_entries (int): the most results to keep
+        max_age (float): how many seconds a result is kept for
+        clock: the function giving the current time in seconds, time.monotonic unless testing
+        results (OrderedDict): decode_key -> (time stored, message), least recently used first
+        hits (int): how many lookups found a result
+        misses (int): how many lookups had to decode
+    '''
+    def __init__(self, max_entries:int, max_age:float, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.clock = clock
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, cache_key:tuple) -> tuple:
+        '''
+        Looks up a decode result
+
+        Args:
+            cache_key (tuple): the key from decode_key
+
+        Returns:
+            tuple: (True, the cached message) on a hit, or (False, None) if the result
+                isn't cached or has expired
+        '''
+        if cache_key in self.results:
+            stored, message = self.results[cache_key]
+            if self.clock() - stored <= self.max_age:
+                self.results.move_to_end(cache_key)
+                self.hits += 1
+                return (True, message)
+            del self.results[cache_key]
+        self.misses += 1
+        return (False, None)
+
+    def add(self, cache_key:tuple, message:bytes):
+        '''
+        Stores a decode result, dropping the least recently used results past max_entries
+
+        Args:
+            cache_key (tuple): the key from decode_key
+            message (bytes): the decoded message, b'' for no message or None for a header
+                claiming more bytes than the image holds
+        '''
+        self.results[cache_key] = (self.clock(), message)
+        self.results.move_to_end(cache_key)
+        while len(self.results) > self.max_entries:
+            self.results.popitem(last=False)
+
+decode_cache_test_time = [0.0]
+decode_cache_test = DecodeCache(2, 60, lambda: decode_cache_test_time[0])
+assert_equal(decode_cache_test.get(decode_key("a", 0)), (False, None))
+decode_cache_test.add(decode_key("a", 0), b"Hi")
+decode_cache_test.add(decode_key("a", 1), b'')
+assert_equal(decode_cache_test.get(decode_key("a", 0))[1] == b"Hi", True)
+assert_equal(decode_cache_test.get(decode_key("a", 1))[1] == b'', True)
+decode_cache_test.add(decode_key("b", 0), None)
+assert_equal(decode_cache_test.get(decode_key("b", 0)), (True, None))
+assert_equal(decode_cache_test.get(decode_key("a", 0)), (False, None))
+assert_equal(list(decode_cache_test.results), [decode_key("a", 1), decode_key("b", 0)])
+decode_cache_test_time[0] = 61.0
+assert_equal(decode_cache_test.get(decode_key("b", 0)), (False, None))
+assert_equal(list(decode_cache_test.results), [decode_key("a", 1)])
+assert_equal((decode_cache_test.hits, decode_cache_test.misses), (3, 3))
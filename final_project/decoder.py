@@ -1,8 +1,10 @@
 from bakery import assert_equal
 from PIL import Image as PIL_Image
-import tkinter as tk
-from tkinter import filedialog
-import os
+import numpy as np
+import lzma
+import zlib
+from keyed_order import keyed_positions
+from header import ALPHA, CODEC_LZMA, CODEC_NONE, CODEC_ZLIB, FIXED_HEADER_BYTES, HEADER_VERSION, INTERLEAVED, KEYED_LAYOUT_VERSION, LZMA_FILTERS, MAX_LENGTH_BYTES, ROW_LAYOUT_VERSION, build_flags, build_header, decode_varint, flags_codec, flags_depth, flags_match_channel, channel_band, is_binary_header
 
 def even_or_odd_bit(num:int) -> str:
     '''
@@ -26,6 +28,43 @@ assert_equal(even_or_odd_bit(255),"1")
 assert_equal(even_or_odd_bit(0),"0")
 assert_equal(even_or_odd_bit(44),"0")
 
+# PARITY_TABLE[value] is even_or_odd_bit(value) as an int, so the parity of a
+# whole buffer of color values is one table lookup
+PARITY_TABLE = np.array([int(even_or_odd_bit(value)) for value in range(256)], dtype=np.uint8)
+
+assert_equal(PARITY_TABLE[55].item(), 1)
+assert_equal(PARITY_TABLE[44].item(), 0)
+
+def values_to_bytes(color_values: list[int] | bytes, depth:int=1) -> bytes:
+    '''
+        Consumes color intensity values and returns the bytes hidden in their
+        lowest bits. With a depth of 1 that is the odd/even bit, looked up in
+        PARITY_TABLE, otherwise the lowest depth bits of every value are taken
+        with one numpy shift and mask. Every eight bits are packed into a byte,
+        most significant bit first.
+        
+        Args:
+            color_values (list[int] | bytes): the color intensity values, ideally
+                holding a multiple of eight bits
+            depth (int): how many of the lowest bits of each value to read (1 to 4)
+        
+        Returns:
+            bytes: the packed bytes, the last one padded with 0 bits if needed
+    '''
+    values = np.frombuffer(bytes(color_values), dtype=np.uint8)
+    if depth == 1:
+        return np.packbits(PARITY_TABLE[values]).tobytes()
+    shifts = np.arange(depth - 1, -1, -1, dtype=np.uint8)
+    bits = (values[:, np.newaxis] >> shifts) & 1
+    return np.packbits(bits.reshape(-1)).tobytes()
+
+assert_equal(list(values_to_bytes([46, 47, 46, 46, 47, 44, 46, 44])), [72])
+assert_equal(list(values_to_bytes(bytes([44,45,45,44,44,45,45,44,46, 47, 46, 46, 47, 44, 46, 44]))), [102, 72])
+assert_equal(list(values_to_bytes([])), [])
+assert_equal(list(values_to_bytes([3, 14, 29, 44], 2)), [0xe4])
+assert_equal(list(values_to_bytes([5, 26], 4)), [0x5a])
+assert_equal(list(values_to_bytes([2, 2, 0, 6, 4, 4], 3)), [72, 105, 0])
+
 def decode_single_char(color_values: list[int]) -> str:
     '''
         Consumes a list of integers containing eight color intensities values
@@ -37,11 +76,8 @@ def decode_single_char(color_values: list[int]) -> str:
         Returns:
             str: a string containing a single ascii character
     '''
-    byte_str = ''
     if len(color_values) == 8:
-        for num in color_values:
-            byte_str += even_or_odd_bit(num)
-        return chr(int(byte_str, 2))
+        return chr(values_to_bytes(color_values)[0])
     return ''
 
 assert_equal(decode_single_char([46, 47, 46, 46, 47, 44, 46, 44]),"H")
@@ -49,34 +85,53 @@ assert_equal(decode_single_char([44,45,45,44,44,45,45,44]),"f")
 assert_equal(decode_single_char([44,44,55,55,44,55,44,55]),"5")
 assert_equal(decode_single_char([44,44,55,44,44,44,44,55]),"!")
 
-def decode_chars(color_values: list[int], char_count:int) -> str:
+def decode_chars(color_values: list[int] | bytes, char_count:int) -> str:
     '''
-        Consumes a list of integers of color intensity values and
-        an integer representing how many characters to decode.
+        Consumes color intensity values and an integer representing how many
+        UTF-8 bytes to decode (one per character for ASCII text).
         Returns a string containing the decoded characters
         
         Args:
-            color_values (list[int]): a list containing the color intensity values
-                from the image
-            char_count (int): the number of characters to decode
+            color_values (list[int] | bytes): the color intensity values
+                from the image, as a list or the buffer from get_color_values
+            char_count (int): the number of bytes to decode
         
         Returns:
             str: a string of the decoded message
     '''
     if len(color_values) == char_count*8:
-        char_str = ''
-        for char in range(char_count):
-            char_str += decode_single_char(color_values[(8*char):(8*(char+1))])
-        return char_str
+        return values_to_bytes(color_values).decode("utf-8", errors="replace")
     return None
 
 assert_equal(decode_chars([],1),None)
 assert_equal(decode_chars([46, 47, 46, 46, 47, 44, 46, 44],1),'H')
 assert_equal(decode_chars([46, 47, 46, 46, 47, 44, 46, 44,44,45,45,44,44,45,45,44],2),'Hf')
 assert_equal(decode_chars([46, 47, 46, 46, 47, 44, 46, 44,44,45,45,44,44,45,45,44,44,44,55,55,44,55,44,55],3),'Hf5')
+assert_equal(decode_chars(bytes([46, 47, 46, 46, 47, 44, 46, 44,44,45,45,44,44,45,45,44]),2),'Hf')
+assert_equal(decode_chars([1,1,0,0,0,0,1,1,1,0,1,0,1,0,0,1],2),'\u00e9')
 
 colors = [22,22,23,23,22,22,23,22,26,26,27,27,26,27,26,27,2,42,43,43,44,44,40,42]
 
+def is_length_header(header_str: str) -> bool:
+    '''
+        Checks that the characters decoded from the old header are all plain digits 0-9.
+        str.isdigit alone also accepts digits like '²' that int can't read
+        
+        Args:
+            header_str (str): the decoded header, or None if too few values were read
+        
+        Returns:
+            bool: True if int can read the header as the message length
+    '''
+    return bool(header_str) and header_str.isascii() and header_str.isdecimal()
+
+assert_equal(is_length_header("250"), True)
+assert_equal(is_length_header("1\u00b2"), False)
+assert_equal(is_length_header("\u0663\u0664\u0665"), False)
+assert_equal(is_length_header("H5!"), False)
+assert_equal(is_length_header(""), False)
+assert_equal(is_length_header(None), False)
+
 def get_message_length(colors:list[int], header_length:int) -> int:
     '''
     Consumes a list of color intensity values and an int representing how many characters
@@ -92,7 +147,7 @@ def get_message_length(colors:list[int], header_length:int) -> int:
     '''
     if len(colors) >= header_length*8:
         header_str = decode_chars(colors[0:header_length*8], header_length)
-        if header_str.isdigit():
+        if is_length_header(header_str):
             return int(header_str)
     return 0
 
@@ -100,13 +155,15 @@ assert_equal(get_message_length([20, 254, 45, 95, 40, 90, 20, 40, 200, 254, 45,
                            95, 40, 95, 20, 45,220, 250, 45, 95, 48, 95, 24, 44], 3), 54)
 assert_equal(get_message_length(colors,3),250)
 assert_equal(get_message_length([44,44,55,55,44,55,44,44,44,44,55,55,44,44,55,44], 2), 42)
+assert_equal(get_message_length([100 + int(bit) for byte in b"1\xc2\xb2" for bit in format(byte, "08b")], 3), 0)
 
-def get_encoded_message(colors: list[int]) -> str:
+def get_encoded_message(colors: list[int] | bytes) -> str:
     '''
         Consumes a list of color intensities and returns the hidden message
     
         Args:
-            colors (list[int]): a list of color value ints with the range of 0-255
+            colors (list[int] | bytes): the color values with the range of 0-255, as a
+                list or the buffer from get_color_values
         
         Returns:
             str: a string with the decoded message
@@ -129,48 +186,472 @@ encoded_message_test = [254, 254, 255, 255, 254, 254, 254, 254,
                            254, 254, 254, 254, 254, 254, 254, 254, 
                            252]
 assert_equal(get_encoded_message(encoded_message_test), "Hi" )
+assert_equal(get_encoded_message(bytes(encoded_message_test)), "Hi" )
 
-def get_color_values(image: PIL_Image, channel_index:int) -> list[int]:
+def get_color_values(image: PIL_Image, channel_index:int) -> bytes:
+    '''
+        Consumes an image and a color channel and returns the intensity values
+        of that channel in column by column order (every y value of x=0, then x=1...).
+        The channel is pulled out as a single band and transposed in one call
+        instead of reading each pixel with getpixel, so the values come back as
+        a compact bytes object rather than a list of ints.
+        With INTERLEAVED the red, green and blue values of each pixel come one
+        after another, in the same pixel order.
+        
+        Args:
+            image (PIL_Image): the image to read the color values from
+            channel_index (int): the color channel to read (0=>red, 1=>green, 2=>blue, 3=>interleaved, 4=>alpha)
+        
+        Returns:
+            bytes: the color intensity values of the channel, one byte per value
+    '''
+    if channel_index == INTERLEAVED:
+        return np.asarray(image)[:, :, :3].transpose(1, 0, 2).tobytes()
+    channel = image.getchannel(channel_band(channel_index))
+    return channel.transpose(PIL_Image.Transpose.TRANSPOSE).tobytes()
+
+test_image = PIL_Image.frombytes("RGB", (2, 3), bytes(range(18)))
+assert_equal(list(get_color_values(test_image, 0)), [0, 6, 12, 3, 9, 15])
+assert_equal(list(get_color_values(test_image, 1)), [1, 7, 13, 4, 10, 16])
+assert_equal(list(get_color_values(test_image, 2)), [2, 8, 14, 5, 11, 17])
+assert_equal(list(get_color_values(test_image, INTERLEAVED)), [0, 1, 2, 6, 7, 8, 12, 13, 14, 3, 4, 5, 9, 10, 11, 15, 16, 17])
+
+def get_color_values_range(image: PIL_Image, channel_index:int, start:int, count:int,
+                           version:int=HEADER_VERSION) -> bytes:
+    '''
+        Consumes an image, a color channel, a starting position and a count and
+        returns only those color values, in the same column by column order as
+        get_color_values (or row by row for ROW_LAYOUT_VERSION). Only the columns
+        (or rows) holding the requested values are cropped out, so reading a short
+        message does not touch the rest of the image.
+        
+        Args:
+            image (PIL_Image): the image to read the color values from
+            channel_index (int): the color channel to read (0=>red, 1=>green, 2=>blue, 3=>interleaved, 4=>alpha)
+            start (int): the position of the first value in the layout's order
+            count (int): the number of values to read
+            version (int): the layout version, HEADER_VERSION or ROW_LAYOUT_VERSION
+        
+        Returns:
+            bytes: up to count color values, fewer if the image runs out of pixels
+    '''
     width, length = image.size
-    color_list = []
-    for x in range(width):
-        for y in range(length):
-            red, green, blue = image.getpixel((x,y))
-            if not channel_index:
-                color_list.append(red)
-            elif channel_index == 1:
-                color_list.append(green)
+    if version == ROW_LAYOUT_VERSION:
+        values_per_row = width*3 if channel_index == INTERLEAVED else width
+        first_row = start // values_per_row
+        last_row = min(length, (start + count + values_per_row - 1) // values_per_row)
+        if count <= 0 or first_row >= last_row:
+            return b''
+        rows = np.asarray(image.crop((0, first_row, width, last_row)))
+        values = (rows[:, :, :3] if channel_index == INTERLEAVED else rows[:, :, channel_band(channel_index)]).tobytes()
+        offset = start - first_row*values_per_row
+        return values[offset:offset+count]
+    values_per_column = length*3 if channel_index == INTERLEAVED else length
+    first_column = start // values_per_column
+    last_column = min(width, (start + count + values_per_column - 1) // values_per_column)
+    if count <= 0 or first_column >= last_column:
+        return b''
+    columns = image.crop((first_column, 0, last_column, length))
+    values = get_color_values(columns, channel_index)
+    offset = start - first_column*values_per_column
+    return values[offset:offset+count]
+
+assert_equal(list(get_color_values_range(test_image, 0, 0, 6)), [0, 6, 12, 3, 9, 15])
+assert_equal(list(get_color_values_range(test_image, 1, 2, 2)), [13, 4])
+assert_equal(list(get_color_values_range(test_image, 2, 4, 5)), [11, 17])
+assert_equal(list(get_color_values_range(test_image, 2, 6, 1)), [])
+assert_equal(list(get_color_values_range(test_image, INTERLEAVED, 7, 5)), [13, 14, 3, 4, 5])
+assert_equal(list(get_color_values_range(test_image, INTERLEAVED, 16, 5)), [16, 17])
+assert_equal(list(get_color_values_range(test_image, 0, 1, 4, ROW_LAYOUT_VERSION)), [3, 6, 9, 12])
+assert_equal(list(get_color_values_range(test_image, 2, 5, 4, ROW_LAYOUT_VERSION)), [17])
+assert_equal(list(get_color_values_range(test_image, INTERLEAVED, 4, 5, ROW_LAYOUT_VERSION)), [4, 5, 6, 7, 8])
+assert_equal(list(get_color_values_range(test_image, 1, 6, 1, ROW_LAYOUT_VERSION)), [])
+
+def get_keyed_values(pixels: np.ndarray, channel_index:int, start:int, count:int, key:str) -> bytes:
+    '''
+        Consumes the pixel array of an image, a color channel, a starting position,
+        a count and a key and returns the color values at those positions of the
+        keyed order, picked out of the array by fancy indexing. Only the positions
+        asked for are worked out, never the order of the whole image.
+        
+        Args:
+            pixels (np.ndarray): the (height, width, 3 or 4) pixel array of the image
+            channel_index (int): the color channel to read (0=>red, 1=>green, 2=>blue, 3=>interleaved, 4=>alpha)
+            start (int): the position of the first value in the keyed order
+            count (int): the number of values to read
+            key (str): the key the message was written with
+        
+        Returns:
+            bytes: up to count color values, fewer if the image runs out of pixels
+    '''
+    values = pixels[:, :, :3] if channel_index == INTERLEAVED else pixels[:, :, channel_band(channel_index)]
+    count = max(0, min(count, values.size - start))
+    positions = keyed_positions(start, count, values.size, key)
+    pixel_positions = positions // 3 if channel_index == INTERLEAVED else positions
+    length = values.shape[0]
+    targets = (pixel_positions % length, pixel_positions // length)
+    if channel_index == INTERLEAVED:
+        targets += (positions % 3,)
+    return values[targets].tobytes()
+
+keyed_test_pixels = np.arange(2*3*3, dtype=np.uint8).reshape(3, 2, 3)
+assert_equal(sorted(get_keyed_values(keyed_test_pixels, 0, 0, 6, "key")), [0, 3, 6, 9, 12, 15])
+assert_equal(sorted(get_keyed_values(keyed_test_pixels, INTERLEAVED, 0, 20, "key")), list(range(18)))
+assert_equal(get_keyed_values(keyed_test_pixels, 1, 2, 3, "key") == get_keyed_values(keyed_test_pixels, 1, 0, 5, "key")[2:], True)
+
+# The most bytes a compressed message may decompress to, so a tiny crafted
+# message can't expand into gigabytes
+MAX_MESSAGE_BYTES = 64*1024*1024
+
+def decompress_message(data: bytes, codec:int) -> bytes:
+    '''
+        Undoes encoder.compress_message. Data that is corrupt, cut short or that
+        would decompress to more than MAX_MESSAGE_BYTES is not a message.
+        
+        Args:
+            data (bytes): the bytes read out of the image
+            codec (int): the codec from the header flags
+        
+        Returns:
+            bytes: the original message, or b'' if the data doesn't decompress
+    '''
+    if codec == CODEC_NONE:
+        return data
+    try:
+        if codec == CODEC_ZLIB:
+            decompressor = zlib.decompressobj()
+        else:
+            decompressor = lzma.LZMADecompressor(lzma.FORMAT_RAW, filters=LZMA_FILTERS)
+        message = decompressor.decompress(data, MAX_MESSAGE_BYTES)
+    except (zlib.error, lzma.LZMAError):
+        return b''
+    if not decompressor.eof:
+        return b''
+    return message
+
+assert_equal(decompress_message(b"plain", CODEC_NONE) == b"plain", True)
+assert_equal(decompress_message(zlib.compress(b"log line\n"*50), CODEC_ZLIB) == b"log line\n"*50, True)
+assert_equal(decompress_message(lzma.compress(b"log line\n"*50, lzma.FORMAT_RAW, filters=LZMA_FILTERS), CODEC_LZMA)
+             == b"log line\n"*50, True)
+assert_equal(decompress_message(zlib.compress(b"log line\n"*50)[:-6], CODEC_ZLIB) == b'', True)
+assert_equal(decompress_message(b"not compressed", CODEC_ZLIB) == b'', True)
+assert_equal(decompress_message(b"not compressed", CODEC_LZMA) == b'', True)
+
+def read_binary_message(read_values, fixed_header: bytes, channel_index:int) -> bytes:
+    '''
+        Reads the rest of a binary header and the message after it, once the
+        fixed header has been found. The flags have to match the channel being
+        read and give the bit depth and codec the message was written with, and
+        the varint length after them says how many bytes follow. A compressed
+        message is decompressed before it is returned.
+        
+        Args:
+            read_values: a function taking a start position and a count and returning
+                        those color values, in the layout the fixed header was read in
+            fixed_header (bytes): the magic, version and flags bytes
+            channel_index (int): the color channel being read (0=>red, 1=>green, 2=>blue, 3=>interleaved, 4=>alpha)
+        
+        Returns:
+            bytes: the hidden message, b'' if there is none, or None if the header
+                claims more bytes than the image holds
+    '''
+    flags = fixed_header[2]
+    if not flags_match_channel(flags, channel_index):
+        return b''
+    depth = flags_depth(flags)
+    length, length_bytes = decode_varint(values_to_bytes(read_values(FIXED_HEADER_BYTES*8, MAX_LENGTH_BYTES*8)))
+    if not length_bytes:
+        return b''
+    start = (FIXED_HEADER_BYTES + length_bytes)*8
+    value_count = (length*8 + depth - 1) // depth
+    message_values = read_values(start, value_count)
+    if len(message_values) < value_count:
+        return None
+    return decompress_message(values_to_bytes(message_values, depth)[:length], flags_codec(flags))
+
+def read_message_values(read_range, channel_index:int) -> bytes:
+    '''
+        Finds and reads a message written in order (not with a key) from a function
+        that returns color values. The first 24 values are read first. If they hold
+        the binary header's magic byte and version the rest is read with read_binary_message.
+        Otherwise they are checked for the old three digit header, then the first
+        24 values in row by row order are checked for a ROW_LAYOUT_VERSION header,
+        and if neither is found the image is rejected without reading further.
+        Only the values the message takes up are asked for, never the whole channel.
+        
+        Args:
+            read_range: a function taking a start position, a count and a layout version
+                        and returning those color values of the channel, like get_color_values_range
+            channel_index (int): the color channel being read (0=>red, 1=>green, 2=>blue, 3=>interleaved, 4=>alpha)
+        
+        Returns:
+            bytes: the hidden message, b'' if there is none, or None if the header
+                claims more bytes than the image holds
+    '''
+    fixed_values = read_range(0, FIXED_HEADER_BYTES*8, HEADER_VERSION)
+    fixed_header = values_to_bytes(fixed_values)
+    if is_binary_header(fixed_header):
+        return read_binary_message(lambda start, count: read_range(start, count, HEADER_VERSION),
+                                   fixed_header, channel_index)
+    header_str = decode_chars(fixed_values, FIXED_HEADER_BYTES)
+    if not is_length_header(header_str):
+        row_header = values_to_bytes(read_range(0, FIXED_HEADER_BYTES*8, ROW_LAYOUT_VERSION))
+        if not is_binary_header(row_header, ROW_LAYOUT_VERSION):
+            return b''
+        return read_binary_message(lambda start, count: read_range(start, count, ROW_LAYOUT_VERSION),
+                                   row_header, channel_index)
+    length = int(header_str)
+    message_values = read_range(FIXED_HEADER_BYTES*8, length*8, HEADER_VERSION)
+    if len(message_values) < length*8:
+        return None
+    return values_to_bytes(message_values)[:length]
+
+def decode_image_bytes(image: PIL_Image, channel_index:int, key:str=None) -> bytes:
+    '''
+        Consumes an image, a color channel and an optional key and returns the hidden message bytes.
+        With a key, only a KEYED_LAYOUT_VERSION message written with that key is looked for;
+        otherwise the message is found with read_message_values, reading only the columns
+        (or rows) it takes up.
+        
+        Args:
+            image (PIL_Image): the image the message is hidden in
+            channel_index (int): the color channel to read (0=>red, 1=>green, 2=>blue, 3=>interleaved, 4=>alpha)
+            key (str): the key the message was written with, or None for a message written in order
+        
+        Returns:
+            bytes: the hidden message, b'' if there is none, or None if the header
+                claims more bytes than the image holds
+    '''
+    if key is not None:
+        return read_keyed_message(np.asarray(image), channel_index, key)
+    return read_message_values(lambda start, count, version: get_color_values_range(image, channel_index, start, count,
+                                                                                    version), channel_index)
+
+def read_keyed_message(pixels: np.ndarray, channel_index:int, key:str) -> bytes:
+    '''
+        Reads a KEYED_LAYOUT_VERSION message written with key out of an image's pixels
+        
+        Args:
+            pixels (np.ndarray): the (length, width, 3 or 4) pixels of the image
+            channel_index (int): the color channel to read (0=>red, 1=>green, 2=>blue, 3=>interleaved, 4=>alpha)
+            key (str): the key the message was written with
+        
+        Returns:
+            bytes: the hidden message, b'' if there is none, or None if the header
+                claims more bytes than the image holds
+    '''
+    read_keyed = lambda start, count: get_keyed_values(pixels, channel_index, start, count, key)
+    keyed_header = values_to_bytes(read_keyed(0, FIXED_HEADER_BYTES*8))
+    if not is_binary_header(keyed_header, KEYED_LAYOUT_VERSION):
+        return b''
+    return read_binary_message(read_keyed, keyed_header, channel_index)
+
+def shared_line_reader(image: PIL_Image):
+    '''
+        Returns a function like get_color_values_range that reads any channel of the image
+        from one shared copy of its leading columns (or rows, for ROW_LAYOUT_VERSION). Each
+        column is converted from the image once, the first time any channel needs it, and the
+        copy grows by at least doubling, so reading every channel costs one pass over the
+        columns the longest message takes up instead of one pass per channel
+        
+        Args:
+            image (PIL_Image): the image to read the color values from
+        
+        Returns:
+            function: read_range(channel_index, start, count, version) returning up to count color values
+    '''
+    width, length = image.size
+    bands = len(image.getbands())
+    lines = {HEADER_VERSION: np.empty((0, length, bands), dtype=np.uint8),
+             ROW_LAYOUT_VERSION: np.empty((0, width, bands), dtype=np.uint8)}
+
+    def read_range(channel_index:int, start:int, count:int, version:int=HEADER_VERSION) -> bytes:
+        line_count, line_size = (length, width) if version == ROW_LAYOUT_VERSION else (width, length)
+        values_per_line = line_size*3 if channel_index == INTERLEAVED else line_size
+        first_line = start // values_per_line
+        last_line = min(line_count, (start + count + values_per_line - 1) // values_per_line)
+        if count <= 0 or first_line >= last_line:
+            return b''
+        have = len(lines[version])
+        if last_line > have:
+            grow_to = min(line_count, max(last_line, have*2))
+            if version == ROW_LAYOUT_VERSION:
+                new_lines = np.asarray(image.crop((0, have, width, grow_to)))
             else:
-                color_list.append(blue)
-    return color_list
-
-# def select_file() -> str:    
-#     '''
-#     This function asks user to select a local PNG file
-#       and returns the file name
-# 
-#     Args:
-#         None         
-#     Returns:
-#         str: the file name
-#     '''
-#     root = tk.Tk()
-#     root.withdraw()
-# 
-#     file_path = tk.filedialog.askopenfilename()
-# 
-#     while (file_path == "" or file_path[-4:] != ".png"):   
-#         print("Invalid file - must select a PNG file.")
-#         file_path = tk.filedialog.askopenfilename()
-# 
-#     file_name = os.path.basename(file_path)  #remove path 
-#     return file_name
-# 
-# file_name = select_file()    # allows user to pick an image file
-# 
-# image = PIL_Image.open(file_name).convert('RGB')  # get RGB Pillow Image format of the image file
-# 
-# # get the color intensity values where the message is hidden
-# # you must define get_color_values
-# green_vals = get_color_values(image, 1)  #use green channel
-# print("Message hidden in file: " , get_encoded_message(green_vals))
\ No newline at end of file
+                new_lines = np.asarray(image.crop((have, 0, grow_to, length))).transpose(1, 0, 2)
+            lines[version] = np.concatenate([lines[version], new_lines])
+        block = lines[version][first_line:last_line]
+        values = (block[:, :, :3] if channel_index == INTERLEAVED else block[:, :, channel_band(channel_index)]).tobytes()
+        offset = start - first_line*values_per_line
+        return values[offset:offset+count]
+
+    return read_range
+
+shared_test_read = shared_line_reader(test_image)
+assert_equal(list(shared_test_read(0, 0, 6)), [0, 6, 12, 3, 9, 15])
+assert_equal(list(shared_test_read(2, 1, 4)), list(get_color_values_range(test_image, 2, 1, 4)))
+assert_equal(list(shared_test_read(INTERLEAVED, 4, 10)), list(get_color_values_range(test_image, INTERLEAVED, 4, 10)))
+assert_equal(list(shared_test_read(1, 0, 6, ROW_LAYOUT_VERSION)), list(get_color_values_range(test_image, 1, 0, 6, ROW_LAYOUT_VERSION)))
+assert_equal(shared_test_read(1, 6, 6) == b'', True)
+
+def carrier_channels(image: PIL_Image) -> list[int]:
+    '''
+        Returns the channels a message can be hidden in for the image's mode: red, green,
+        blue and interleaved for every image, and alpha as well for an RGBA image
+        
+        Args:
+            image (PIL_Image): an RGB or RGBA image
+        
+        Returns:
+            list[int]: the channel ids
+    '''
+    if image.mode == "RGBA":
+        return [0, 1, 2, INTERLEAVED, ALPHA]
+    return [0, 1, 2, INTERLEAVED]
+
+assert_equal(carrier_channels(test_image), [0, 1, 2, INTERLEAVED])
+assert_equal(carrier_channels(test_image.convert("RGBA")), [0, 1, 2, INTERLEAVED, ALPHA])
+
+def decode_all_channels(image: PIL_Image, key:str=None) -> dict[int, bytes]:
+    '''
+        Consumes an image and an optional key and looks for a hidden message in every one
+        of its carrier_channels. The channels are checked one after another, not concurrently,
+        but every channel reads its values out of the same shared_line_reader (or the same
+        pixel array, with a key), so the image is converted once for all of them instead of
+        once per channel
+        
+        Args:
+            image (PIL_Image): the image the messages are hidden in
+            key (str): the key the messages were written with, or None for messages written in order
+        
+        Returns:
+            dict[int, bytes]: channel id -> hidden message (or None if its header claims more bytes
+                than the image holds), for every channel that has a message
+    '''
+    messages = {}
+    if key is not None:
+        pixels = np.asarray(image)
+    else:
+        read_range = shared_line_reader(image)
+    for channel_index in carrier_channels(image):
+        if key is not None:
+            message = read_keyed_message(pixels, channel_index, key)
+        else:
+            message = read_message_values(lambda start, count, version: read_range(channel_index, start, count, version),
+                                          channel_index)
+        if message != b'':
+            messages[channel_index] = message
+    return messages
+
+def decode_image(image: PIL_Image, channel_index:int, key:str=None) -> str:
+    '''
+        Consumes an image, a color channel and an optional key and returns the hidden message as
+        text. See decode_image_bytes for how the header is read.
+        
+        Args:
+            image (PIL_Image): the image the message is hidden in
+            channel_index (int): the color channel to read (0=>red, 1=>green, 2=>blue, 3=>interleaved, 4=>alpha)
+            key (str): the key the message was written with, or None for a message written in order
+        
+        Returns:
+            str: the hidden message, '' if there is none, or None if the header
+                claims more bytes than the image holds
+    '''
+    message = decode_image_bytes(image, channel_index, key)
+    if message is None:
+        return None
+    return message.decode("utf-8", errors="replace")
+
+def parity_column_image(data: bytes, width:int, length:int, channel_index:int=0) -> PIL_Image:
+    '''
+        Test helper. Builds an image whose values, read column by column,
+        hide data in their parity (100 for a 0 bit, 101 for a 1 bit) and are
+        200 after the data runs out. Data that doesn't fit is cut off
+        
+        Args:
+            data (bytes): the bytes to hide
+            width (int): the width of the image
+            length (int): the height of the image
+            channel_index (int): INTERLEAVED to spread the data over all three
+                channels, anything else puts the same values in every channel
+        
+        Returns:
+            PIL_Image: an RGB image holding the data
+    '''
+    values_per_pixel = 3 if channel_index == INTERLEAVED else 1
+    values = np.full(width*length*values_per_pixel, 200, dtype=np.uint8)
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8))[:len(values)]
+    values[:len(bits)] = bits + 100
+    if channel_index == INTERLEAVED:
+        return PIL_Image.frombytes("RGB", (length, width), values.tobytes()).transpose(PIL_Image.Transpose.TRANSPOSE)
+    columns = PIL_Image.frombytes("L", (length, width), values.tobytes()).transpose(PIL_Image.Transpose.TRANSPOSE)
+    return PIL_Image.merge("RGB", [columns, columns, columns])
+
+message_columns = bytes(value for value in encoded_message_test for channel in range(3)) + bytes((100-81)*3)
+message_image = PIL_Image.frombytes("RGB", (50, 2), message_columns).transpose(PIL_Image.Transpose.TRANSPOSE)
+assert_equal(decode_image(message_image, 0), "Hi")
+assert_equal(decode_image(test_image, 0), "")
+assert_equal(decode_image(parity_column_image(build_header(2) + b"Hi", 4, 20), 1), "Hi")
+assert_equal(decode_image(parity_column_image(build_header(300) + bytes(300), 60, 50), 2), "\x00"*300)
+assert_equal(decode_image(parity_column_image(build_header(300) + bytes(300), 4, 20), 0), None)
+assert_equal(decode_image(parity_column_image(build_header(0), 4, 20), 0), "")
+assert_equal(decode_image(parity_column_image(b"007caf\xc3\xa9!!", 4, 20), 0), "caf\u00e9!!")
+assert_equal(decode_image(parity_column_image(build_header(2, build_flags(INTERLEAVED)) + b"Hi", 4, 20), 0), "")
+assert_equal(decode_image(parity_column_image(b"\xff\xff\xff", 4, 20), 0), "")
+assert_equal(decode_image(parity_column_image(b"1\xc2\xb2Hi", 4, 20), 0), "")
+assert_equal(decode_image(parity_column_image(build_header(2, build_flags(INTERLEAVED)) + b"Hi", 4, 20), INTERLEAVED), "")
+assert_equal(decode_image(parity_column_image(build_header(3, build_flags(INTERLEAVED)) + b"Hi!", 4, 20, INTERLEAVED), INTERLEAVED), "Hi!")
+assert_equal(decode_image(parity_column_image(build_header(3, build_flags(INTERLEAVED)) + b"Hi!", 4, 20, INTERLEAVED), 0), "")
+assert_equal(decode_image(parity_column_image(build_header(2, 0x80) + b"Hi", 4, 20), 0), "")
+assert_equal(decode_image(parity_column_image(build_header(200, build_flags(INTERLEAVED)) + bytes(200), 30, 20, INTERLEAVED), INTERLEAVED), "\x00"*200)
+assert_equal(decode_image(parity_column_image(build_header(3, 0, ROW_LAYOUT_VERSION) + b"Hi!", 4, 20), 0), "")
+row_test_header = build_header(8, build_flags(1), ROW_LAYOUT_VERSION) + "rows ✓".encode("utf-8")
+row_test_image = parity_column_image(row_test_header, 20, 30, 1).transpose(PIL_Image.Transpose.TRANSPOSE)
+assert_equal(decode_image(row_test_image, 1), "rows ✓")
+assert_equal(decode_image(row_test_image, INTERLEAVED), "")
+assert_equal(decode_image(row_test_image.crop((0, 0, 30, 2)), 1), None)
+row_test_header = build_header(60, build_flags(INTERLEAVED), ROW_LAYOUT_VERSION) + b"Hi!"*20
+assert_equal(decode_image(parity_column_image(row_test_header, 20, 30, INTERLEAVED).transpose(PIL_Image.Transpose.TRANSPOSE),
+                          INTERLEAVED), "Hi!"*20)
+keyed_test_data = build_header(5, build_flags(2), KEYED_LAYOUT_VERSION) + b"Key!!"
+keyed_test_bits = np.unpackbits(np.frombuffer(keyed_test_data, dtype=np.uint8))
+keyed_test_values = np.full(20*30, 200, dtype=np.uint8)
+keyed_test_values[keyed_positions(0, len(keyed_test_bits), 20*30, "key")] = keyed_test_bits + 100
+keyed_test_columns = PIL_Image.frombytes("L", (30, 20), keyed_test_values.tobytes()).transpose(PIL_Image.Transpose.TRANSPOSE)
+keyed_test_image = PIL_Image.merge("RGB", [keyed_test_columns, keyed_test_columns, keyed_test_columns])
+assert_equal(decode_image(keyed_test_image, 2, "key"), "Key!!")
+assert_equal(decode_image(keyed_test_image, 2, "wrong key"), "")
+assert_equal(decode_image(keyed_test_image, 2), "")
+assert_equal(decode_image(keyed_test_image, INTERLEAVED, "key"), "")
+codec_test_message = "2026-10-18 INFO worker finished batch ✓\n".encode("utf-8")*40
+codec_test_payload = zlib.compress(codec_test_message)
+codec_test_image = parity_column_image(build_header(len(codec_test_payload), build_flags(0, 1, CODEC_ZLIB)) + codec_test_payload, 40, 50)
+assert_equal(decode_image(codec_test_image, 0), codec_test_message.decode("utf-8"))
+codec_test_image = parity_column_image(build_header(8, build_flags(0, 1, CODEC_LZMA)) + b"not lzma", 40, 50)
+assert_equal(decode_image(codec_test_image, 0), "")
+all_test_red = parity_column_image(build_header(3) + b"Red", 60, 50).getchannel(0)
+all_test_blue = parity_column_image(build_header(300, build_flags(2)) + bytes(300), 60, 50).getchannel(2)
+all_test_green = parity_column_image(build_header(1000, build_flags(1)), 60, 50).getchannel(1)
+all_test_messages = decode_all_channels(PIL_Image.merge("RGB", [all_test_red, all_test_green, all_test_blue]))
+assert_equal(all_test_messages[0] == b"Red", True)
+assert_equal(all_test_messages[1], None)
+assert_equal(all_test_messages[2] == bytes(300), True)
+assert_equal(sorted(all_test_messages), [0, 1, 2])
+assert_equal(decode_all_channels(test_image), {})
+assert_equal(list(decode_all_channels(row_test_image)), [0, 1, 2])
+assert_equal(decode_all_channels(keyed_test_image, "key") == {0: b"Key!!", 1: b"Key!!", 2: b"Key!!"}, True)
+assert_equal(decode_all_channels(keyed_test_image), {})
+assert_equal(decode_all_channels(codec_test_image), {})
+assert_equal(decode_all_channels(parity_column_image(build_header(3, build_flags(INTERLEAVED)) + b"Hi!", 4, 20, INTERLEAVED))
+             == {INTERLEAVED: b"Hi!"}, True)
+rgba_test_image = PIL_Image.merge("RGBA", [all_test_red, all_test_green, all_test_blue,
+                                           parity_column_image(build_header(5) + b"Alpha", 60, 50).getchannel(0)])
+assert_equal(decode_image(rgba_test_image, ALPHA), "Alpha")
+assert_equal(decode_image(rgba_test_image, 0), "Red")
+assert_equal(decode_all_channels(rgba_test_image)[ALPHA] == b"Alpha", True)
+assert_equal(decode_all_channels(rgba_test_image)[0] == b"Red", True)
+rgba_test_image = parity_column_image(build_header(3, build_flags(INTERLEAVED)) + b"Hi!", 4, 20, INTERLEAVED).convert("RGBA")
+assert_equal(decode_image(rgba_test_image, INTERLEAVED), "Hi!")
+assert_equal(decode_all_channels(rgba_test_image) == {INTERLEAVED: b"Hi!"}, True)
+assert_equal(decode_image(keyed_test_image.convert("RGBA"), 2, "key"), "Key!!")
+assert_equal(decode_image(row_test_image.convert("RGBA"), 1), "rows ✓")
@@ -1,12 +1,17 @@
 from bakery import assert_equal
 from PIL import Image as PIL_Image
-import tkinter as tk
-from tkinter import filedialog
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+import lzma
 import os
+import zlib
+from header import ALPHA, CODEC_LZMA, CODEC_NONE, CODEC_ZLIB, HEADER_VERSION, INTERLEAVED, KEYED_LAYOUT_VERSION, LZMA_FILTERS, ROW_LAYOUT_VERSION, build_flags, build_header, channel_band
+from keyed_order import keyed_positions
 
 def prepend_header(message:str) -> str:
     """
     Prepends a three digit header to the message indicating the message length
+    in UTF-8 bytes, which is the same as the number of characters for ASCII text
     
     Args:
         message (str): a string containing the message you want to prepend
@@ -14,7 +19,7 @@ def prepend_header(message:str) -> str:
     Returns:
         str: a atring containing the prepended header and the message
     """
-    message_len = len(message)
+    message_len = len(message.encode("utf-8"))
     if message_len <= 9:
         return "00" + str(message_len)+message
     elif message_len <= 99:
@@ -26,25 +31,44 @@ assert_equal(prepend_header(""),"000")
 assert_equal(prepend_header("123456789012345678901"),"021123456789012345678901")
 assert_equal(prepend_header("1234567890123456789012345678901234567890123456789012345678901234567890123456789012345678901234567890"),
              "1001234567890123456789012345678901234567890123456789012345678901234567890123456789012345678901234567890")
+assert_equal(prepend_header("caf\u00e9"),"005caf\u00e9")
+
+def prepend_binary_header(data:bytes, flags:int=0) -> bytes:
+    """
+    Prepends the binary header (magic byte, version, flags and varint length)
+    to the message bytes. Unlike prepend_header this has no 999 character cap
+    
+    Args:
+        data (bytes): the message bytes you want to prepend
+        flags (int): the embedding flags to record in the header
+    
+    Returns:
+        bytes: the header followed by the message bytes
+    """
+    return build_header(len(data), flags) + data
+
+assert_equal(list(prepend_binary_header(b"Hi")), [0xA7, 1, 0, 2, 72, 105])
+assert_equal(list(prepend_binary_header(b"")), [0xA7, 1, 0, 0])
+assert_equal(len(prepend_binary_header(bytes(2000000))), 2000000 + 6)
 
 def message_to_binary(message:str) -> str:
     """
-    Takes in a string and returns the binary string of the characters
+    Takes in a string and returns the binary string of its UTF-8 bytes.
+    Only used with the hide_bits reference implementation, hide_bytes takes
+    the packed bytes directly
     
     Args:
         message (str): the message to be converted to binary
     Returns:
         str: a binary string of "1"s and "0"s representing the message
     """
-    binary_str = ''
-    for char in message:
-        binary_str += format(ord(char), '08b')
-    return binary_str
+    return ''.join(format(byte, '08b') for byte in message.encode("utf-8"))
 
 assert_equal(message_to_binary("Hi"), "0100100001101001")
 assert_equal(message_to_binary("058"),"001100000011010100111000")
 assert_equal(message_to_binary("test"),"01110100011001010111001101110100")
 assert_equal(message_to_binary("binary101"),"011000100110100101101110011000010111001001111001001100010011000000110001")
+assert_equal(message_to_binary("\u00e9"),"1100001110101001")
 
 def new_color_value(original:int, bit:str) -> int:
     """
@@ -69,6 +93,34 @@ assert_equal(new_color_value(120,"1"),121)
 assert_equal(new_color_value(120,"0"),120)
 assert_equal(new_color_value(199,"0"),198)
 
+def build_color_tables(depth:int) -> np.ndarray:
+    """
+    Builds the lookup tables write_values uses in place of per value math.
+    Row n of the table maps every 0-255 color value to the value that holds
+    the chunk n in its lowest depth bits. The depth 1 tables (one for bit 0,
+    one for bit 1) come straight from new_color_value
+    
+    Args:
+        depth (int): how many of the lowest bits of each value hold the message (1 to 4)
+    Returns:
+        np.ndarray: a (2**depth, 256) uint8 array of encoded values
+    """
+    if depth == 1:
+        return np.array([[new_color_value(value, bit) for value in range(256)] for bit in "01"], dtype=np.uint8)
+    keep_mask = 0xFF ^ ((1 << depth) - 1)
+    return np.array([[(value & keep_mask) | chunk for value in range(256)] for chunk in range(1 << depth)],
+                    dtype=np.uint8)
+
+# COLOR_TABLES[depth] is the lookup table for that bit depth
+COLOR_TABLES = {depth: build_color_tables(depth) for depth in range(1, 5)}
+
+assert_equal(COLOR_TABLES[1][0][199].item(), 198)
+assert_equal(COLOR_TABLES[1][1][120].item(), 121)
+assert_equal(COLOR_TABLES[1][1][199].item(), 199)
+assert_equal(COLOR_TABLES[2][3][44].item(), 47)
+assert_equal(COLOR_TABLES[4][5][31].item(), 21)
+assert_equal(COLOR_TABLES[3].shape, (8, 256))
+
 def hide_bits(image:PIL_Image, bits:str, color:int) ->PIL_Image:
     """
     Consumes an image and a string of bits and encodes the
@@ -101,52 +153,351 @@ def hide_bits(image:PIL_Image, bits:str, color:int) ->PIL_Image:
             length_current += 1
     return modified_image
 
-# def get_message(max_length: int) -> str:
-#     '''
-#     Takes a max length of the message as an arg and the message using input once
-#     it's length is less than the max length
-#     
-#     Args:
-#         max_length (int): the maximum lenth of characters the message can be
-#     Returns:
-#         str: the message from the user
-#     '''
-#     message = input('Write your message here:')
-#     while len(message) > max_length:
-#         print('Message is to long, try again')
-#         message = input('Write your message here:')
-#     return message
-
-# def select_file() -> str:    
-#     '''
-#     This function asks user to select a local PNG file
-#       and returns the file name
-# 
-#     Args:
-#         None         
-#     Returns:
-#         str: the file name
-#     '''
-#     root = tk.Tk()
-#     root.withdraw()
-# 
-#     file_path = tk.filedialog.askopenfilename()
-# 
-#     while (file_path == "" or file_path[-4:] != ".png"):   
-#         print("Invalid file - must select a PNG file.")
-#         file_path = tk.filedialog.askopenfilename()
-# 
-#     file_name = os.path.basename(file_path)  #remove path 
-#     return file_name
-
-# file_name = select_file()    # allows user to pick an image file
-# 
-# image = PIL_Image.open(file_name).convert('RGB')  # get RGB Pillow Image format of the image file
-# binary_string = message_to_binary(prepend_header(get_message(999)))
-# 
-# image = hide_bits(image, binary_string,1) # encode the message into the image
-# 
-# # save the updated image with a new file name  
-# new_file_name = "1_" + file_name # format of 1 + old filename (1 represents green channel)  
-# image.save(new_file_name, "PNG")
-# print("Message hidden in file: ", new_file_name)
\ No newline at end of file
+def bytes_to_chunks(data:bytes, depth:int) -> np.ndarray:
+    """
+    Consumes message bytes and a bit depth and splits the bits of the message
+    into chunks of depth bits, most significant bit first. The last chunk is
+    padded with 0 bits
+    
+    Args:
+        data (bytes): the message bytes
+        depth (int): the number of bits per chunk (1 to 4)
+    Returns:
+        np.ndarray: a uint8 array with one chunk per value that will be changed
+    """
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+    padding = -len(bits) % depth
+    if padding:
+        bits = np.concatenate([bits, np.zeros(padding, dtype=np.uint8)])
+    place_values = (1 << np.arange(depth - 1, -1, -1)).astype(np.uint8)
+    return (bits.reshape(-1, depth) * place_values).sum(axis=1, dtype=np.uint8)
+
+assert_equal(bytes_to_chunks(b"Hi", 1).tolist(), [0, 1, 0, 0, 1, 0, 0, 0, 0, 1, 1, 0, 1, 0, 0, 1])
+assert_equal(bytes_to_chunks(b"Hi", 2).tolist(), [1, 0, 2, 0, 1, 2, 2, 1])
+assert_equal(bytes_to_chunks(b"Hi", 3).tolist(), [2, 2, 0, 6, 4, 4])
+assert_equal(bytes_to_chunks(b"Hi", 4).tolist(), [4, 8, 6, 9])
+
+def channel_view(pixels:np.ndarray, color:int) -> np.ndarray:
+    """
+    Returns the part of a (height, width, 3 or 4) pixel array a message in the given
+    color channel is written into, as a view so writing to it changes pixels. The array
+    is the image's own mode, RGB or RGBA, so nothing is converted or copied
+    
+    Args:
+        pixels (np.ndarray): the pixel array of an RGB or RGBA image
+        color (int): the color channel (0=>red, 1=>green, 2=>blue, 3=>interleaved, 4=>alpha)
+    Returns:
+        np.ndarray: the (height, width) channel, or the (height, width, 3) red, green
+            and blue values for INTERLEAVED
+    """
+    if color == INTERLEAVED:
+        return pixels[:, :, :3]
+    return pixels[:, :, channel_band(color)]
+
+def write_values(values:np.ndarray, data:bytes, start:int, depth:int=1, version:int=HEADER_VERSION,
+                 key:str=None) -> tuple:
+    """
+    Writes the message bits into the lowest depth bits of the values in the
+    array, starting at position start in column by column order (or row by
+    row order for ROW_LAYOUT_VERSION). With a key the positions are first
+    shuffled by keyed_order.keyed_positions, and the values at the shuffled
+    positions are written by fancy indexing. Every target value is looked up in
+    COLOR_TABLES in a single vectorized operation, so no per value math or
+    branching happens in Python. Changes the array
+    in place. With a (height, width, 3) array the red, green and blue values
+    of each pixel are used in turn
+    
+    Args:
+        values (np.ndarray): the array from channel_view
+        data (bytes): the bytes to be encoded, most significant bit first
+        start (int): the position of the first value to change
+        depth (int): how many of the lowest bits of each value to use (1 to 4)
+        version (int): the layout version, HEADER_VERSION or ROW_LAYOUT_VERSION
+        key (str): the key to shuffle the positions with, or None to write them in order
+    Returns:
+        tuple: the index arrays of the values that were written, one per axis of values
+    """
+    chunks = bytes_to_chunks(data, depth)
+    if key is None:
+        positions = np.arange(start, start + len(chunks))
+    else:
+        positions = keyed_positions(start, len(chunks), values.size, key)
+    pixel_positions = positions // 3 if values.ndim == 3 else positions
+    if version == ROW_LAYOUT_VERSION:
+        width = values.shape[1]
+        targets = (pixel_positions // width, pixel_positions % width)
+    else:
+        length = values.shape[0]
+        targets = (pixel_positions % length, pixel_positions // length)
+    if values.ndim == 3:
+        targets += (positions % 3,)
+    values[targets] = COLOR_TABLES[depth][chunks, values[targets]]
+    return targets
+
+def hide_bytes(image:PIL_Image, data:bytes, color:int, depth:int=1) -> PIL_Image:
+    """
+    Array backed version of hide_bits that takes the message as packed bytes.
+    The image is copied into a numpy array once, in its own mode, every target value
+    of the channel is changed in a single vectorized operation by write_values and
+    the array becomes the new image. Bits are placed in the same column by
+    column order that get_color_values reads them in. hide_bits is kept as the
+    reference implementation this is checked against.
+    With color set to INTERLEAVED the bits go into the red, green and blue
+    values of each pixel in turn, so a message takes a third of the pixels.
+    
+    Args:
+        image (PIL_Image): the image to have data encoded into
+        data (bytes): the bytes to be encoded into the image, most significant bit first
+        color (int): the color channel to encode the data into (0=>red, 1=>green, 2=>blue, 3=>interleaved, 4=>alpha)
+        depth (int): how many of the lowest bits of each value to use (1 to 4)
+    Returns:
+        PIL_Image: an image with the message encoded into it
+    """
+    pixels = np.array(image)
+    write_values(channel_view(pixels, color), data, 0, depth)
+    return PIL_Image.fromarray(pixels, image.mode)
+
+test_image = PIL_Image.frombytes("RGB", (5, 40), bytes(value % 256 for value in range(5*40*3)))
+assert_equal(hide_bytes(test_image, b"", 1).tobytes() == test_image.tobytes(), True)
+assert_equal(hide_bytes(test_image, b"Hi", 0).tobytes() ==
+             hide_bits(test_image, "0100100001101001", 0).tobytes(), True)
+assert_equal(hide_bytes(test_image, prepend_header("Hi").encode("utf-8"), 1).tobytes() ==
+             hide_bits(test_image, message_to_binary(prepend_header("Hi")), 1).tobytes(), True)
+assert_equal(hide_bytes(test_image, b"\xff\xff\xff\xff\xff", 2).tobytes() ==
+             hide_bits(test_image, "1111111111111111111111111111111111111111", 2).tobytes(), True)
+
+def hide_bits_by_column(image:PIL_Image, bits:str, color:int) -> PIL_Image:
+    """
+    Test helper. hide_bits one pixel at a time, moving to the next column after the last
+    row of a column instead of one row past it, so messages longer than a column can be
+    checked against hide_bytes
+    """
+    modified_image = image.copy()
+    width, length = modified_image.size
+    for position, bit in enumerate(bits):
+        pixel = list(modified_image.getpixel((position // length, position % length)))
+        pixel[color] = new_color_value(pixel[color], bit)
+        modified_image.putpixel((position // length, position % length), tuple(pixel))
+    return modified_image
+
+# 160 bits, four of test_image's 40 value columns
+assert_equal(hide_bytes(test_image, b"across four columns!", 0).tobytes() ==
+             hide_bits_by_column(test_image, message_to_binary("across four columns!"), 0).tobytes(), True)
+assert_equal(hide_bytes(test_image, b"\x00"*24 + b"\xff", 1).tobytes() ==
+             hide_bits_by_column(test_image, "0"*192 + "1"*8, 1).tobytes(), True)
+assert_equal(hide_bytes(test_image, b"\x00"*5 + b"\x80", 2).getpixel((1, 0))[2] % 2, 1)
+assert_equal(hide_bytes(test_image, b"\x00"*5 + b"\x80", 2).getpixel((0, 39))[2] % 2, 0)
+
+assert_equal(list(hide_bytes(test_image, b"\x80\x00\x00", INTERLEAVED).getpixel((0, 0))), [1, 0, 2])
+assert_equal(list(hide_bytes(test_image, b"\x80\x00\x00", INTERLEAVED).getpixel((0, 1))), [14, 16, 16])
+assert_equal(list(hide_bytes(test_image, b"\x00\x00\x07", INTERLEAVED).getpixel((0, 7))), [105, 107, 107])
+
+assert_equal(list(hide_bytes(test_image, b"\xe4", 0, 2).getpixel((0, 3))), [44, 46, 47])
+assert_equal([hide_bytes(test_image, b"\xe4", 0, 2).getpixel((0, y))[0] for y in range(4)], [3, 14, 29, 44])
+assert_equal([hide_bytes(test_image, b"\x5a", 1, 4).getpixel((0, y))[1] for y in range(3)], [5, 26, 31])
+
+def write_message(values:np.ndarray, message:bytes, color:int, depth:int=1, version:int=HEADER_VERSION,
+                  key:str=None, codec:int=CODEC_NONE) -> tuple:
+    """
+    Writes the message behind a binary header recording the color channel,
+    bit depth and layout into the values, in place. The header is always written one bit
+    per value so the decoder can read it before it knows the depth; the message
+    follows it at the chosen depth. With a key, the header and message are both
+    written in the keyed order and the header records KEYED_LAYOUT_VERSION
+    
+    Args:
+        values (np.ndarray): the array from channel_view
+        message (bytes): the message to hide, already compressed if codec isn't CODEC_NONE
+        color (int): the color channel the values are from (0=>red, 1=>green, 2=>blue, 3=>interleaved, 4=>alpha)
+        depth (int): how many of the lowest bits of each value hold the message (1 to 4)
+        version (int): the layout version, HEADER_VERSION or ROW_LAYOUT_VERSION
+        key (str): the key to shuffle the positions with, or None to write them in order
+        codec (int): the codec from compress_message the message was compressed with
+    Returns:
+        tuple: the index arrays of every value that was written, one per axis of values
+    """
+    if key is not None:
+        version = KEYED_LAYOUT_VERSION
+    header = build_header(len(message), build_flags(color, depth, codec), version)
+    header_targets = write_values(values, header, 0, 1, version, key)
+    message_targets = write_values(values, message, len(header)*8, depth, version, key)
+    return tuple(np.concatenate(axis) for axis in zip(header_targets, message_targets))
+
+def encode_message(image:PIL_Image, message:bytes, color:int, depth:int=1, version:int=HEADER_VERSION,
+                   key:str=None, codec:int=CODEC_NONE) -> PIL_Image:
+    """
+    Hides the message in a copy of the image with write_message
+    
+    Args:
+        image (PIL_Image): the image to have the message encoded into
+        message (bytes): the message to hide, already compressed if codec isn't CODEC_NONE
+        color (int): the color channel to encode the data into (0=>red, 1=>green, 2=>blue, 3=>interleaved, 4=>alpha)
+        depth (int): how many of the lowest bits of each value hold the message (1 to 4)
+        version (int): the layout version, HEADER_VERSION or ROW_LAYOUT_VERSION
+        key (str): the key to shuffle the positions with, or None to write them in order
+        codec (int): the codec from compress_message the message was compressed with
+    Returns:
+        PIL_Image: an image with the message encoded into it
+    """
+    pixels = np.array(image)
+    write_message(channel_view(pixels, color), message, color, depth, version, key, codec)
+    return PIL_Image.fromarray(pixels, image.mode)
+
+assert_equal(encode_message(test_image, b"Hi", 1).tobytes() ==
+             hide_bytes(test_image, prepend_binary_header(b"Hi"), 1).tobytes(), True)
+assert_equal(encode_message(test_image, b"Hi", INTERLEAVED).tobytes() ==
+             hide_bytes(test_image, prepend_binary_header(b"Hi", 1), INTERLEAVED).tobytes(), True)
+assert_equal([encode_message(test_image, b"\xff", 2, 4).getpixel((0, y))[2] for y in range(30, 34)], [196, 211, 239, 255])
+test_pixels = np.array(test_image)
+assert_equal([axis.tolist() for axis in write_message(channel_view(test_pixels, 0), b"", 0)],
+             [list(range(32)), [0]*32])
+assert_equal(test_pixels.tobytes() == encode_message(test_image, b"", 0).tobytes(), True)
+assert_equal(len(write_message(channel_view(test_pixels, INTERLEAVED), b"Hi!", INTERLEAVED, 2)[0]), 32 + 12)
+assert_equal([axis.tolist() for axis in write_values(channel_view(np.array(test_image), 1), b"\x01", 3, 1, ROW_LAYOUT_VERSION)],
+             [[0, 0, 1, 1, 1, 1, 1, 2], [3, 4, 0, 1, 2, 3, 4, 0]])
+assert_equal([axis.tolist() for axis in write_values(channel_view(np.array(test_image), INTERLEAVED), b"\x01", 12, 1, ROW_LAYOUT_VERSION)],
+             [[0, 0, 0, 1, 1, 1, 1, 1], [4, 4, 4, 0, 0, 0, 1, 1], [0, 1, 2, 0, 1, 2, 0, 1]])
+keyed_test_targets = write_message(channel_view(np.array(test_image), 2), b"Hi", 2, 1, key="key")
+assert_equal(len(set(zip(*[axis.tolist() for axis in keyed_test_targets]))), 48)
+assert_equal(keyed_test_targets[1].max().item() > 0, True)
+assert_equal([axis.tolist() for axis in keyed_test_targets] ==
+             [axis.tolist() for axis in write_message(channel_view(np.array(test_image), 2), b"Hi", 2, 1, key="key")], True)
+rgba_test_image = PIL_Image.frombytes("RGBA", (5, 40), bytes(value % 256 for value in range(5*40*4)))
+rgba_test_pixels = np.array(encode_message(rgba_test_image, b"Hi", ALPHA))
+assert_equal(encode_message(rgba_test_image, b"Hi", ALPHA).mode, "RGBA")
+assert_equal(rgba_test_pixels[:, :, :3].tobytes() == np.array(rgba_test_image)[:, :, :3].tobytes(), True)
+assert_equal(rgba_test_pixels[:, :, 3].tobytes() == np.array(encode_message(rgba_test_image.getchannel(3).convert("RGB"), b"Hi", 0))[:, :, 0].tobytes(), True)
+rgba_test_pixels = np.array(encode_message(rgba_test_image, b"Hi", INTERLEAVED, 2))
+assert_equal(rgba_test_pixels[:, :, 3].tobytes() == np.array(rgba_test_image)[:, :, 3].tobytes(), True)
+assert_equal(rgba_test_pixels[:, :, :3].tobytes() ==
+             encode_message(rgba_test_image.convert("RGB"), b"Hi", INTERLEAVED, 2).tobytes(), True)
+
+def compress_message(message:bytes) -> tuple:
+    """
+    Compresses the message with zlib and with lzma and keeps whichever is smallest,
+    or the message itself if neither makes it smaller (short or random messages)
+    
+    Args:
+        message (bytes): the message to hide
+    Returns:
+        tuple: (the bytes to hide, the codec to record in the header flags)
+    """
+    best = (message, CODEC_NONE)
+    for codec, compressed in [(CODEC_ZLIB, zlib.compress(message)),
+                              (CODEC_LZMA, lzma.compress(message, lzma.FORMAT_RAW, filters=LZMA_FILTERS))]:
+        if len(compressed) < len(best[0]):
+            best = (compressed, codec)
+    return best
+
+assert_equal(compress_message(b"Hi") == (b"Hi", CODEC_NONE), True)
+assert_equal(compress_message(b"")[1], CODEC_NONE)
+assert_equal(compress_message(b"INFO request served in 12 ms\n"*200)[1] != CODEC_NONE, True)
+assert_equal(len(compress_message(b"INFO request served in 12 ms\n"*200)[0]) < 100, True)
+assert_equal(zlib.decompress(compress_message(b"a"*50)[0]) == b"a"*50, True)
+
+def pixels_needed(data_length:int, color:int, depth:int=1) -> int:
+    """
+    Consumes the length of a message in bytes, the color channel it goes in
+    and the bit depth and returns how many pixels encode_message will change
+    
+    Args:
+        data_length (int): the number of bytes in the message
+        color (int): the color channel (0=>red, 1=>green, 2=>blue, 3=>interleaved, 4=>alpha)
+        depth (int): how many of the lowest bits of each value hold the message (1 to 4)
+    Returns:
+        int: the number of pixels, in column by column order, the message takes up
+    """
+    value_count = len(build_header(data_length))*8 + (data_length*8 + depth - 1) // depth
+    if color == INTERLEAVED:
+        return (value_count + 2) // 3
+    return value_count
+
+assert_equal(pixels_needed(2, 1), 48)
+assert_equal(pixels_needed(2, INTERLEAVED), 16)
+assert_equal(pixels_needed(300, INTERLEAVED), 814)
+assert_equal(pixels_needed(300, 0, 4), 640)
+assert_equal(pixels_needed(1, INTERLEAVED, 3), 12)
+
+def write_tile(values:np.ndarray, chunks:np.ndarray, start:int, depth:int, first_column:int, last_column:int):
+    """
+    Writes the chunks that land in one block of columns into the values, in place.
+    Only the columns of the block the chunks reach are copied out, into column by
+    column order, and the chunks are put in their lowest depth bits with in place
+    numpy bitwise operations, which release the GIL so blocks can be written on
+    several threads at once. Blocks never share a column, so they can't overlap
+    
+    Args:
+        values (np.ndarray): the array from channel_view
+        chunks (np.ndarray): every chunk of the message from bytes_to_chunks
+        start (int): the position of the first chunk, in column by column order
+        depth (int): how many of the lowest bits of each value hold the message (1 to 4)
+        first_column (int): the first column of the block
+        last_column (int): the column after the last column of the block
+    """
+    per_column = values.shape[0] * (3 if values.ndim == 3 else 1)
+    tile_start = max(start, first_column*per_column)
+    tile_end = min(start + len(chunks), last_column*per_column)
+    if tile_start >= tile_end:
+        return
+    first_column = tile_start // per_column
+    last_column = (tile_end + per_column - 1) // per_column
+    if values.ndim == 3:
+        block = values[:, first_column:last_column].transpose(1, 0, 2)
+    else:
+        block = values[:, first_column:last_column].T
+    tile = np.ascontiguousarray(block)
+    offset = tile_start - first_column*per_column
+    targets = tile.reshape(-1)[offset:offset + tile_end - tile_start]
+    np.bitwise_and(targets, np.uint8(0xFF ^ ((1 << depth) - 1)), out=targets)
+    np.bitwise_or(targets, chunks[tile_start - start:tile_end - start], out=targets)
+    block[...] = tile
+
+def encode_message_tiled(image:PIL_Image, message:bytes, color:int, depth:int=1,
+                         workers:int=None, tile_columns:int=0, codec:int=CODEC_NONE) -> PIL_Image:
+    """
+    Same result as encode_message, for very large images. The header is written
+    first, then the columns the message reaches are split into blocks of
+    tile_columns and every block is written by write_tile on a thread pool,
+    straight into one shared pixel array that becomes the output image
+    
+    Args:
+        image (PIL_Image): the image to have the message encoded into
+        message (bytes): the message to hide
+        color (int): the color channel to encode the data into (0=>red, 1=>green, 2=>blue, 3=>interleaved, 4=>alpha)
+        depth (int): how many of the lowest bits of each value hold the message (1 to 4)
+        workers (int): how many threads to use, one per CPU if None
+        tile_columns (int): how many columns each block has, or 0 to give every
+                    thread about four blocks
+        codec (int): the codec from compress_message the message was compressed with
+    Returns:
+        PIL_Image: an image with the message encoded into it
+    """
+    workers = workers or os.cpu_count()
+    pixels = np.array(image)
+    values = channel_view(pixels, color)
+    header = build_header(len(message), build_flags(color, depth, codec))
+    write_values(values, header, 0)
+    chunks = bytes_to_chunks(message, depth)
+    start = len(header)*8
+    per_column = values.shape[0] * (3 if color == INTERLEAVED else 1)
+    columns = (start + len(chunks) + per_column - 1) // per_column
+    if not tile_columns:
+        tile_columns = max(1, (columns + workers*4 - 1) // (workers*4))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda first_column: write_tile(values, chunks, start, depth, first_column,
+                                                          first_column + tile_columns),
+                          range(0, columns, tile_columns)))
+    return PIL_Image.fromarray(pixels, image.mode)
+
+tiled_test_message = "tile test ✓".encode("utf-8")
+assert_equal(encode_message_tiled(test_image, tiled_test_message, 0, 1, 3, 1).tobytes() ==
+             encode_message(test_image, tiled_test_message, 0).tobytes(), True)
+assert_equal(encode_message_tiled(test_image, tiled_test_message*2, 2, 3, 2, 2).tobytes() ==
+             encode_message(test_image, tiled_test_message*2, 2, 3).tobytes(), True)
+assert_equal(encode_message_tiled(test_image, tiled_test_message*4, INTERLEAVED, 2, 4, 1).tobytes() ==
+             encode_message(test_image, tiled_test_message*4, INTERLEAVED, 2).tobytes(), True)
+assert_equal(encode_message_tiled(test_image, b"", 1).tobytes() == encode_message(test_image, b"", 1).tobytes(), True)
+assert_equal(encode_message_tiled(rgba_test_image, tiled_test_message*4, INTERLEAVED, 2, 4, 1).tobytes() ==
+             encode_message(rgba_test_image, tiled_test_message*4, INTERLEAVED, 2).tobytes(), True)
+assert_equal(encode_message_tiled(rgba_test_image, tiled_test_message, ALPHA, 1, 3, 1).tobytes() ==
+             encode_message(rgba_test_image, tiled_test_message, ALPHA).tobytes(), True)
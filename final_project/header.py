@@ -0,0 +1,241 @@
+from bakery import assert_equal
+import lzma
+
+# Layout of the binary header written in front of every message:
+#   byte 0: HEADER_MAGIC, never an ASCII digit so it can't be confused with the old 3 digit header
+#   byte 1: the layout version, which says what order the values were written in:
+#           HEADER_VERSION (column by column), ROW_LAYOUT_VERSION (row by row) or
+#           KEYED_LAYOUT_VERSION (a keyed shuffle of the column by column positions)
+#   byte 2: flags describing how the message was embedded (0 for a plain message)
+#   byte 3+: the message length in bytes as a varint (7 bits per byte, high bit set on all but the last)
+HEADER_MAGIC = 0xA7
+HEADER_VERSION = 1
+# Row by row follows the order PNG stores pixels in, so the message can be read
+# from the first scanlines without decompressing the rest of the image
+ROW_LAYOUT_VERSION = 2
+# Keyed messages, header included, are spread over the whole image in an order only the
+# key gives, so they can't be found, or told apart from noise, by reading the first pixels
+KEYED_LAYOUT_VERSION = 3
+# One part of a message split across the frames of an animated PNG; the part starts with its
+# frame index and the number of frames the message takes, see animation.frame_payload
+FRAME_LAYOUT_VERSION = 4
+FIXED_HEADER_BYTES = 3
+MAX_LENGTH_BYTES = 4
+
+# Channel id used alongside 0=>red, 1=>green, 2=>blue for messages spread over all three
+# channels of each pixel (red, green, blue, then the next pixel)
+INTERLEAVED = 3
+# Channel id for the alpha band of an RGBA image, a fourth single channel carrier.
+# Interleaved messages only ever use red, green and blue, so RGB and RGBA images read them alike
+ALPHA = 4
+
+# Flag bits stored in byte 2 of the header. The header itself is always written one bit
+# per value; the flags describe how the message after it was written
+FLAG_INTERLEAVED = 0x01
+FLAG_DEPTH_SHIFT = 1
+FLAG_DEPTH_MASK = 0x06  # bits per value minus one, so 1 to 4 bits
+FLAG_CODEC_SHIFT = 3
+FLAG_CODEC_MASK = 0x18  # the codec the message was compressed with before it was hidden
+KNOWN_FLAGS = FLAG_INTERLEAVED | FLAG_DEPTH_MASK | FLAG_CODEC_MASK
+MAX_DEPTH = 4
+
+# Codecs recorded in the flags; the header's length is the length of the compressed message
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_LZMA = 2
+# CODEC_LZMA messages are raw LZMA2 streams, without the .xz container's headers and
+# checks, so tiny messages don't pay for them; the decoder has to use the same filters
+LZMA_FILTERS = [{"id": lzma.FILTER_LZMA2, "preset": 2}]
+
+def encode_varint(number:int) -> bytes:
+    '''
+    Consumes a non negative int and returns it as a varint, seven bits per byte
+    with the lowest bits first and the high bit set on every byte but the last
+
+    Args:
+        number (int): the number to encode
+
+    Returns:
+        bytes: the varint encoding of the number
+    '''
+    varint = bytearray()
+    while number > 0x7F:
+        varint.append((number & 0x7F) | 0x80)
+        number >>= 7
+    varint.append(number)
+    return bytes(varint)
+
+assert_equal(list(encode_varint(0)), [0])
+assert_equal(list(encode_varint(127)), [127])
+assert_equal(list(encode_varint(128)), [128, 1])
+assert_equal(list(encode_varint(300)), [172, 2])
+assert_equal(list(encode_varint(5000000)), [192, 150, 177, 2])
+
+def decode_varint(data:bytes) -> tuple[int, int]:
+    '''
+    Consumes the bytes at the start of a varint and returns the number along
+    with how many bytes it used. Returns a used count of 0 if the varint is
+    not finished within data or runs past MAX_LENGTH_BYTES
+
+    Args:
+        data (bytes): bytes starting with a varint
+
+    Returns:
+        tuple[int, int]: the decoded number and the number of bytes it took up
+    '''
+    number = 0
+    for index, byte in enumerate(data[:MAX_LENGTH_BYTES]):
+        number |= (byte & 0x7F) << (7*index)
+        if not byte & 0x80:
+            return (number, index + 1)
+    return (0, 0)
+
+assert_equal(decode_varint(bytes([0])), (0, 1))
+assert_equal(decode_varint(bytes([172, 2, 99])), (300, 2))
+assert_equal(decode_varint(bytes([192, 150, 177, 2])), (5000000, 4))
+assert_equal(decode_varint(bytes([172])), (0, 0))
+assert_equal(decode_varint(bytes([255, 255, 255, 255, 1])), (0, 0))
+
+def build_header(data_length:int, flags:int=0, version:int=HEADER_VERSION) -> bytes:
+    '''
+    Consumes the length of a message in bytes and returns the binary header
+    that goes in front of it
+
+    Args:
+        data_length (int): the number of bytes in the message
+        flags (int): the embedding flags to record in the header
+        version (int): the layout version, HEADER_VERSION, ROW_LAYOUT_VERSION or KEYED_LAYOUT_VERSION
+
+    Returns:
+        bytes: the magic byte, version, flags and varint length
+    '''
+    return bytes([HEADER_MAGIC, version, flags]) + encode_varint(data_length)
+
+assert_equal(list(build_header(2)), [HEADER_MAGIC, HEADER_VERSION, 0, 2])
+assert_equal(list(build_header(300, 1)), [HEADER_MAGIC, HEADER_VERSION, 1, 172, 2])
+assert_equal(list(build_header(2, 0, ROW_LAYOUT_VERSION)), [HEADER_MAGIC, ROW_LAYOUT_VERSION, 0, 2])
+
+def is_binary_header(fixed_header:bytes, version:int=HEADER_VERSION) -> bool:
+    '''
+    Consumes the first FIXED_HEADER_BYTES bytes read out of an image and
+    returns whether they start a binary header of the given layout version
+
+    Args:
+        fixed_header (bytes): the magic, version and flags bytes
+        version (int): the layout version the bytes were read in
+
+    Returns:
+        bool: True if the magic byte and version match
+    '''
+    return (len(fixed_header) == FIXED_HEADER_BYTES and fixed_header[0] == HEADER_MAGIC
+            and fixed_header[1] == version)
+
+assert_equal(is_binary_header(build_header(5)[:FIXED_HEADER_BYTES]), True)
+assert_equal(is_binary_header(b"005"), False)
+assert_equal(is_binary_header(bytes([HEADER_MAGIC, 9, 0])), False)
+assert_equal(is_binary_header(bytes([HEADER_MAGIC])), False)
+assert_equal(is_binary_header(build_header(5, 0, ROW_LAYOUT_VERSION)[:FIXED_HEADER_BYTES]), False)
+assert_equal(is_binary_header(build_header(5, 0, ROW_LAYOUT_VERSION)[:FIXED_HEADER_BYTES], ROW_LAYOUT_VERSION), True)
+
+def build_flags(channel:int, depth:int=1, codec:int=CODEC_NONE) -> int:
+    '''
+    Consumes a channel id, a bit depth and a codec and returns the header flags that record them
+
+    Args:
+        channel (int): 0=>red, 1=>green, 2=>blue, INTERLEAVED or ALPHA
+        depth (int): how many of the lowest bits of each value hold the message (1 to 4)
+        codec (int): CODEC_NONE, CODEC_ZLIB or CODEC_LZMA
+
+    Returns:
+        int: the flags byte for a message embedded that way
+    '''
+    flags = ((depth - 1) << FLAG_DEPTH_SHIFT) | (codec << FLAG_CODEC_SHIFT)
+    if channel == INTERLEAVED:
+        flags |= FLAG_INTERLEAVED
+    return flags
+
+assert_equal(build_flags(0), 0)
+assert_equal(build_flags(2), 0)
+assert_equal(build_flags(ALPHA), 0)
+assert_equal(build_flags(INTERLEAVED), FLAG_INTERLEAVED)
+assert_equal(build_flags(1, 4), 6)
+assert_equal(build_flags(INTERLEAVED, 2), 3)
+assert_equal(build_flags(0, 1, CODEC_LZMA), 0x10)
+
+def flags_codec(flags:int) -> int:
+    '''
+    Consumes a header flags byte and returns the codec it records
+
+    Args:
+        flags (int): the flags byte from the header
+
+    Returns:
+        int: the codec the message was compressed with (CODEC_NONE if it wasn't)
+    '''
+    return (flags & FLAG_CODEC_MASK) >> FLAG_CODEC_SHIFT
+
+assert_equal(flags_codec(build_flags(1, 3)), CODEC_NONE)
+assert_equal(flags_codec(build_flags(INTERLEAVED, 4, CODEC_ZLIB)), CODEC_ZLIB)
+assert_equal(flags_codec(build_flags(2, 1, CODEC_LZMA)), CODEC_LZMA)
+
+def flags_match_channel(flags:int, channel:int) -> bool:
+    '''
+    Consumes a header flags byte and the channel it was read from and returns
+    whether the message can be decoded from that channel. Unknown flag bits
+    or codecs mean a newer format or not a header at all, so they never match
+
+    Args:
+        flags (int): the flags byte from the header
+        channel (int): 0=>red, 1=>green, 2=>blue, INTERLEAVED or ALPHA
+
+    Returns:
+        bool: True if the flags were written for that channel
+    '''
+    if flags & ~KNOWN_FLAGS or flags_codec(flags) > CODEC_LZMA:
+        return False
+    return bool(flags & FLAG_INTERLEAVED) == (channel == INTERLEAVED)
+
+assert_equal(flags_match_channel(0, 1), True)
+assert_equal(flags_match_channel(6, 2), True)
+assert_equal(flags_match_channel(0, ALPHA), True)
+assert_equal(flags_match_channel(FLAG_INTERLEAVED, 0), False)
+assert_equal(flags_match_channel(FLAG_INTERLEAVED, INTERLEAVED), True)
+assert_equal(flags_match_channel(0, INTERLEAVED), False)
+assert_equal(flags_match_channel(0x80, 0), False)
+assert_equal(flags_match_channel(build_flags(INTERLEAVED, 2, CODEC_ZLIB), INTERLEAVED), True)
+assert_equal(flags_match_channel(FLAG_CODEC_MASK, 0), False)
+
+def flags_depth(flags:int) -> int:
+    '''
+    Consumes a header flags byte and returns the bit depth it records
+
+    Args:
+        flags (int): the flags byte from the header
+
+    Returns:
+        int: how many of the lowest bits of each value hold the message
+    '''
+    return ((flags & FLAG_DEPTH_MASK) >> FLAG_DEPTH_SHIFT) + 1
+
+assert_equal(flags_depth(0), 1)
+assert_equal(flags_depth(build_flags(INTERLEAVED, 3)), 3)
+assert_equal(flags_depth(build_flags(0, 4)), 4)
+
+def channel_band(channel:int) -> int:
+    '''
+    Consumes a single channel id and returns the index of its band in the image,
+    which is the same number for red, green and blue but 3 for ALPHA
+
+    Args:
+        channel (int): 0=>red, 1=>green, 2=>blue or ALPHA
+
+    Returns:
+        int: the band index, for getchannel or the last axis of the pixel array
+    '''
+    if channel == ALPHA:
+        return 3
+    return channel
+
+assert_equal(channel_band(0), 0)
+assert_equal(channel_band(2), 2)
+assert_equal(channel_band(ALPHA), 3)
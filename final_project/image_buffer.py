@@ -0,0 +1,292 @@
+from bakery import assert_equal
+from PIL import Image as PIL_Image
+import numpy as np
+from collections import OrderedDict
+import base64
+import io
+import logging
+import time
+import uuid
+from encoder import channel_view, pixels_needed, write_message
+from header import ALPHA, CODEC_NONE, INTERLEAVED
+
+# Modified columns are copied from the original in blocks of this many columns
+TILE_COLUMNS = 32
+
+# zlib levels for the PNG download: fast to save, or smaller to send
+COMPRESSION_LEVELS = {"Fast": 1, "Small": 9}
+
+logger = logging.getLogger(__name__)
+
+class ImageBuffer():
+    '''
+    Copy-on-write pixel storage for an image that is having messages encoded into it.
+    The original PIL image is shared and never changed; it is passed in to the methods that
+    need it rather than kept, so it can live in the image store. Messages are written in column
+    by column order starting at the first column, so only the leftmost columns a message reaches
+    are copied out of the original (in blocks of TILE_COLUMNS) and changed. Every other pixel
+    is read straight from the original when the full image is needed for a download.
+    A keyed message is spread over the whole image, so writing one copies every column.
+
+    Args:
+        columns (np.ndarray): a (height, copied columns, 3 or 4) array of the modified leftmost columns,
+                        in the original's mode (RGB or RGBA), None until the first message is written
+        changed_values (list): the index arrays (from write_message) of the values each message changed, so only
+                        those values are restored when a channel is re-encoded or cleared. Holds red, green, blue,
+                        interleaved and alpha, in that order, with None for a channel that has no message. Kept here
+                        on the server with the buffer, since numpy arrays can't be serialized into the drafter State
+        modifications (int): counts every write and restore, so saved PNGs can tell if they are stale
+        saved_png (tuple): the (modifications, compression level, base64 PNG) from the last to_png_base64
+    '''
+    def __init__(self):
+        self.columns = None
+        self.changed_values = [None, None, None, None, None]
+        self.modifications = 0
+        self.saved_png = None
+
+    def column_count(self) -> int:
+        '''
+        Returns how many of the leftmost columns have been copied out of the original
+
+        Returns:
+            int: the number of copied columns
+        '''
+        if self.columns is None:
+            return 0
+        return self.columns.shape[1]
+
+    def copy_columns(self, original:PIL_Image, needed:int):
+        '''
+        Makes sure at least the first needed columns have been copied out of the original,
+        copying only the ones that have not been copied yet
+
+        Args:
+            original (PIL_Image): the unmodified image
+            needed (int): the number of leftmost columns that are about to be written
+        '''
+        width, length = original.size
+        copied = self.column_count()
+        if needed <= copied:
+            return
+        new_count = min(width, (needed + TILE_COLUMNS - 1) // TILE_COLUMNS * TILE_COLUMNS)
+        new_columns = np.array(original.crop((copied, 0, new_count, length)))
+        if self.columns is None:
+            self.columns = new_columns
+        else:
+            self.columns = np.concatenate([self.columns, new_columns], axis=1)
+
+    def write_message(self, original:PIL_Image, message:bytes, color:int, depth:int=1, key:str=None,
+                      codec:int=CODEC_NONE) -> tuple:
+        '''
+        Writes the message with encoder.write_message into the copied columns, copying
+        more of them first if the message reaches past them (all of them for a keyed message)
+
+        Args:
+            original (PIL_Image): the unmodified image
+            message (bytes): the message to hide, already compressed if codec isn't CODEC_NONE
+            color (int): the color channel (0=>red, 1=>green, 2=>blue, 3=>interleaved, 4=>alpha)
+            depth (int): how many of the lowest bits of each value hold the message (1 to 4)
+            key (str): the key to shuffle the message's positions with, or None to write them in order
+            codec (int): the codec from encoder.compress_message the message was compressed with
+
+        Returns:
+            tuple: the index arrays of every value that was written, for restore
+        '''
+        width, length = original.size
+        if key is None:
+            self.copy_columns(original, (pixels_needed(len(message), color, depth) + length - 1) // length)
+        else:
+            self.copy_columns(original, width)
+        self.modifications += 1
+        return write_message(channel_view(self.columns, color), message, color, depth, key=key, codec=codec)
+
+    def restore(self, original:PIL_Image, color:int, changed_values:tuple):
+        '''
+        Copies the original values back over the values a message changed
+
+        Args:
+            original (PIL_Image): the unmodified image
+            color (int): the color channel the message was written in
+            changed_values (tuple): the index arrays write_message returned for the message
+        '''
+        width, length = original.size
+        self.modifications += 1
+        original_columns = np.asarray(original.crop((0, 0, self.column_count(), length)))
+        channel_view(self.columns, color)[changed_values] = channel_view(original_columns, color)[changed_values]
+
+    def to_image(self, original:PIL_Image) -> PIL_Image:
+        '''
+        Builds the full modified image: a copy of the original with the modified columns pasted in
+
+        Args:
+            original (PIL_Image): the unmodified image
+
+        Returns:
+            PIL_Image: a new image holding every message written so far
+        '''
+        image = original.copy()
+        if self.columns is not None:
+            image.paste(PIL_Image.fromarray(self.columns, original.mode), (0, 0))
+        return image
+
+    def to_png_base64(self, original:PIL_Image, compression:str) -> str:
+        '''
+        Returns the full modified image as a base64 encoded PNG for the download. The PNG is
+        only compressed again when a message has been written or restored, or the compression
+        setting changed, since the last call; otherwise the saved one is returned
+
+        Args:
+            original (PIL_Image): the unmodified image
+            compression (str): a key of COMPRESSION_LEVELS
+
+        Returns:
+            str: the base64 encoded PNG file
+        '''
+        level = COMPRESSION_LEVELS[compression]
+        if self.saved_png is not None and self.saved_png[:2] == (self.modifications, level):
+            return self.saved_png[2]
+        start = time.perf_counter()
+        image_data = io.BytesIO()
+        self.to_image(original).save(image_data, format="PNG", compress_level=level)
+        png = base64.b64encode(image_data.getvalue()).decode("ascii")
+        logger.info("Saved %dx%d PNG at compress_level %d: %d bytes in %.1f ms", *original.size, level,
+                    image_data.tell(), (time.perf_counter() - start)*1000)
+        self.saved_png = (self.modifications, level, png)
+        return png
+
+buffer_test_image = PIL_Image.frombytes("RGB", (100, 12), bytes(value % 256 for value in range(100*12*3)))
+buffer_test = ImageBuffer()
+assert_equal(buffer_test.column_count(), 0)
+assert_equal(buffer_test.changed_values, [None, None, None, None, None])
+assert_equal(buffer_test.to_image(buffer_test_image).tobytes() == buffer_test_image.tobytes(), True)
+buffer_test_changes = buffer_test.write_message(buffer_test_image, b"Hi", 1)
+assert_equal(buffer_test.column_count(), 32)
+assert_equal(buffer_test.to_image(buffer_test_image).tobytes() == buffer_test_image.tobytes(), False)
+buffer_test.copy_columns(buffer_test_image, 40)
+assert_equal(buffer_test.column_count(), 64)
+buffer_test.copy_columns(buffer_test_image, 1000)
+assert_equal(buffer_test.column_count(), 100)
+buffer_test.restore(buffer_test_image, 1, buffer_test_changes)
+assert_equal(buffer_test.to_image(buffer_test_image).tobytes() == buffer_test_image.tobytes(), True)
+buffer_test_changes = buffer_test.write_message(buffer_test_image, b"Hi", INTERLEAVED, 2)
+buffer_test.restore(buffer_test_image, INTERLEAVED, buffer_test_changes)
+assert_equal(buffer_test.to_image(buffer_test_image).tobytes() == buffer_test_image.tobytes(), True)
+buffer_test_changes = buffer_test.write_message(buffer_test_image, b"Hi", 2, 1, "key")
+assert_equal(buffer_test.to_image(buffer_test_image).tobytes() == buffer_test_image.tobytes(), False)
+buffer_test.restore(buffer_test_image, 2, buffer_test_changes)
+assert_equal(buffer_test.to_image(buffer_test_image).tobytes() == buffer_test_image.tobytes(), True)
+buffer_test_png = buffer_test.to_png_base64(buffer_test_image, "Fast")
+assert_equal(buffer_test.to_png_base64(buffer_test_image, "Fast") is buffer_test_png, True)
+assert_equal(buffer_test.to_png_base64(buffer_test_image, "Small") is buffer_test_png, False)
+buffer_test_png = buffer_test.to_png_base64(buffer_test_image, "Small")
+buffer_test.write_message(buffer_test_image, b"Hi", 0)
+assert_equal(buffer_test.to_png_base64(buffer_test_image, "Small") == buffer_test_png, False)
+assert_equal(PIL_Image.open(io.BytesIO(base64.b64decode(buffer_test.to_png_base64(buffer_test_image, "Fast")))).tobytes()
+             == buffer_test.to_image(buffer_test_image).tobytes(), True)
+buffer_test_image = buffer_test_image.convert("RGBA")
+buffer_test = ImageBuffer()
+buffer_test_changes = buffer_test.write_message(buffer_test_image, b"Hi", ALPHA)
+assert_equal(buffer_test.to_image(buffer_test_image).mode, "RGBA")
+assert_equal(np.array(buffer_test.to_image(buffer_test_image))[:, :, :3].tobytes() == np.array(buffer_test_image)[:, :, :3].tobytes(), True)
+buffer_test.restore(buffer_test_image, ALPHA, buffer_test_changes)
+assert_equal(buffer_test.to_image(buffer_test_image).tobytes() == buffer_test_image.tobytes(), True)
+
+class BufferStore():
+    '''
+    Keeps every session's ImageBuffer on the server, so the drafter State, which is serialized to
+    JSON on every request, only has to carry a short handle. Each upload gets a new random handle
+    rather than reusing the image handle, since two sessions can upload the same file and must not
+    see each other's messages. Buffers are kept in least recently used order; when their copied
+    columns and saved PNGs go over memory_budget the ones that have not been used for the longest
+    (the idle sessions) are dropped, and their sessions are sent back to the upload page.
+
+    Args:
+        memory_budget (int): the most bytes of copied columns and saved PNGs to keep
+        buffers (OrderedDict): handle -> ImageBuffer, least recently used first
+    '''
+    def __init__(self, memory_budget:int):
+        self.memory_budget = memory_budget
+        self.buffers = OrderedDict()
+
+    def new(self) -> str:
+        '''
+        Adds an empty ImageBuffer for a new upload
+
+        Returns:
+            str: the handle to get the buffer back with
+        '''
+        handle = uuid.uuid4().hex
+        self.buffers[handle] = ImageBuffer()
+        self.trim_memory(handle)
+        return handle
+
+    def get(self, handle:str) -> ImageBuffer:
+        '''
+        Returns the buffer for a handle, first dropping other buffers if the messages written
+        since the last call took the store over memory_budget
+
+        Args:
+            handle (str): the handle from new
+
+        Returns:
+            ImageBuffer: the buffer, or None if the handle is unknown or the buffer was dropped
+        '''
+        if handle not in self.buffers:
+            return None
+        self.buffers.move_to_end(handle)
+        self.trim_memory(handle)
+        return self.buffers[handle]
+
+    def remove(self, handle:str):
+        '''
+        Drops the buffer for a handle, when its session uploads a new image
+
+        Args:
+            handle (str): the handle from new, or '' for none
+        '''
+        self.buffers.pop(handle, None)
+
+    def buffer_memory(self, buffer:ImageBuffer) -> int:
+        '''
+        Returns how many bytes a buffer holds
+
+        Args:
+            buffer (ImageBuffer): the buffer
+
+        Returns:
+            int: the bytes of its copied columns and its saved PNG
+        '''
+        total = 0
+        if buffer.columns is not None:
+            total += buffer.columns.nbytes
+        if buffer.saved_png is not None:
+            total += len(buffer.saved_png[2])
+        return total
+
+    def trim_memory(self, keep:str):
+        '''
+        Drops the least recently used buffers until the store is under memory_budget,
+        never dropping the buffer that was just asked for
+
+        Args:
+            keep (str): the handle that must stay in the store
+        '''
+        used = sum(self.buffer_memory(buffer) for buffer in self.buffers.values())
+        for handle in list(self.buffers):
+            if used <= self.memory_budget:
+                return
+            if handle != keep:
+                used -= self.buffer_memory(self.buffers.pop(handle))
+
+buffer_store_test = BufferStore(buffer_test_image.size[1]*TILE_COLUMNS*len(buffer_test_image.getbands())*2)
+buffer_store_test_handles = [buffer_store_test.new() for count in range(3)]
+assert_equal(len(set(buffer_store_test_handles)), 3)
+assert_equal(buffer_store_test.get("not a handle"), None)
+for handle in buffer_store_test_handles:
+    buffer_store_test.get(handle).write_message(buffer_test_image, b"Hi", 0)
+assert_equal(buffer_store_test.get(buffer_store_test_handles[2]).column_count(), TILE_COLUMNS)
+assert_equal(list(buffer_store_test.buffers), buffer_store_test_handles[1:])
+assert_equal(buffer_store_test.get(buffer_store_test_handles[0]), None)
+buffer_store_test.remove(buffer_store_test_handles[1])
+buffer_store_test.remove('')
+assert_equal(list(buffer_store_test.buffers), buffer_store_test_handles[2:])
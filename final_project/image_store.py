@@ -0,0 +1,197 @@
+from bakery import assert_equal
+from PIL import Image as PIL_Image
+from collections import OrderedDict
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+from upload import carrier_image
+
+class ImageStore():
+    '''
+    Content-addressed store for uploaded images, so the drafter State only has to carry a short
+    handle (the sha256 of the upload) instead of the image itself. Every upload is written through
+    to the spill folder once, as the original PNG bytes, while it is being hashed, rather than
+    when it is dropped from memory; the PNG is much smaller than its pixels and is already on
+    hand as a file, so dropping an image never has to write anything. Decoded images (RGB or
+    RGBA, see upload.carrier_image) are kept in memory in least recently used order; when they
+    go over memory_budget the ones that have not been used for the longest (the idle sessions)
+    are dropped and are decoded from disk again if they are ever asked for. The spill folder is
+    trimmed the same way once it goes over disk_budget.
+
+    Args:
+        memory_budget (int): the most bytes of decoded pixels to keep in memory
+        disk_budget (int): the most bytes of PNG files to keep in the spill folder
+        folder (str): the spill folder
+        images (OrderedDict): handle -> decoded image, least recently used first
+        files (OrderedDict): handle -> size in bytes of the spilled PNG, least recently used first
+    '''
+    def __init__(self, memory_budget:int, disk_budget:int, folder:str):
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self.folder = folder
+        self.images = OrderedDict()
+        self.files = OrderedDict()
+        os.makedirs(folder, exist_ok=True)
+
+    def path(self, handle:str) -> str:
+        '''
+        Returns where the PNG for a handle is spilled to
+
+        Args:
+            handle (str): the handle from put
+
+        Returns:
+            str: the file path
+        '''
+        return os.path.join(self.folder, handle + ".png")
+
+    def put(self, image_bytes:bytes) -> str:
+        '''
+        Adds an uploaded PNG to the store and returns its handle. Uploading the same
+        bytes twice returns the same handle and stores them once
+
+        Args:
+            image_bytes (bytes): the uploaded PNG file
+
+        Returns:
+            str: the handle to get the image back with
+        '''
+        return self.put_file(io.BytesIO(image_bytes))
+
+    def put_file(self, upload_file, chunk_size:int=64*1024) -> str:
+        '''
+        Adds an uploaded PNG to the store from an open file, hashing it and writing it to the
+        spill folder one chunk at a time so the whole upload is never held in memory
+
+        Args:
+            upload_file: the uploaded PNG, read with .read(size) from its current position
+            chunk_size (int): how many bytes to read at a time
+
+        Returns:
+            str: the handle to get the image back with
+        '''
+        digest = hashlib.sha256()
+        size = 0
+        spill_file = tempfile.NamedTemporaryFile(dir=self.folder, suffix=".part", delete=False)
+        with spill_file:
+            chunk = upload_file.read(chunk_size)
+            while chunk:
+                digest.update(chunk)
+                spill_file.write(chunk)
+                size += len(chunk)
+                chunk = upload_file.read(chunk_size)
+        handle = digest.hexdigest()
+        if handle in self.files:
+            os.remove(spill_file.name)
+        else:
+            os.replace(spill_file.name, self.path(handle))
+            self.files[handle] = size
+            self.trim_disk(handle)
+        self.files.move_to_end(handle)
+        return handle
+
+    def get(self, handle:str) -> PIL_Image:
+        '''
+        Returns the decoded image for a handle, in its own mode when it is RGB or RGBA, decoding
+        it from the spill folder if it had been dropped from memory
+
+        Args:
+            handle (str): the handle from put
+
+        Returns:
+            PIL_Image: the image, or None if the handle is unknown or was trimmed from disk
+
+        Raises:
+            ValueError: if the stored file is a palette image
+        '''
+        if handle in self.images:
+            self.images.move_to_end(handle)
+            return self.images[handle]
+        if handle not in self.files:
+            return None
+        self.files.move_to_end(handle)
+        with PIL_Image.open(self.path(handle)) as spill_image:
+            image = carrier_image(spill_image)
+        self.images[handle] = image
+        self.trim_memory(handle)
+        return image
+
+    def memory_used(self) -> int:
+        '''
+        Returns how many bytes of decoded pixels are held in memory
+
+        Returns:
+            int: the total pixel bytes of the images in memory
+        '''
+        total = 0
+        for image in self.images.values():
+            width, length = image.size
+            total += width*length*len(image.getbands())
+        return total
+
+    def trim_memory(self, keep:str):
+        '''
+        Drops the least recently used images from memory until the store is under
+        memory_budget, never dropping the image that was just asked for
+
+        Args:
+            keep (str): the handle that must stay in memory
+        '''
+        used = self.memory_used()
+        for handle in list(self.images):
+            if used <= self.memory_budget:
+                return
+            if handle != keep:
+                image = self.images.pop(handle)
+                width, length = image.size
+                used -= width*length*len(image.getbands())
+
+    def trim_disk(self, keep:str):
+        '''
+        Deletes the least recently used spilled files until the folder is under
+        disk_budget, never deleting the file that was just added
+
+        Args:
+            keep (str): the handle that must stay on disk
+        '''
+        used = sum(self.files.values())
+        for handle in list(self.files):
+            if used <= self.disk_budget:
+                return
+            if handle != keep:
+                used -= self.files.pop(handle)
+                self.images.pop(handle, None)
+                os.remove(self.path(handle))
+
+def png_bytes(image:PIL_Image) -> bytes:
+    '''
+    Test helper. Saves an image as PNG and returns the file bytes
+    '''
+    image_data = io.BytesIO()
+    image.save(image_data, format="PNG")
+    return image_data.getvalue()
+
+store_test = ImageStore(2*10*10*3, 10**6, tempfile.mkdtemp())
+store_test_images = [PIL_Image.new("RGB", (10, 10), (shade, shade, shade)) for shade in [0, 100, 200]]
+store_test_handles = [store_test.put(png_bytes(image)) for image in store_test_images]
+assert_equal(store_test.put(png_bytes(store_test_images[0])), store_test_handles[0])
+assert_equal(store_test.put_file(io.BytesIO(png_bytes(store_test_images[1])), 7), store_test_handles[1])
+assert_equal(len(store_test.files), 3)
+assert_equal(sorted(os.listdir(store_test.folder)), sorted(handle + ".png" for handle in store_test_handles))
+assert_equal(store_test.get(store_test_handles[0]).getpixel((0, 0)), (0, 0, 0))
+assert_equal(store_test.get(store_test_handles[1]).getpixel((0, 0)), (100, 100, 100))
+assert_equal(store_test.get(store_test_handles[2]).getpixel((0, 0)), (200, 200, 200))
+assert_equal(list(store_test.images), store_test_handles[1:])
+assert_equal(store_test.get(store_test_handles[0]).getpixel((5, 5)), (0, 0, 0))
+assert_equal(list(store_test.images), [store_test_handles[2], store_test_handles[0]])
+assert_equal(store_test.get("not a handle"), None)
+store_test_rgba = store_test.put(png_bytes(PIL_Image.new("RGBA", (10, 10), (1, 2, 3, 4))))
+assert_equal(store_test.get(store_test_rgba).getpixel((0, 0)), (1, 2, 3, 4))
+assert_equal(store_test.memory_used(), 10*10*4)
+store_test.disk_budget = 0
+store_test.trim_disk(store_test_handles[0])
+assert_equal(list(store_test.files), [store_test_handles[0]])
+assert_equal(store_test.get(store_test_handles[2]), None)
+shutil.rmtree(store_test.folder)
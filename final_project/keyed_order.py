@@ -0,0 +1,87 @@
+from bakery import assert_equal
+import numpy as np
+import hashlib
+
+FEISTEL_ROUNDS = 4
+# Odd 64 bit constants for the round function's multiply and shift mixing
+MIX_MULTIPLIERS = (np.uint64(0x9E3779B97F4A7C15), np.uint64(0xBF58476D1CE4E5B9))
+
+def keyed_round_keys(key:str) -> np.ndarray:
+    '''
+    Turns a key into the round keys of the permutation, by seeding a numpy
+    generator with a hash of the key, so the same key always gives the same order
+
+    Args:
+        key (str): the key shared by the encoder and decoder
+
+    Returns:
+        np.ndarray: FEISTEL_ROUNDS uint64 round keys
+    '''
+    seed = int.from_bytes(hashlib.sha256(key.encode("utf-8")).digest()[:8], "big")
+    return np.random.default_rng(seed).integers(0, 2**63, FEISTEL_ROUNDS, dtype=np.uint64)
+
+assert_equal(keyed_round_keys("key").tolist() == keyed_round_keys("key").tolist(), True)
+assert_equal(keyed_round_keys("key").tolist() == keyed_round_keys("kez").tolist(), False)
+
+def feistel(indices:np.ndarray, half_bits:int, round_keys:np.ndarray) -> np.ndarray:
+    '''
+    Shuffles every index below 2**(2*half_bits) to another one with a balanced Feistel
+    network, which is a one to one mapping whatever the round function is
+
+    Args:
+        indices (np.ndarray): uint64 indices below 2**(2*half_bits)
+        half_bits (int): the number of bits in each half of an index
+        round_keys (np.ndarray): the round keys from keyed_round_keys
+
+    Returns:
+        np.ndarray: the shuffled uint64 indices
+    '''
+    shift = np.uint64(half_bits)
+    mask = np.uint64((1 << half_bits) - 1)
+    left = indices >> shift
+    right = indices & mask
+    for round_key in round_keys:
+        mixed = (right ^ round_key) * MIX_MULTIPLIERS[0]
+        mixed ^= mixed >> np.uint64(29)
+        mixed *= MIX_MULTIPLIERS[1]
+        mixed ^= mixed >> np.uint64(32)
+        left, right = right, left ^ (mixed & mask)
+    return (left << shift) | right
+
+feistel_test_keys = keyed_round_keys("test")
+assert_equal(sorted(feistel(np.arange(256, dtype=np.uint64), 4, feistel_test_keys).tolist()), list(range(256)))
+
+def keyed_positions(start:int, count:int, total:int, key:str) -> np.ndarray:
+    '''
+    Returns where the values start to start+count-1 of a message go, out of total
+    values, in the order given by the key. Position n always maps to the same place
+    for the same key and total, so the positions can be worked out a piece at a time
+    (the header first, then the message) and only for the values actually used:
+    the cost depends on count, never on the size of the image.
+    Indices that land past the end are shuffled again until they land inside it
+
+    Args:
+        start (int): the position of the first value in the message
+        count (int): how many positions to return
+        total (int): how many values the image has; start+count must not be more than this
+        key (str): the key shared by the encoder and decoder
+
+    Returns:
+        np.ndarray: count distinct int64 positions below total, in column by column order
+    '''
+    half_bits = max(1, ((total - 1).bit_length() + 1) // 2)
+    round_keys = keyed_round_keys(key)
+    positions = feistel(np.arange(start, start + count, dtype=np.uint64), half_bits, round_keys)
+    outside = positions >= total
+    while outside.any():
+        positions[outside] = feistel(positions[outside], half_bits, round_keys)
+        outside = positions >= total
+    return positions.astype(np.int64)
+
+assert_equal(sorted(keyed_positions(0, 1000, 1000, "key").tolist()), list(range(1000)))
+assert_equal(sorted(keyed_positions(0, 777, 777, "another key").tolist()), list(range(777)))
+assert_equal(keyed_positions(0, 10, 5000, "key").tolist() == keyed_positions(0, 30, 5000, "key")[:10].tolist(), True)
+assert_equal(keyed_positions(10, 20, 5000, "key").tolist() == keyed_positions(0, 30, 5000, "key")[10:].tolist(), True)
+assert_equal(keyed_positions(0, 30, 5000, "key").tolist() == keyed_positions(0, 30, 5000, "kez").tolist(), False)
+assert_equal(keyed_positions(0, 30, 5000, "key").tolist() == list(range(30)), False)
+assert_equal(len(keyed_positions(0, 0, 5000, "key")), 0)
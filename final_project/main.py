@@ -1,9 +1,38 @@
 from dataclasses import dataclass
 from PIL import Image as PIL_Image  #This is a different Image than the drafter Image.
 from drafter import *
-from decoder import get_encoded_message, get_color_values
-from encoder import hide_bits, message_to_binary,prepend_header
+from crypto_pipeline import decrypt_and_verify, encrypt_and_hash
+from decode_cache import DecodeCache, decode_key
+from decoder import carrier_channels, decode_all_channels, decode_image_bytes
+from encoder import compress_message, pixels_needed
+from image_buffer import BufferStore, ImageBuffer
+from image_store import ImageStore
+from preview_cache import PreviewCache, PreviewImage
+from upload import read_upload
+import base64
+import io
+import json
+import os
+import tempfile
+from header import ALPHA, CODEC_NONE, INTERLEAVED
 from bakery import assert_equal
+import logging
+
+#Uploaded images live here instead of in the State. Every upload is written through to disk as it arrives; decoded
+#pixels past the memory budget are dropped, least recently used (idle sessions) first, and decoded again from that PNG
+IMAGE_STORE = ImageStore(memory_budget=512*1024*1024, disk_budget=4*1024*1024*1024,
+                         folder=os.path.join(tempfile.gettempdir(), "stego_image_store"))
+#Each session's copy-on-write ImageBuffer, which the State can't hold since it is serialized to JSON on every request
+BUFFER_STORE = BufferStore(memory_budget=512*1024*1024)
+#Downscaled previews shown on the pages, encoded once per upload. The full image is only used for the Download
+PREVIEW_CACHE = PreviewCache(max_entries=256)
+#Decoded messages (and "no message" results) per upload, channel and key, so decoding the same image again is a lookup
+DECODE_CACHE = DecodeCache(max_entries=4096, max_age=60*60)
+
+#The color channel names shown in the SelectBoxes, in channel id order
+CHANNEL_NAMES = ["Red", "Green", "Blue", "RGB (interleaved)", "Alpha"]
+#The extra decode page choice that looks in every channel, one after another, from one read of the image
+ALL_CHANNELS = "All Channels"
 
 #Classes
 class EmptyableFile():
@@ -11,43 +40,47 @@ class EmptyableFile():
     Used for the File upload system
     Allows for an empty file to be processed by Drafter
     without automaticaly triggering a 500 server error.
-    Assigns value as either a bytes value or a None value
-    for the user to process manualy.
+    Assigns value as either the upload streamed into a spooled temporary file
+    or a None value for the user to process manualy, and error as the reason a
+    non empty upload was rejected (too large, or not a PNG).
     Uses class over dataclass for type flexability when assigning self.value
     '''
     def __init__(self, value):   
         try:
-            self.value = bytes(value.file.read()) 
+            self.value, self.error = read_upload(value.file)
         except:
             self.value = None
+            self.error = ''
         value.file.close()
 
 #Dataclasses
 @dataclass
 class State:
     '''
-    The drafter State. Stores all the core information to be transfered across pages
+    The drafter State. Stores all the core information to be transfered across pages. drafter serializes it to
+    JSON on every request, so it only holds strings and bools; the image and the buffer live on the server in
+    IMAGE_STORE and BUFFER_STORE and the State carries their handles
     
     Args:
-        image (PIL_Image): The image that will either have information encoded into it or be decoded
+        image_handle (str): The IMAGE_STORE handle of the image that will either have information encoded into
+                        it or be decoded. Use get_state_image to get the image itself
         info list[str]: a list of strings used to project error messages if the image that is uploaded
                         is either invalid or incorrectly named by the user
         encoding (bool): used by the decode_encode_settings function to determine if the encode fields
                         need to be shown or the decode feilds need to be shown
-        modified_image (PIL_Image): the image that gets modified to store the encrypted data. Separated
-                        from image to allow for the user to change what message they have in a given channel
-                        before they download the image
-        message_lengths (tupple): used to store information about the encrypted message length so that only the
-                        effected pixels have to be restored to their origional format when re-encrypting or clearing
-                        a channel
+        buffer_handle (str): The BUFFER_STORE handle of the copy-on-write buffer that gets modified to store the
+                        encrypted data. The buffer shares the pixels of image and only copies the columns the messages
+                        reach. Separated from image to allow for the user to change what message they have in a given
+                        channel before they download the image. Use get_state_buffer to get the buffer itself
         file_name (str): the user given name of the file 
+        compression (str): the PNG compression setting for the download, "Fast" or "Small"
     '''
-    image: PIL_Image = None
+    image_handle: str = ''
     info: list[str] = field(default_factory=lambda: ["Select a 'png' file."])
     encoding: bool = True
-    modified_image: PIL_Image = None
-    message_lengths: tuple = (0,0,0)
+    buffer_handle: str = ''
     file_name:str = ''
+    compression:str = "Fast"
 
 #Routes
 @route
@@ -61,9 +94,9 @@ def index(state: State) -> Page:
     Returns:
         Page: a page containing the upload form for the image and a field for the filename
     '''
-    state.message_lengths = (0,0,0)
-    state.modified_image = None
-    state.image = None
+    BUFFER_STORE.remove(state.buffer_handle)
+    state.buffer_handle = ''
+    state.image_handle = ''
     state.file_name=''
     page_content = []
     for message_line in state.info:
@@ -101,23 +134,31 @@ def image_verification_handler(state : State, new_image:EmptyableFile, file_name
                       "Please try again.",
                       "Select a 'png' file."]
         return index(state)
+    if new_image.error:
+        state.info = [new_image.error,
+                      "Please try again.",
+                      "Select a 'png' file."]
+        return index(state)
     state.info = ["An image was either not uploaded or incorrectly formated",
                       "Please try again.",
                       "Select a 'png' file."]
     return index(state)
 
 @route
-def display_new_image(state : State, new_image: bytes) -> Page:
-    # open the file and assign to State field
-    state.image = PIL_Image.open(io.BytesIO(new_image)).convert('RGB')
-    state.modified_image = state.image.copy()
+def display_new_image(state : State, new_image: tempfile.SpooledTemporaryFile) -> Page:
+    # stream the upload into the image store and assign its handle to the State field
+    state.image_handle = IMAGE_STORE.put_file(new_image)
+    new_image.close()
+    state.buffer_handle = BUFFER_STORE.new()
     return display_image(state)
 
 @route
 def display_image(state : State) -> Page:
-    # open the file and assign to State field
+    preview = get_state_preview(state)
+    if preview is None:
+        return image_expired(state)
     return Page(state, [
-        Image(state.image),
+        preview,
         Button("Decode", decode_page),
         Button("Encode", encode_page),
         Button("Back", index)
@@ -134,8 +175,28 @@ def encode_page(state : State) -> Page:
     return decode_encode_settings(state)
 
 @route
-def decoded(state: State, color_channel: str) -> Page:
-    message = get_encoded_message(get_color_values(state.image, color_to_channel_ID(color_channel)))
+def decoded(state: State, color_channel: str, key: str, rotation: str) -> Page:
+    image = get_state_image(state)
+    if image is None:
+        return image_expired(state)
+    if rotation and not is_rotation(rotation):
+        return rotation_error(state, decode_page)
+    if color_channel == ALL_CHANNELS:
+        return decoded_all_channels(state, image, key, rotation)
+    payload = decode_state_channel(state, image, color_to_channel_ID(color_channel), key)
+    if payload is None:
+        message = None
+    elif rotation:
+        message = decrypt_and_verify(payload, int(rotation)) if payload else payload
+        if message is None:
+            return Page(state, [
+                "The hidden message failed its integrity check.",
+                "It may have been tampered with, or the rotation is wrong.",
+                Button("Return to Selection Screen",display_image),
+                Button("New Image",index)
+                ])
+    else:
+        message = payload.decode("utf-8", errors="replace")
     if message:
         return Page(state, [
             "The hidden message is:",
@@ -148,37 +209,238 @@ def decoded(state: State, color_channel: str) -> Page:
             Button("Return to Selection Screen",display_image),
             Button("New Image",index)
             ])
+
+def decoded_all_channels(state: State, image: PIL_Image, key: str, rotation: str) -> Page:
+    '''
+    Decodes every color channel with decode_all_channels, which checks them one after
+    another from one shared read of the image, and lists each message found, with its
+    channel, on a single page
+    
+    Args:
+        state (State): the state of the Drafter instance
+        image (PIL_Image): the uploaded image
+        key (str): the key from the decode page, '' for none
+        rotation (str): the checked cipher rotation from the decode page, '' for none
+    
+    Returns:
+        Page: the results page
+    '''
+    results = []
+    for channel_id, payload in decode_state_all_channels(state, image, key).items():
+        if payload is None:
+            continue
+        if rotation:
+            message = decrypt_and_verify(payload, int(rotation))
+            if message is None:
+                results.append(CHANNEL_NAMES[channel_id]+": failed its integrity check")
+                continue
+        else:
+            message = payload.decode("utf-8", errors="replace")
+        results.append(CHANNEL_NAMES[channel_id]+': “'+message+'”')
+    if not results:
+        results = ["Sorry, there is no hidden message in any channel"]
+    else:
+        results.insert(0, "The hidden messages are:")
+    return Page(state, results + [
+        Button("Return to Selection Screen",display_image),
+        Button("New Image",index)
+        ])
+
 @route
-def encode_image(state:State, message:str, color_channel: str) -> Page:
+def encode_image(state:State, message:str, color_channel: str, bit_depth: str, compression: str, key: str,
+                 message_compression: str, rotation: str) -> Page:
+    state.compression = compression
     color_channel_id = color_to_channel_ID(color_channel)
-    binary_message = message_to_binary(prepend_header(message))
-    
-    #if there has already been a message encoded into the channel, removes it before adding the new one
-    if color_channel_id == 0:
-        if not state.message_lengths[0] == 0:
-            state.modified_image = reset_bits(state.image, state.modified_image, 0, state.message_lengths[0])
-        state.message_lengths = (len(binary_message),state.message_lengths[1],state.message_lengths[2])
-    elif color_channel_id == 1:
-        if not state.message_lengths[1] == 0:
-            state.modified_image = reset_bits(state.image, state.modified_image, 1, state.message_lengths[1])
-        state.message_lengths = (state.message_lengths[0],len(binary_message),state.message_lengths[2])
+    depth = int(bit_depth)
+    if rotation and message:
+        if not is_rotation(rotation):
+            return rotation_error(state, encode_page)
+        try:
+            encoded_message = encrypt_and_hash(message, int(rotation))
+        except ValueError:
+            return Page(state, [
+                "Only plain keyboard characters (no '~' or accented letters) can be encrypted.",
+                Button("Return to Encoding", encode_page)
+                ])
     else:
-        if not state.message_lengths[2] == 0:
-            state.modified_image = reset_bits(state.image, state.modified_image, 2, state.message_lengths[2])
-        state.message_lengths = (state.message_lengths[0],state.message_lengths[1],len(binary_message))
-    # if the message is empty, checks if there is any messages at all and if not, sets the modified image back to none to prevent
-    #download from poping up in the encode page
-    if message:    
-        state.modified_image = hide_bits(state.modified_image, binary_message, color_channel_id)
+        encoded_message = message.encode("utf-8")
+    codec = CODEC_NONE
+    if message_compression == "Auto":
+        encoded_message, codec = compress_message(encoded_message)
+    image = get_state_image(state)
+    buffer = get_state_buffer(state)
+    if image is None or buffer is None:
+        return image_expired(state)
+    width, length = image.size
+    if pixels_needed(len(encoded_message), color_channel_id, depth) > width*length:
+        return Page(state, [
+            "That message is too long for this image.",
+            "Try a shorter message, the interleaved channel or a higher bit depth.",
+            Button("Return to Encoding", encode_page)
+            ])
+    
+    #if there has already been a message encoded into the channel, removes it before adding the new one.
+    #an interleaved message uses the red, green and blue channels, so it replaces and is replaced by the messages
+    #in those channels. It never touches alpha, so an alpha message and an interleaved one can sit side by side
+    if color_channel_id == INTERLEAVED:
+        channels_to_reset = [0, 1, 2, INTERLEAVED]
+    elif color_channel_id == ALPHA:
+        channels_to_reset = [ALPHA]
     else:
-        if state.message_lengths == (0,0,0):
-            state.modified_image = state.image.copy()
+        channels_to_reset = [color_channel_id, INTERLEAVED]
+    for channel in channels_to_reset:
+        if buffer.changed_values[channel] is not None:
+            buffer.restore(image, channel, buffer.changed_values[channel])
+            buffer.changed_values[channel] = None
+    if message:
+        buffer.changed_values[color_channel_id] = buffer.write_message(image, encoded_message,
+                                                                       color_channel_id, depth, key or None, codec)
     return encode_page(state)
 
 #Functions
+def get_state_image(state:State) -> PIL_Image:
+    '''
+    Looks up the state's image in IMAGE_STORE
+    
+    Args:
+        state (State): the state of the Drafter instance
+    
+    Returns:
+        PIL_Image: the uploaded RGB image, or None if it has been trimmed from the store
+    '''
+    return IMAGE_STORE.get(state.image_handle)
+
+def get_state_buffer(state:State) -> ImageBuffer:
+    '''
+    Looks up the state's copy-on-write buffer in BUFFER_STORE
+    
+    Args:
+        state (State): the state of the Drafter instance
+    
+    Returns:
+        ImageBuffer: the buffer holding the messages encoded so far, or None if it has been trimmed from the store
+    '''
+    return BUFFER_STORE.get(state.buffer_handle)
+
+def get_state_preview(state:State) -> PreviewImage:
+    '''
+    Returns the downscaled preview of the state's image, building it the first time
+    
+    Args:
+        state (State): the state of the Drafter instance
+    
+    Returns:
+        PreviewImage: the preview page element, or None if the image has been trimmed from the store
+    '''
+    url = PREVIEW_CACHE.get(state.image_handle)
+    if url is None:
+        image = get_state_image(state)
+        if image is None:
+            return None
+        url = PREVIEW_CACHE.add(state.image_handle, image)
+    return PreviewImage(url)
+
+def decode_state_channel(state:State, image:PIL_Image, channel_id:int, key:str) -> bytes:
+    '''
+    Returns the message hidden in one channel of the state's image, from DECODE_CACHE
+    when the same upload has been decoded with the same channel and key before
+    
+    Args:
+        state (State): the state of the Drafter instance
+        image (PIL_Image): the state's image
+        channel_id (int): the color channel to read (0=>red, 1=>green, 2=>blue, 3=>interleaved, 4=>alpha)
+        key (str): the key from the decode page, '' for none
+    
+    Returns:
+        bytes: the hidden message, b'' if there is none, or None if the header
+            claims more bytes than the image holds
+    '''
+    cache_key = decode_key(state.image_handle, channel_id, key or None)
+    found, message = DECODE_CACHE.get(cache_key)
+    if not found:
+        message = decode_image_bytes(image, channel_id, key or None)
+        DECODE_CACHE.add(cache_key, message)
+    return message
+
+def decode_state_all_channels(state:State, image:PIL_Image, key:str) -> dict[int, bytes]:
+    '''
+    Returns the messages hidden in every channel of the state's image, like decode_all_channels,
+    from DECODE_CACHE when all of its channels are cached and with one shared read of the image otherwise
+    
+    Args:
+        state (State): the state of the Drafter instance
+        image (PIL_Image): the state's image
+        key (str): the key from the decode page, '' for none
+    
+    Returns:
+        dict[int, bytes]: channel id -> hidden message, for every channel that has a message
+    '''
+    cache_keys = {channel_id: decode_key(state.image_handle, channel_id, key or None) for channel_id in carrier_channels(image)}
+    messages = {}
+    for channel_id, cache_key in cache_keys.items():
+        found, message = DECODE_CACHE.get(cache_key)
+        if not found:
+            messages = decode_all_channels(image, key or None)
+            for channel_id, cache_key in cache_keys.items():
+                DECODE_CACHE.add(cache_key, messages.get(channel_id, b''))
+            return messages
+        if message != b'':
+            messages[channel_id] = message
+    return messages
+
+def image_expired(state:State) -> Page:
+    '''
+    Sends the user back to the upload page when their image is no longer in the store
+    
+    Args:
+        state (State): the state of the Drafter instance
+    
+    Returns:
+        Page: the index page with a message explaining what happened
+    '''
+    state.info = ["Your image was cleared after being idle for too long.",
+                  "Please upload it again.",
+                  "Select a 'png' file."]
+    return index(state)
+
+def is_rotation(rotation:str) -> bool:
+    '''
+    Checks that the cipher rotation typed in by the user is a whole number
+    
+    Args:
+        rotation (str): the rotation from the TextBox
+    
+    Returns:
+        bool: True if it can be used as a rotation
+    '''
+    digits = rotation.strip().lstrip("-")
+    return digits.isascii() and digits.isdecimal()
+assert_equal(is_rotation("4"), True)
+assert_equal(is_rotation("-43"), True)
+assert_equal(is_rotation("four"), False)
+assert_equal(is_rotation("1.5"), False)
+assert_equal(is_rotation("\u00b2"), False)
+
+def rotation_error(state:State, back) -> Page:
+    '''
+    Returns a page telling the user their cipher rotation isn't a whole number
+    
+    Args:
+        state (State): the state of the Drafter instance
+        back: the route the user is sent back to
+    
+    Returns:
+        Page: the error page
+    '''
+    return Page(state, [
+        "The cipher rotation has to be a whole number, like 4.",
+        Button("Back", back)
+        ])
+
 def color_to_channel_ID(color_channel:str) -> int:
     '''
-    Consumes a string of either 'Red', 'Green', or 'Blue' and returns the accompaning channel id of 0, 1, or 2
+    Consumes a string of either 'Red', 'Green', 'Blue', 'RGB (interleaved)' or 'Alpha' and returns the accompaning
+    channel id of 0, 1, 2, 3 (INTERLEAVED) or 4 (ALPHA)
     
     Args:
         color_channel (str): the color chanel name to be converted to ID
@@ -191,11 +453,17 @@ def color_to_channel_ID(color_channel:str) -> int:
         return 0
     elif color_channel == "Green":
         return 1
-    else:
+    elif color_channel == "Blue":
         return 2
+    elif color_channel == "Alpha":
+        return ALPHA
+    else:
+        return INTERLEAVED
 assert_equal(color_to_channel_ID("Red"), 0)
 assert_equal(color_to_channel_ID("Green"), 1)
 assert_equal(color_to_channel_ID("Blue"), 2)
+assert_equal(color_to_channel_ID("RGB (interleaved)"), 3)
+assert_equal(color_to_channel_ID("Alpha"), ALPHA)
 
 def decode_encode_settings(state : State) -> Page:
     '''
@@ -209,57 +477,46 @@ def decode_encode_settings(state : State) -> Page:
         Page: a page element for the encode or decode page
     '''
     
-    pageItems = [Image(state.image),
+    preview = get_state_preview(state)
+    image = get_state_image(state)
+    if preview is None or image is None:
+        return image_expired(state)
+    #the alpha channel is only offered for RGBA images
+    channel_choices = [CHANNEL_NAMES[channel_id] for channel_id in carrier_channels(image)]
+    if not state.encoding:
+        channel_choices.append(ALL_CHANNELS)
+    pageItems = [preview,
                  "Color Channel:",
-                 SelectBox("color_channel",["Red","Green","Blue"], "Green")
+                 SelectBox("color_channel", channel_choices, "Green"),
+                 "Key (optional, spreads the message over the whole image):",
+                 TextBox("key"),
+                 "Cipher Rotation (optional, encrypts the message and checks it wasn't changed):",
+                 TextBox("rotation")
                  ]
     if state.encoding:
         pageItems += [
+            "Bits Per Color Value:",
+            SelectBox("bit_depth",["1","2","3","4"], "1"),
             "Message To Encode:",
             TextBox("message"),
+            "Compress Message (when it makes it smaller):",
+            SelectBox("message_compression",["Auto","Off"], "Auto"),
+            "Download Compression:",
+            SelectBox("compression",["Fast","Small"], state.compression),
             Button("Encode", encode_image)
             ]
-        if not state.message_lengths == (0,0,0):
-            pageItems.append(Download("Download", state.file_name+"_encrypted", state.modified_image))
+        buffer = get_state_buffer(state)
+        if buffer is None:
+            return image_expired(state)
+        if buffer.changed_values != [None, None, None, None, None]:
+            pageItems.append(Download("Download", state.file_name+"_encrypted",
+                                      buffer.to_png_base64(image, state.compression), "image/png;base64"))
     else:
         pageItems.append(Button("Decode", decoded))
     pageItems.append(Button("Back", display_image))
     
     return Page(state, pageItems)
 
-def reset_bits(original_image:PIL_Image, image:PIL_Image, color:int, num_of_bits:int) -> PIL_Image:
-    '''
-    Used to reset the color channel of a modified image before it is rewritten
-    
-    Args:
-        original_image (PIL_Image): the image that has already been modified
-        image (PIL_Image): the origional image to reference
-        color: the color channel to clear encode the data from (0=>red, 1=>green, 2=>blue)
-        num_of_bits (int): the number of bits that need to be cleared
-
-    Returns:
-        PIL_Image: the modified image with all the data stripped from the provided channel
-    '''
-    width, length = image.size
-    width_current = 0
-    length_current = 0
-    for bit in range(num_of_bits):
-        red_old, green_old, blue_old = original_image.getpixel((width_current, length_current))
-        red, green, blue = image.getpixel((width_current, length_current))
-        if color == 0:
-            red = red_old
-        elif color == 1:
-            green = green_old
-        else:
-            blue = blue_old
-        image.putpixel((width_current, length_current), (red, green, blue))
-        if length_current >= length:
-            width_current += 1
-            length_current = 0
-        else:
-            length_current += 1
-    return image
-
 def verify_file_name(fileName:str) -> bool:
     '''
     Takes in a file name and returns a bool stating if it is or isnt
@@ -293,6 +550,47 @@ assert_equal(verify_file_name('%test'), False)
 assert_equal(verify_file_name(''), False)
 
 #Route Assert Equal Statements:
+#drafter serializes the State to JSON after every route, so it has to stay serializable once a message is encoded
+state_test = State()
+state_test_upload = io.BytesIO()
+PIL_Image.new("RGB", (40, 40), (10, 20, 30)).save(state_test_upload, format="PNG")
+state_test_png = state_test_upload.getvalue()
+display_new_image(state_test, io.BytesIO(state_test_png))
+encode_image(state_test, "Hi", "Green", "1", "Fast", "", "Off", "")
+assert_equal(get_state_buffer(state_test).changed_values[1] is not None, True)
+assert_equal(json.loads(json.dumps(dehydrate_json(state_test)))["buffer_handle"], state_test.buffer_handle)
+index(state_test)
+assert_equal(get_state_buffer(state_test), None)
+#A Cipher Rotation sends the message through crypto_pipeline: encrypted and hashed on Encode,
+#decrypted and checked on Decode (the Download is uploaded again, as a user would)
+display_new_image(state_test, io.BytesIO(state_test_png))
+encode_image(state_test, "Meet at noon", "Blue", "1", "Fast", "", "Off", "4")
+state_test_png = base64.b64decode(get_state_buffer(state_test).to_png_base64(get_state_image(state_test), "Fast"))
+display_new_image(state_test, io.BytesIO(state_test_png))
+assert_equal(decoded(state_test, "Blue", "", "4").content[:2], ["The hidden message is:", '“Meet at noon”'])
+assert_equal(decoded(state_test, "Blue", "", "5").content[0], "The hidden message failed its integrity check.")
+#a header claiming more bytes than the image holds is no message, with or without a rotation
+state_test_image = PIL_Image.new("RGB", (40, 40), (10, 20, 30))
+for state_test_index, state_test_bit in enumerate(format(int.from_bytes(b"999", "big"), "024b")):
+    state_test_image.putpixel((0, state_test_index), (10 + int(state_test_bit), 20, 30))
+state_test_upload = io.BytesIO()
+state_test_image.save(state_test_upload, format="PNG")
+display_new_image(state_test, io.BytesIO(state_test_upload.getvalue()))
+assert_equal(decode_state_channel(state_test, get_state_image(state_test), 0, "") is None, True)
+assert_equal(decoded(state_test, "Red", "", "").content[0], "Sorry, there is no hidden message here")
+assert_equal(decoded(state_test, "Red", "", "4").content[0], "Sorry, there is no hidden message here")
+#an alpha message and an interleaved message use different values of an RGBA image, so both are kept
+state_test_upload = io.BytesIO()
+PIL_Image.new("RGBA", (40, 40), (10, 20, 30, 255)).save(state_test_upload, format="PNG")
+display_new_image(state_test, io.BytesIO(state_test_upload.getvalue()))
+encode_image(state_test, "interleaved msg", "RGB (interleaved)", "1", "Fast", "", "Off", "")
+encode_image(state_test, "alpha msg", "Alpha", "1", "Fast", "", "Off", "")
+encode_image(state_test, "alpha again", "Alpha", "1", "Fast", "", "Off", "")
+state_test_png = base64.b64decode(get_state_buffer(state_test).to_png_base64(get_state_image(state_test), "Fast"))
+display_new_image(state_test, io.BytesIO(state_test_png))
+assert_equal(decoded(state_test, "RGB (interleaved)", "", "").content[:2], ["The hidden message is:", '“interleaved msg”'])
+assert_equal(decoded(state_test, "Alpha", "", "").content[:2], ["The hidden message is:", '“alpha again”'])
 
 
+logging.basicConfig(level=logging.INFO)
 start_server(State())
\ No newline at end of file
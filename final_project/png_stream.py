@@ -0,0 +1,239 @@
+from bakery import assert_equal
+from PIL import Image as PIL_Image
+import numpy as np
+import io
+import struct
+import zlib
+from decoder import carrier_channels, decode_image_bytes, read_binary_message, values_to_bytes
+from header import ALPHA, FIXED_HEADER_BYTES, INTERLEAVED, ROW_LAYOUT_VERSION, build_flags, build_header, channel_band, is_binary_header
+from upload import PALETTE_ERROR, PNG_SIGNATURE, carrier_image
+
+# PNG color types the scanline reader understands, and how many bytes each pixel takes
+# at 8 bits per sample: 2 => RGB, 6 => RGBA
+PIXEL_BYTES = {2: 3, 6: 4}
+# The most decompressed bytes to ask zlib for at once, so a highly compressed
+# chunk can't expand into a huge buffer before its first rows are read
+DECOMPRESS_BYTES = 256*1024
+
+def read_png_chunks(png_file):
+    '''
+    Reads a PNG file one chunk at a time, only as far as the caller keeps asking
+
+    Args:
+        png_file: the open PNG file, at its start
+
+    Yields:
+        tuple: the (chunk type, chunk data) of every chunk in the file
+    '''
+    if png_file.read(len(PNG_SIGNATURE)) != PNG_SIGNATURE:
+        raise ValueError("not a PNG file")
+    while True:
+        chunk_start = png_file.read(8)
+        if len(chunk_start) < 8:
+            return
+        size, chunk_type = struct.unpack(">I4s", chunk_start)
+        data = png_file.read(size)
+        png_file.read(4)  # CRC
+        yield (chunk_type, data)
+        if chunk_type == b"IEND":
+            return
+
+def paeth(left:int, up:int, up_left:int) -> int:
+    '''
+    The PNG Paeth predictor: whichever of left, up and up_left is closest to left + up - up_left
+
+    Args:
+        left (int): the byte to the left
+        up (int): the byte above
+        up_left (int): the byte above and to the left
+
+    Returns:
+        int: the predicted byte
+    '''
+    estimate = left + up - up_left
+    left_distance, up_distance, up_left_distance = abs(estimate - left), abs(estimate - up), abs(estimate - up_left)
+    if left_distance <= up_distance and left_distance <= up_left_distance:
+        return left
+    if up_distance <= up_left_distance:
+        return up
+    return up_left
+
+assert_equal(paeth(10, 20, 15), 15)
+assert_equal(paeth(10, 20, 20), 10)
+assert_equal(paeth(10, 20, 10), 20)
+
+def unfilter_row(filter_type:int, row:np.ndarray, prior:np.ndarray, pixel_bytes:int) -> np.ndarray:
+    '''
+    Undoes the PNG filter on one scanline. None, Sub and Up are done with whole
+    row numpy operations; Average and Paeth depend on the byte just decoded, so
+    they go byte by byte
+
+    Args:
+        filter_type (int): the filter byte at the start of the scanline (0 to 4)
+        row (np.ndarray): the filtered scanline bytes, without the filter byte
+        prior (np.ndarray): the previous decoded scanline, all zeros for the first one
+        pixel_bytes (int): the bytes per pixel
+
+    Returns:
+        np.ndarray: the decoded scanline bytes
+    '''
+    if filter_type == 0:
+        return row
+    if filter_type == 1:
+        return np.cumsum(row.reshape(-1, pixel_bytes), axis=0, dtype=np.uint8).reshape(-1)
+    if filter_type == 2:
+        return row + prior
+    if filter_type not in (3, 4):
+        raise ValueError(f"unknown PNG filter {filter_type}")
+    decoded = bytearray(row.tobytes())
+    above = prior.tolist()
+    for index in range(len(decoded)):
+        left = decoded[index - pixel_bytes] if index >= pixel_bytes else 0
+        if filter_type == 3:
+            decoded[index] = (decoded[index] + ((left + above[index]) >> 1)) & 0xFF
+        else:
+            up_left = above[index - pixel_bytes] if index >= pixel_bytes else 0
+            decoded[index] = (decoded[index] + paeth(left, above[index], up_left)) & 0xFF
+    return np.frombuffer(bytes(decoded), dtype=np.uint8)
+
+unfilter_test_prior = np.array([10, 20, 30, 40, 50, 60], dtype=np.uint8)
+unfilter_test_row = np.array([1, 2, 3, 250, 5, 6], dtype=np.uint8)
+assert_equal(unfilter_row(0, unfilter_test_row, unfilter_test_prior, 3).tolist(), [1, 2, 3, 250, 5, 6])
+assert_equal(unfilter_row(1, unfilter_test_row, unfilter_test_prior, 3).tolist(), [1, 2, 3, 251, 7, 9])
+assert_equal(unfilter_row(2, unfilter_test_row, unfilter_test_prior, 3).tolist(), [11, 22, 33, 34, 55, 66])
+assert_equal(unfilter_row(3, unfilter_test_row, unfilter_test_prior, 3).tolist(), [6, 12, 18, 17, 36, 45])
+assert_equal(unfilter_row(4, unfilter_test_row, unfilter_test_prior, 3).tolist(), [11, 22, 33, 34, 55, 66])
+
+def png_rows(png_file):
+    '''
+    Decodes a PNG one scanline at a time. The IDAT chunks are read from the file and
+    fed to an incremental zlib decompressor only as rows are asked for, so stopping
+    after the first few rows never reads or decompresses the rest of the image.
+    Only 8 bit, non interlaced RGB and RGBA images can be read this way
+
+    Args:
+        png_file: the open PNG file, at its start
+
+    Yields:
+        np.ndarray: every row of the image as a (width, 3 or 4) uint8 array, top row first
+    '''
+    chunks = read_png_chunks(png_file)
+    chunk_type, data = next(chunks)
+    if chunk_type != b"IHDR":
+        raise ValueError("the PNG does not start with IHDR")
+    width, length, bit_depth, color_type, compression, filter_method, interlace = struct.unpack(">IIBBBBB", data)
+    if bit_depth != 8 or color_type not in PIXEL_BYTES or interlace:
+        raise ValueError("only 8 bit, non interlaced RGB and RGBA PNGs can be streamed")
+    pixel_bytes = PIXEL_BYTES[color_type]
+    row_bytes = width*pixel_bytes + 1
+    decompressor = zlib.decompressobj()
+    pending = bytearray()
+    prior = np.zeros(width*pixel_bytes, dtype=np.uint8)
+    rows_read = 0
+    for chunk_type, data in chunks:
+        if chunk_type != b"IDAT":
+            continue
+        while data and rows_read < length:
+            pending += decompressor.decompress(data, DECOMPRESS_BYTES)
+            data = decompressor.unconsumed_tail
+            while len(pending) >= row_bytes and rows_read < length:
+                row = np.frombuffer(bytes(pending[1:row_bytes]), dtype=np.uint8)
+                prior = unfilter_row(pending[0], row, prior, pixel_bytes)
+                del pending[:row_bytes]
+                rows_read += 1
+                yield prior.reshape(width, pixel_bytes)
+        if rows_read == length:
+            return
+
+def png_bytes(image:PIL_Image, **options) -> bytes:
+    '''
+    Test helper. Saves an image as PNG and returns the file bytes
+    '''
+    image_data = io.BytesIO()
+    image.save(image_data, format="PNG", **options)
+    return image_data.getvalue()
+
+stream_test_image = PIL_Image.fromarray(np.random.default_rng(106).integers(0, 256, (40, 50, 3), dtype=np.uint8)
+                                        // np.arange(1, 51, dtype=np.uint8)[None, :, None], "RGB")
+assert_equal(np.array(list(png_rows(io.BytesIO(png_bytes(stream_test_image))))).tobytes() == stream_test_image.tobytes(), True)
+assert_equal(np.array(list(png_rows(io.BytesIO(png_bytes(stream_test_image.convert("RGBA")))))).tobytes()
+             == stream_test_image.convert("RGBA").tobytes(), True)
+assert_equal(len(list(png_rows(io.BytesIO(png_bytes(PIL_Image.new("RGB", (7, 300), (9, 9, 9)), compress_level=9))))), 300)
+
+def decode_png_stream(png_file, channel_index:int) -> bytes:
+    '''
+    Consumes an open PNG file and a color channel and returns the hidden message bytes,
+    like decoder.decode_image_bytes. A message written in ROW_LAYOUT_VERSION is read
+    straight from the first scanlines with png_rows, which stops as soon as the header and
+    message have been read, so a short message in a huge image costs about the same as one
+    in a small image. Any other message, and any PNG png_rows can't read, falls back to
+    decoding the whole image. Asking for the alpha channel of an image without one finds no message
+
+    Args:
+        png_file: the open PNG file, at its start, which must be seekable
+        channel_index (int): the color channel to read (0=>red, 1=>green, 2=>blue, 3=>interleaved, 4=>alpha)
+
+    Returns:
+        bytes: the hidden message, b'' if there is none or the image has no such channel,
+            or None if the header claims more bytes than the image holds
+    '''
+    values = bytearray()
+    try:
+        rows = png_rows(png_file)
+
+        def read_values(start:int, count:int) -> bytes:
+            while len(values) < start + count:
+                row = next(rows, None)
+                if row is None:
+                    break
+                values.extend((row[:, :3] if channel_index == INTERLEAVED else row[:, channel_band(channel_index)]).tobytes())
+            return bytes(values[start:start + count])
+
+        fixed_header = values_to_bytes(read_values(0, FIXED_HEADER_BYTES*8))
+        if is_binary_header(fixed_header, ROW_LAYOUT_VERSION):
+            return read_binary_message(read_values, fixed_header, channel_index)
+    except (ValueError, IndexError, zlib.error):
+        pass
+    png_file.seek(0)
+    with PIL_Image.open(png_file) as image:
+        image = carrier_image(image)
+        if channel_index not in carrier_channels(image):
+            return b''
+        return decode_image_bytes(image, channel_index)
+
+def row_layout_image(data:bytes, width:int, length:int, channel_index:int) -> PIL_Image:
+    '''
+    Test helper. Builds a random image holding the data in the lowest bit of each value,
+    in row by row order
+    '''
+    pixels = np.random.default_rng(7).integers(0, 256, (length, width, 3), dtype=np.uint8)
+    values = pixels.reshape(-1) if channel_index == INTERLEAVED else pixels[:, :, channel_index].reshape(-1)
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+    values[:len(bits)] = (values[:len(bits)] & 0xFE) | bits
+    if channel_index != INTERLEAVED:
+        pixels[:, :, channel_index] = values.reshape(length, width)
+    return PIL_Image.fromarray(pixels, "RGB")
+
+stream_test_file = io.BytesIO(png_bytes(row_layout_image(build_header(5, build_flags(1), ROW_LAYOUT_VERSION) + b"Fast!", 600, 600, 1)))
+assert_equal(decode_png_stream(stream_test_file, 1) == b"Fast!", True)
+assert_equal(stream_test_file.tell() < len(stream_test_file.getvalue()) // 4, True)
+stream_test_file = io.BytesIO(png_bytes(row_layout_image(build_header(3, build_flags(INTERLEAVED), ROW_LAYOUT_VERSION) + b"RGB",
+                                                         30, 20, INTERLEAVED).convert("RGBA")))
+assert_equal(decode_png_stream(stream_test_file, INTERLEAVED) == b"RGB", True)
+assert_equal(decode_png_stream(io.BytesIO(png_bytes(row_layout_image(build_header(500, 0, ROW_LAYOUT_VERSION), 30, 20, 0))), 0), None)
+assert_equal(decode_png_stream(io.BytesIO(png_bytes(stream_test_image)), 0) == b'', True)
+assert_equal(decode_png_stream(io.BytesIO(png_bytes(row_layout_image(b"002Hi", 30, 20, 0).transpose(PIL_Image.Transpose.TRANSPOSE))), 0) == b"Hi", True)
+try:
+    decode_png_stream(io.BytesIO(png_bytes(stream_test_image.convert("P"))), 0)
+    stream_test_error = ''
+except ValueError as error:
+    stream_test_error = str(error)
+assert_equal(stream_test_error, PALETTE_ERROR)
+stream_test_alpha = row_layout_image(build_header(5, 0, ROW_LAYOUT_VERSION) + b"Alpha", 30, 20, 0).getchannel(0)
+stream_test_file = io.BytesIO(png_bytes(PIL_Image.merge("RGBA", [*stream_test_image.crop((0, 0, 30, 20)).split(), stream_test_alpha])))
+assert_equal(decode_png_stream(stream_test_file, ALPHA) == b"Alpha", True)
+assert_equal(decode_png_stream(stream_test_file, 0) == b'', True)
+stream_test_alpha = row_layout_image(b"003Hi!", 20, 30, 0).getchannel(0).transpose(PIL_Image.Transpose.TRANSPOSE)
+stream_test_file = io.BytesIO(png_bytes(PIL_Image.merge("RGBA", [*stream_test_image.crop((0, 0, 30, 20)).split(), stream_test_alpha])))
+assert_equal(decode_png_stream(stream_test_file, ALPHA) == b"Hi!", True)
+assert_equal(decode_png_stream(io.BytesIO(png_bytes(stream_test_image)), ALPHA) == b'', True)
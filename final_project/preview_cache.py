@@ -0,0 +1,107 @@
+from bakery import assert_equal
+from PIL import Image as PIL_Image
+from PIL import ImageOps
+from collections import OrderedDict
+from drafter import PageContent
+import base64
+import io
+
+# Previews are scaled down to fit in this box
+PREVIEW_SIZE = (480, 480)
+
+class PreviewImage(PageContent):
+    '''
+    Drafter page content for an image that has already been encoded as a PNG data url.
+    The drafter Image element re-saves a PIL image as a PNG every time the page renders,
+    and treats a string as a file in the images folder, so this renders the cached url as is.
+
+    Args:
+        url (str): a data:image/png;base64 url
+    '''
+    def __init__(self, url:str):
+        self.url = url
+
+    def __str__(self) -> str:
+        return f"<img src='{self.url}'>"
+
+class PreviewCache():
+    '''
+    Keeps a downscaled PNG preview of each uploaded image, keyed by the image store handle
+    (the content hash of the upload). The preview is scaled and encoded once, the first time
+    the image is shown, and every later page render reuses the same data url.
+
+    Args:
+        max_entries (int): the most previews to keep; the least recently used one is dropped first
+        previews (OrderedDict): handle -> data url, least recently used first
+    '''
+    def __init__(self, max_entries:int):
+        self.max_entries = max_entries
+        self.previews = OrderedDict()
+
+    def get(self, handle:str) -> str:
+        '''
+        Returns the cached preview for a handle
+
+        Args:
+            handle (str): the image store handle
+
+        Returns:
+            str: the preview data url, or None if it hasn't been built yet
+        '''
+        if handle not in self.previews:
+            return None
+        self.previews.move_to_end(handle)
+        return self.previews[handle]
+
+    def add(self, handle:str, image:PIL_Image) -> str:
+        '''
+        Builds, caches and returns the preview for an image
+
+        Args:
+            handle (str): the image store handle
+            image (PIL_Image): the full size image
+
+        Returns:
+            str: the preview data url
+        '''
+        self.previews[handle] = preview_url(image)
+        while len(self.previews) > self.max_entries:
+            self.previews.popitem(last=False)
+        return self.previews[handle]
+
+def preview_url(image:PIL_Image) -> str:
+    '''
+    Scales an image down to fit in PREVIEW_SIZE (images that already fit are left
+    alone) and returns it as a PNG data url
+
+    Args:
+        image (PIL_Image): the full size image
+
+    Returns:
+        str: a data:image/png;base64 url of the preview
+    '''
+    width, length = image.size
+    if width > PREVIEW_SIZE[0] or length > PREVIEW_SIZE[1]:
+        image = ImageOps.contain(image, PREVIEW_SIZE)
+    image_data = io.BytesIO()
+    image.save(image_data, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(image_data.getvalue()).decode("ascii")
+
+def url_image_size(url:str) -> tuple:
+    '''
+    Test helper. Opens a PNG data url and returns the image size
+    '''
+    return PIL_Image.open(io.BytesIO(base64.b64decode(url.split(",")[1]))).size
+
+assert_equal(url_image_size(preview_url(PIL_Image.new("RGB", (1000, 500)))), (480, 240))
+assert_equal(url_image_size(preview_url(PIL_Image.new("RGB", (300, 2400)))), (60, 480))
+assert_equal(url_image_size(preview_url(PIL_Image.new("RGB", (20, 10)))), (20, 10))
+preview_test = PreviewCache(2)
+assert_equal(preview_test.get("a"), None)
+preview_test_url = preview_test.add("a", PIL_Image.new("RGB", (20, 10)))
+assert_equal(preview_test.get("a") is preview_test_url, True)
+preview_test.add("b", PIL_Image.new("RGB", (20, 10)))
+preview_test.get("a")
+preview_test.add("c", PIL_Image.new("RGB", (20, 10)))
+assert_equal(list(preview_test.previews), ["a", "c"])
+assert_equal(str(PreviewImage("data:image/png;base64,AAAA")), "<img src='data:image/png;base64,AAAA'>")
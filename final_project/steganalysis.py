@@ -0,0 +1,262 @@
+from bakery import assert_equal
+from PIL import Image as PIL_Image
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import argparse
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+from batch import find_images
+from decoder import decode_chars, is_length_header, values_to_bytes
+from encoder import encode_message
+from header import ALPHA, FIXED_HEADER_BYTES, FRAME_LAYOUT_VERSION, HEADER_VERSION, INTERLEAVED, ROW_LAYOUT_VERSION, channel_band, is_binary_header
+from upload import carrier_image
+
+# Names of the bands whose LSB planes are tested, in the order of the results
+BAND_NAMES = {0: "red", 1: "green", 2: "blue", ALPHA: "alpha"}
+# The chi-square test is run on this many growing prefixes of the values in column order,
+# since a message written in order only changes the first of them
+CHI_SQUARE_SEGMENTS = 16
+# Pairs of values expected fewer times than this are left out of the chi-square sum
+MIN_EXPECTED = 5
+# The old header is 3 ASCII digits, 8 values each
+LEGACY_HEADER_VALUES = 3*8
+
+def chi_square_probability(values:np.ndarray) -> float:
+    '''
+    Runs the pairs of values chi-square test on the LSB plane of one band. Replacing the
+    lowest bits with message bits makes each pair of values that only differ in the lowest
+    bit (2i and 2i+1) about equally common, which natural images rarely are. The test is
+    run on CHI_SQUARE_SEGMENTS growing prefixes of the values, counted with one bincount
+    per segment, and the highest probability is kept, so a short message at the start of
+    the image is found as well as one filling it. scipy isn't a dependency, so the chi-square
+    tail uses the Wilson-Hilferty normal approximation
+
+    Args:
+        values (np.ndarray): the band's values in column by column order, as uint8
+
+    Returns:
+        float: the probability (0 to 1) that the lowest bits are random, 0 if there are too few values to tell
+    '''
+    bounds = np.linspace(0, len(values), CHI_SQUARE_SEGMENTS + 1).astype(int)
+    counts = np.array([np.bincount(values[start:end], minlength=256)
+                       for start, end in zip(bounds[:-1], bounds[1:])]).cumsum(axis=0)
+    expected = (counts[:, 0::2] + counts[:, 1::2]) / 2
+    used = expected >= MIN_EXPECTED
+    terms = np.where(used, (counts[:, 0::2] - expected)**2 / np.where(used, expected, 1), 0)
+    probability = 0.0
+    for chi_square, freedom in zip(terms.sum(axis=1), used.sum(axis=1) - 1):
+        if freedom < 1:
+            continue
+        spread = 2 / (9*freedom)
+        z = ((chi_square / freedom)**(1/3) - (1 - spread)) / math.sqrt(spread)
+        probability = max(probability, 0.5*math.erfc(z / math.sqrt(2)))
+    return probability
+
+def sample_pair_rate(band:np.ndarray) -> float:
+    '''
+    Estimates the share of the band's values whose lowest bit was replaced, with sample pair
+    analysis on horizontally neighbouring values. In a natural image a pair (u, v) with v even
+    is about as likely to have u < v as a pair with v odd is to have u > v; replacing lowest bits
+    moves values between those sets by a known amount, which gives a quadratic in the rate
+
+    Args:
+        band (np.ndarray): the band as a (height, width) uint8 array
+
+    Returns:
+        float: the estimated embedding rate, from 0 (nothing hidden) to 1 (every lowest bit replaced)
+    '''
+    left = band[:, :-1].astype(np.int16).ravel()
+    right = band[:, 1:].astype(np.int16).ravel()
+    even = right % 2 == 0
+    x = np.count_nonzero((even & (left < right)) | (~even & (left > right)))
+    y = np.count_nonzero((even & (left > right)) | (~even & (left < right)))
+    z = np.count_nonzero(left == right)
+    w = np.count_nonzero(((left >> 1) == (right >> 1)) & (left != right))
+    a = (w + z) / 2
+    b = 2*x - left.size
+    c = y - x
+    if a == 0:
+        return 0.0
+    discriminant = b*b - 4*a*c
+    if discriminant < 0:
+        return 1.0
+    roots = [(-b + math.sqrt(discriminant)) / (2*a), (-b - math.sqrt(discriminant)) / (2*a)]
+    return float(min(1.0, max(0.0, min(roots, key=abs))))
+
+steganalysis_test_rng = np.random.default_rng(0)
+steganalysis_test_y, steganalysis_test_x = np.mgrid[0:120, 0:160]
+# A smooth cover whose values are multiples of 3, like a scaled image, so its pairs of values are uneven
+steganalysis_test_band = (np.clip(128 + 60*np.sin(steganalysis_test_x/17) + 40*np.cos(steganalysis_test_y/11)
+                                  + steganalysis_test_rng.normal(0, 3, (120, 160)), 0, 255) / 3).astype(np.uint8)*3
+steganalysis_test_full = steganalysis_test_band & 0xFE | steganalysis_test_rng.integers(0, 2, (120, 160), dtype=np.uint8)
+steganalysis_test_half = steganalysis_test_band.copy()
+steganalysis_test_half[:, :80] = steganalysis_test_full[:, :80]
+assert_equal(chi_square_probability(steganalysis_test_band.T.ravel()) < 0.05, True)
+assert_equal(chi_square_probability(steganalysis_test_full.T.ravel()) > 0.5, True)
+assert_equal(chi_square_probability(steganalysis_test_half.T.ravel()) > 0.5, True)
+assert_equal(chi_square_probability(np.zeros(10, dtype=np.uint8)), 0.0)
+assert_equal(sample_pair_rate(steganalysis_test_band) < 0.1, True)
+assert_equal(sample_pair_rate(steganalysis_test_full) > 0.9, True)
+assert_equal(0.2 < sample_pair_rate(steganalysis_test_half) < 0.7, True)
+assert_equal(sample_pair_rate(np.zeros((4, 4), dtype=np.uint8)), 0.0)
+
+def header_found(column_values:np.ndarray, row_values:np.ndarray) -> bool:
+    '''
+    Checks whether a channel starts with a message header: the first LEGACY_HEADER_VALUES values
+    in column order parse as the old 3 digit decoder.get_message_length header, or start a binary
+    header in column order (HEADER_VERSION or FRAME_LAYOUT_VERSION) or row order (ROW_LAYOUT_VERSION).
+    Keyed messages have no header at the start and are left to the statistics
+
+    Args:
+        column_values (np.ndarray): at least the first LEGACY_HEADER_VALUES values in column by column order
+        row_values (np.ndarray): at least the first FIXED_HEADER_BYTES*8 values in row by row order
+
+    Returns:
+        bool: True if a header was found
+    '''
+    legacy = decode_chars(column_values[:LEGACY_HEADER_VALUES].tobytes(), LEGACY_HEADER_VALUES // 8)
+    if is_length_header(legacy):
+        return True
+    fixed_header = values_to_bytes(column_values[:FIXED_HEADER_BYTES*8].tobytes())
+    if is_binary_header(fixed_header, HEADER_VERSION) or is_binary_header(fixed_header, FRAME_LAYOUT_VERSION):
+        return True
+    return is_binary_header(values_to_bytes(row_values[:FIXED_HEADER_BYTES*8].tobytes()), ROW_LAYOUT_VERSION)
+
+def analyze_image(image:PIL_Image) -> dict:
+    '''
+    Runs the chi-square and sample pair tests on the LSB plane of every band of an image and
+    looks for a header at the start of every channel, interleaved included. The pixels are
+    read into one array, which every test slices. The score ranks images for a closer look:
+    the strongest sign of embedding in any band, plus 1 if a header was found
+
+    Args:
+        image (PIL_Image): an RGB or RGBA image
+
+    Returns:
+        dict: the "score", whether a "header" was found, and the "chi_square" probability
+            and "sample_pairs" rate of each band by name
+    '''
+    pixels = np.asarray(image)
+    bands = [0, 1, 2, ALPHA] if image.mode == "RGBA" else [0, 1, 2]
+    result = {"score": 0.0, "header": False}
+    for channel in bands:
+        band = pixels[:, :, channel_band(channel)]
+        column_values = band.T.ravel()
+        statistics = {"chi_square": chi_square_probability(column_values), "sample_pairs": sample_pair_rate(band)}
+        result[BAND_NAMES[channel]] = statistics
+        result["score"] = max(result["score"], *statistics.values())
+        result["header"] = result["header"] or header_found(column_values, band.ravel())
+    interleaved = pixels[:, :, :3]
+    result["header"] = result["header"] or header_found(interleaved[:, :3].transpose(1, 0, 2).ravel(),
+                                                        interleaved[:3].ravel())
+    if result["header"]:
+        result["score"] += 1
+    return result
+
+steganalysis_test_pixels = np.dstack([steganalysis_test_band, np.roll(steganalysis_test_band, 40, axis=1), 255 - steganalysis_test_band])
+steganalysis_test_image = PIL_Image.fromarray(steganalysis_test_pixels, "RGB")
+steganalysis_test_result = analyze_image(steganalysis_test_image)
+assert_equal(steganalysis_test_result["header"], False)
+assert_equal(steganalysis_test_result["score"] < 0.1, True)
+assert_equal(sorted(steganalysis_test_result), ["blue", "green", "header", "red", "score"])
+steganalysis_test_encoded = analyze_image(encode_message(steganalysis_test_image, b"Hi", 1))
+assert_equal(steganalysis_test_encoded["header"], True)
+assert_equal(steganalysis_test_encoded["score"] > 1, True)
+assert_equal(analyze_image(encode_message(steganalysis_test_image, b"Hi", INTERLEAVED, 1, ROW_LAYOUT_VERSION))["header"], True)
+steganalysis_test_legacy = steganalysis_test_pixels.copy()
+steganalysis_test_legacy[:LEGACY_HEADER_VALUES, 0, 2] = steganalysis_test_legacy[:LEGACY_HEADER_VALUES, 0, 2] & 0xFE | np.unpackbits(np.frombuffer(b"042", dtype=np.uint8))
+assert_equal(analyze_image(PIL_Image.fromarray(steganalysis_test_legacy, "RGB"))["header"], True)
+steganalysis_test_legacy[:LEGACY_HEADER_VALUES, 0, 2] = steganalysis_test_legacy[:LEGACY_HEADER_VALUES, 0, 2] & 0xFE | np.unpackbits(np.frombuffer(b"1\xc2\xb2", dtype=np.uint8))
+assert_equal(analyze_image(PIL_Image.fromarray(steganalysis_test_legacy, "RGB"))["header"], False)
+steganalysis_test_alpha = np.dstack([steganalysis_test_pixels, steganalysis_test_full])
+steganalysis_test_result = analyze_image(PIL_Image.fromarray(steganalysis_test_alpha, "RGBA"))
+assert_equal(steganalysis_test_result["alpha"]["sample_pairs"] > 0.9, True)
+assert_equal(steganalysis_test_result["red"]["sample_pairs"] < 0.1, True)
+
+def analyze_file(image_path:str) -> dict:
+    '''
+    Runs analyze_image on one image file. Runs in a worker process, so any error is
+    returned in the result instead of stopping the whole scan
+
+    Args:
+        image_path (str): the PNG to analyze
+
+    Returns:
+        dict: the image path and the analyze_image result, or an error if the image couldn't be read
+    '''
+    result = {"image": image_path}
+    try:
+        with PIL_Image.open(image_path) as image:
+            result.update(analyze_image(carrier_image(image)))
+    except Exception as error:
+        result["error"] = str(error)
+    return result
+
+def scan_images(image_paths:list[str], workers:int=None, chunksize:int=0) -> list[dict]:
+    '''
+    Runs analyze_file over every image on a pool of worker processes, handing the paths
+    to the workers in chunks like batch.run_tasks, and ranks the results
+
+    Args:
+        image_paths (list[str]): the images to analyze
+        workers (int): how many worker processes to use, one per CPU if None,
+                    or 1 to analyze every image in this process
+        chunksize (int): how many images to hand a worker at once, or 0 to pick one that
+                    gives every worker about four chunks
+
+    Returns:
+        list[dict]: the analyze_file results, highest score first, then the images that
+            couldn't be read, in path order
+    '''
+    if workers == 1:
+        results = list(map(analyze_file, image_paths))
+    else:
+        if not chunksize:
+            chunksize = max(1, len(image_paths) // ((workers or os.cpu_count())*4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(analyze_file, image_paths, chunksize=chunksize))
+    return sorted(results, key=lambda result: ("error" in result, -result.get("score", 0)))
+
+def main(arguments:list[str]) -> int:
+    '''
+    The command line entry point.
+        python steganalysis.py --output ranked.jsonl FOLDER [--workers 8] [--chunksize 0]
+
+    Args:
+        arguments (list[str]): the command line arguments, without the program name
+
+    Returns:
+        int: the exit status, 1 if any image failed
+    '''
+    parser = argparse.ArgumentParser(description="Rank every PNG in a folder by how likely it is to hide a message.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes (default: one per CPU)")
+    parser.add_argument("--chunksize", type=int, default=0, help="images handed to a worker at once (default: automatic)")
+    # A file rather than standard output, since the inline tests print as each module is imported
+    parser.add_argument("--output", required=True, help="JSON lines results file, most suspicious image first")
+    parser.add_argument("folder", help="the folder to scan, subfolders included")
+    options = parser.parse_args(arguments)
+    results = scan_images(find_images(options.folder), options.workers, options.chunksize)
+    with open(options.output, "w", encoding="utf-8") as output_file:
+        for result in results:
+            output_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+    return 1 if any("error" in result for result in results) else 0
+
+steganalysis_test_folder = tempfile.mkdtemp()
+steganalysis_test_image.save(os.path.join(steganalysis_test_folder, "plain.png"))
+encode_message(steganalysis_test_image, b"Hi", 1).save(os.path.join(steganalysis_test_folder, "header.png"))
+PIL_Image.fromarray(steganalysis_test_alpha, "RGBA").save(os.path.join(steganalysis_test_folder, "alpha.png"))
+with open(os.path.join(steganalysis_test_folder, "broken.png"), "w") as broken:
+    broken.write("not an image")
+steganalysis_test_results = scan_images(find_images(steganalysis_test_folder), workers=1)
+assert_equal([os.path.basename(result["image"]) for result in steganalysis_test_results],
+             ["header.png", "alpha.png", "plain.png", "broken.png"])
+assert_equal("error" in steganalysis_test_results[3], True)
+assert_equal(json.loads(json.dumps(steganalysis_test_results[1]))["alpha"]["sample_pairs"] > 0.9, True)
+shutil.rmtree(steganalysis_test_folder)
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,132 @@
+from bakery import assert_equal
+from PIL import Image as PIL_Image
+import io
+import struct
+import tempfile
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# The signature, then the IHDR chunk's length and type, then its width, height, bit depth and color type
+PNG_START_BYTES = 26
+PALETTE_COLOR_TYPE = 3
+# Modes whose bands are used as they are; anything else is converted to RGB
+NATIVE_MODES = ("RGB", "RGBA")
+PALETTE_ERROR = "Palette (indexed color) images can't hide a message. Save it as an RGB or RGBA PNG."
+UPLOAD_CHUNK_BYTES = 64*1024
+# Uploads bigger than this are spooled to a temporary file instead of kept in memory
+SPOOL_MEMORY_BYTES = 1024*1024
+MAX_UPLOAD_BYTES = 50*1024*1024
+MAX_IMAGE_PIXELS = 40*1000*1000
+
+def png_dimensions(start:bytes) -> tuple:
+    '''
+    Consumes the first bytes of a file and returns the width and height from its
+    PNG header, without decoding any pixels
+
+    Args:
+        start (bytes): at least the first PNG_START_BYTES bytes of the file
+
+    Returns:
+        tuple: (width, height), or None if the bytes are not the start of a PNG
+    '''
+    if len(start) < PNG_START_BYTES or not start.startswith(PNG_SIGNATURE) or start[12:16] != b"IHDR":
+        return None
+    return struct.unpack(">II", start[16:24])
+
+def png_start(width:int, length:int, color_type:int=2) -> bytes:
+    '''
+    Test helper. Returns the signature and the start of an IHDR chunk for the given size and color type
+    '''
+    return PNG_SIGNATURE + struct.pack(">I", 13) + b"IHDR" + struct.pack(">IIBB", width, length, 8, color_type)
+
+assert_equal(png_dimensions(png_start(300, 200)), (300, 200))
+assert_equal(png_dimensions(png_start(300, 200)[:24]), None)
+assert_equal(png_dimensions(b"GIF89a" + bytes(30)), None)
+assert_equal(png_dimensions(PNG_SIGNATURE + struct.pack(">I", 13) + b"IDAT" + bytes(8)), None)
+
+def read_upload(upload_file, max_bytes:int=MAX_UPLOAD_BYTES, max_pixels:int=MAX_IMAGE_PIXELS) -> tuple:
+    '''
+    Reads an uploaded file in chunks into a spooled temporary file, which stays in memory
+    while it is small and moves to disk when it grows. The PNG signature and IHDR size are
+    checked from the first chunk, and the upload is abandoned as soon as it goes over
+    max_bytes, so a huge or non PNG upload is rejected before it is fully read and before
+    any pixel memory is allocated. Palette images are rejected the same way, from the
+    color type in the IHDR chunk.
+
+    Args:
+        upload_file: the uploaded file object, read with .read(size)
+        max_bytes (int): the largest file size to accept
+        max_pixels (int): the largest width*height to accept
+
+    Returns:
+        tuple: (the spooled file rewound to the start, '') if the upload is accepted,
+            (None, '') if nothing was uploaded, or (None, an error message) if it was rejected
+    '''
+    start = upload_file.read(UPLOAD_CHUNK_BYTES)
+    if not start:
+        return (None, '')
+    while len(start) < PNG_START_BYTES:
+        chunk = upload_file.read(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            break
+        start += chunk
+    dimensions = png_dimensions(start)
+    if dimensions is None:
+        return (None, "The uploaded file is not a PNG image.")
+    width, length = dimensions
+    if width*length > max_pixels:
+        return (None, f"The image is {width}x{length}, which is more than {max_pixels} pixels.")
+    if start[25] == PALETTE_COLOR_TYPE:
+        return (None, PALETTE_ERROR)
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+    total = 0
+    chunk = start
+    while chunk:
+        total += len(chunk)
+        if total > max_bytes:
+            spooled.close()
+            return (None, f"The file is larger than {max_bytes // (1024*1024)} MB.")
+        spooled.write(chunk)
+        chunk = upload_file.read(UPLOAD_CHUNK_BYTES)
+    spooled.seek(0)
+    return (spooled, '')
+
+upload_test_file, upload_test_error = read_upload(io.BytesIO(png_start(10, 10) + bytes(1000)))
+assert_equal(len(upload_test_file.read()), 1026)
+assert_equal(upload_test_error, '')
+assert_equal(read_upload(io.BytesIO(b"")), (None, ''))
+assert_equal(read_upload(io.BytesIO(b"not a png at all, just some text")), (None, "The uploaded file is not a PNG image."))
+assert_equal(read_upload(io.BytesIO(png_start(10000, 10000))), (None, "The image is 10000x10000, which is more than 40000000 pixels."))
+assert_equal(read_upload(io.BytesIO(png_start(10, 10) + bytes(3*1024*1024)), max_bytes=2*1024*1024),
+             (None, "The file is larger than 2 MB."))
+assert_equal(read_upload(io.BytesIO(png_start(10, 10, PALETTE_COLOR_TYPE) + bytes(1000))), (None, PALETTE_ERROR))
+assert_equal(read_upload(io.BytesIO(png_start(10, 10, 6) + bytes(1000)))[1], '')
+
+def carrier_image(image:PIL_Image) -> PIL_Image:
+    '''
+    Returns the image messages are written into and read from. RGB and RGBA images are
+    loaded and used in their own mode, so no converted copy of the pixels is made and the
+    alpha band of an RGBA image can carry a message too. Pillow already reads 16 bit color
+    PNGs as 8 bit RGB; grayscale images are converted to RGB, as every image used to be
+
+    Args:
+        image (PIL_Image): the opened image
+
+    Returns:
+        PIL_Image: an RGB or RGBA image
+
+    Raises:
+        ValueError: PALETTE_ERROR for a palette image, whose values are indexes
+            into a color table rather than colors
+    '''
+    if image.mode in ("P", "PA"):
+        raise ValueError(PALETTE_ERROR)
+    if image.mode in NATIVE_MODES:
+        image.load()
+        return image
+    return image.convert('RGB')
+
+assert_equal(carrier_image(PIL_Image.new("RGBA", (4, 4))).mode, "RGBA")
+assert_equal(carrier_image(PIL_Image.new("RGB", (4, 4))).mode, "RGB")
+assert_equal(carrier_image(PIL_Image.new("L", (4, 4), 7)).getpixel((0, 0)), (7, 7, 7))
+carrier_test_image = PIL_Image.new("RGB", (4, 4))
+assert_equal(carrier_image(carrier_test_image) is carrier_test_image, True)